@@ -0,0 +1,76 @@
+'''Bytes per AST node for the slotted node classes, against dict-backed twins
+of the same classes with a fresh scalar type object per expression (the
+layout before nodes were slotted and scalar types interned).
+
+usage: python bench/bench_ast_memory.py [--stmts N]
+'''
+import argparse
+import tracemalloc
+from dataclasses import fields, make_dataclass
+from common import row
+from tokenizer import RegexTokenizer
+from parser import Parser
+from traverse import TRAVERSAL, iter_tree
+from lib.ast import Span
+from lib.types import ScalarType
+
+STMTS = [
+  'x{i} := a + {i} * (b - -a);\n',
+  'if (a < {i}) {{\n  y{i} := [a, b, {i}];\n  while (b > 0) {{ b = b - y{i}[1]; }}\n}}\n',
+  'try {{ a = a + 1; }} catch {{ b = b * 2; }}\n',
+]
+
+def generate(stmts: int) -> str:
+  parts = ['in {\n  low a: int;\n  low b: int;\n}\nout {}\n']
+  parts.extend(STMTS[i % len(STMTS)].format(i=i) for i in range(stmts))
+  return ''.join(parts)
+
+def parse(src: str):
+  tokenizer = RegexTokenizer(src)
+  tokenizer.tokenize()
+  return Parser(tokenizer.buffer).parse()
+
+def dict_twin(cls: type) -> type:
+  return make_dataclass(cls.__name__, [f.name for f in fields(cls)])
+
+DICT_TWINS = {cls: dict_twin(cls) for cls in [*TRAVERSAL, Span]}
+DictScalar = make_dataclass('DictScalar', [])
+
+def copy_tree(value, twins: dict[type, type]|None):
+  '''Deep-copy the nodes, spans and lists of a tree, either into the same
+  classes or into the dict-backed twins with un-interned scalar types.'''
+  match value:
+    case list():
+      return [copy_tree(v, twins) for v in value]
+    case ScalarType():
+      return value if twins is None else DictScalar()
+    case _ if type(value) in DICT_TWINS:
+      cls = type(value) if twins is None else twins[type(value)]
+      return cls(*[copy_tree(getattr(value, f.name), twins) for f in fields(value)])
+    case _:
+      return value
+
+def traced(fn) -> tuple[object, int]:
+  tracemalloc.start()
+  result = fn()
+  size = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  return result, size
+
+def main():
+  argp = argparse.ArgumentParser(description=__doc__)
+  argp.add_argument('--stmts', type=int, default=20_000)
+  args = argp.parse_args()
+
+  ast = parse(generate(args.stmts))
+  nodes = sum(1 for _ in iter_tree(ast))
+  # both copies allocate the same lists, so the difference is the layout
+  _, dicts = traced(lambda: copy_tree(ast, DICT_TWINS))
+  _, slotted = traced(lambda: copy_tree(ast, None))
+  print(f'{nodes} nodes')
+  row('layout', 'total KiB', 'bytes/node')
+  row('dict-backed', f'{dicts / 1024:.0f}', f'{dicts / nodes:.0f}')
+  row('slotted', f'{slotted / 1024:.0f}', f'{slotted / nodes:.0f}')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,59 @@
+'''Loading a binary AST against getting the same tree from source.
+
+`tokenize+parse` is the cheapest way to get a tree from source, and an
+untyped one; `front end` adds the passes up to type checking, which the
+binary AST has already been through.
+
+usage: python bench/bench_astfile.py [--stmts N,N,...] [--repeat N]
+'''
+import argparse
+import os
+import tempfile
+from common import best_of, row
+from tokenizer import RegexTokenizer
+from parser import Parser
+from passes import PassManager
+from symbolize import symbolize
+from type_check import type_annotate, type_check
+from lib.ast import SourceFile
+from lib.astfile import dump_ast, load_ast
+
+STMTS = [
+  'x{i} := a + {i} * (b - -a);\n',
+  'if (a < {i}) {{\n  y{i} := [a, b, {i}];\n  while (b > 0) {{ b = b - y{i}[1]; }}\n}}\n',
+  'try {{ a = a + 1; }} catch {{ b = b * 2; }}\n',
+  'fn f{i}(p: int) int {{\n  if (p > {i}) {{ return p; }}\n  return a;\n}}\nb = f{i}(b);\n',
+]
+
+def generate(stmts: int) -> str:
+  parts = ['in {\n  low a: int;\n  low b: int;\n}\nout {}\n']
+  parts.extend(STMTS[i % len(STMTS)].format(i=i) for i in range(stmts))
+  return ''.join(parts)
+
+def parse(src: SourceFile):
+  tokenizer = RegexTokenizer(src)
+  tokenizer.tokenize()
+  return Parser(tokenizer.buffer).parse()
+
+def front_end(src: SourceFile):
+  return PassManager([symbolize, type_annotate, type_check]).run(parse(src))
+
+def main():
+  argp = argparse.ArgumentParser(description=__doc__)
+  argp.add_argument('--stmts', default='1000,10000,50000')
+  argp.add_argument('--repeat', type=int, default=3)
+  args = argp.parse_args()
+
+  row('statements', 'KiB', 'tok+parse ms', 'front end ms', 'load ms')
+  with tempfile.TemporaryDirectory() as tmpdir:
+    path = os.path.join(tmpdir, 'ast')
+    for stmts in map(int, args.stmts.split(',')):
+      src = SourceFile(generate(stmts))
+      dump_ast(front_end(src), path)
+      row(stmts, f'{os.path.getsize(path) / 1024:.0f}',
+          f'{best_of(lambda: parse(src), args.repeat) * 1000:.1f}',
+          f'{best_of(lambda: front_end(src), args.repeat) * 1000:.1f}',
+          f'{best_of(lambda: load_ast(path), args.repeat) * 1000:.1f}')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,58 @@
+'''Flow analysis time on chains of function calls.
+
+`chain` has every function call the next one once, `fanout` has every
+function call the next one twice: analyzing bodies again at every call site
+is linear in the depth for the former and exponential for the latter.
+`recursive` also has every function call itself.
+
+usage: python bench/bench_calls.py [--depths N,N,...] [--repeat N]
+'''
+import argparse
+from common import best_of, row
+from tokenizer import RegexTokenizer
+from parser import Parser
+from symbolize import symbolize
+from type_check import type_annotate, type_check
+from flow_analysis import flow_analysis, SecurityContext, LOW
+from lib.ast import SymTab
+
+HEADER = 'in {\n  high h: int;\n  low l: int;\n}\nout {\n  low o: int;\n}\n'
+
+SHAPES = {
+  'chain': 'fn f{i}(a: int, b: int) int {{\n  c := a + 1;\n  if (b < c) {{ c = c * b; }}\n  return c + f{n}(b, a);\n}}\n',
+  'fanout': 'fn f{i}(a: int, b: int) int {{\n  c := f{n}(a, b);\n  return c + f{n}(b, a);\n}}\n',
+  'recursive': 'fn f{i}(a: int, b: int) int {{\n  if (a > 0) {{ return f{i}(b, a - 1); }}\n  return f{n}(a, b);\n}}\n',
+}
+LEAF = 'fn f{i}(a: int, b: int) int {{\n  return a + b;\n}}\n'
+
+def generate(shape: str, depth: int) -> str:
+  # functions are defined callee first
+  parts = [HEADER, LEAF.format(i=depth)]
+  parts.extend(SHAPES[shape].format(i=i, n=i + 1) for i in reversed(range(depth)))
+  parts.append('o = f0(l, l);\n')
+  return ''.join(parts)
+
+def build(src: str):
+  tokenizer = RegexTokenizer(src)
+  tokenizer.tokenize()
+  ast = Parser(tokenizer.buffer).parse()
+  ast = symbolize(ast, SymTab())
+  return type_check(type_annotate(ast))
+
+def analyze(ast):
+  flow_analysis(ast, LOW, SecurityContext())
+
+def main():
+  argp = argparse.ArgumentParser(description=__doc__)
+  argp.add_argument('--depths', default='10,100,1000')
+  argp.add_argument('--repeat', type=int, default=3)
+  args = argp.parse_args()
+
+  row('shape', 'depth', 'flow ms')
+  for shape in SHAPES:
+    for depth in map(int, args.depths.split(',')):
+      ast = build(generate(shape, depth))
+      row(shape, depth, f'{best_of(lambda: analyze(ast), args.repeat) * 1000:.2f}')
+
+if __name__ == '__main__':
+  main()
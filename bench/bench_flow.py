@@ -0,0 +1,83 @@
+'''Flow analysis time on programs full of branches and loops.
+
+`sequence` puts the branches one after another, `nested` puts each one
+inside the previous one. The front end still recurses per nesting level,
+which limits how deep `nested` can go. `array` runs loops that read and
+write a global array of the given length at known and unknown indices.
+
+usage: python bench/bench_flow.py [--sizes N,N,...] [--depths N,N,...] [--vars N,N,...]
+                                  [--lengths N,N,...] [--repeat N]
+'''
+import argparse
+from common import best_of, row
+from tokenizer import RegexTokenizer
+from parser import Parser
+from symbolize import symbolize
+from type_check import type_annotate, type_check
+from flow_analysis import flow_analysis, SecurityContext, LOW
+from lib.ast import SymTab
+from lib.utils import DIAGNOSTICS
+
+BRANCHES = [
+  'if (l < {i}) {{\n  x{v} = x{w} + {i};\n',
+  'while (l > {i}) {{\n  x{v} = x{w} * 2;\n',
+  'if (x{w} == {i}) {{\n  x{v} = 1;\n}} else {{\n  x{v} = l;\n',
+]
+
+def generate(shape: str, size: int, nvars: int) -> str:
+  parts = ['in {\n  low l: int;\n}\nout {}\n']
+  parts.extend(f'x{v} := l;\n' for v in range(nvars))
+  for i in range(size):
+    parts.append(BRANCHES[i % len(BRANCHES)].format(i=i, v=i % nvars, w=(i * 7 + 3) % nvars))
+    if shape == 'sequence':
+      parts.append('}\n')
+  if shape == 'nested':
+    parts.append('}\n' * size)
+  return ''.join(parts)
+
+ARRAY_LOOP = '''while (l > {i}) {{
+  x = x + buf[l];
+  buf[{j}] = x;
+  buf[l] = l;
+}}
+'''
+
+def generate_array(length: int, loops: int = 100) -> str:
+  parts = [f'in {{\n  low l: int;\n  high buf[{length}]: int;\n}}\nout {{}}\nx := 0;\n']
+  parts.extend(ARRAY_LOOP.format(i=i, j=i * 7919 % length) for i in range(loops))
+  return ''.join(parts)
+
+def build(src: str):
+  tokenizer = RegexTokenizer(src)
+  tokenizer.tokenize()
+  ast = Parser(tokenizer.buffer).parse()
+  ast = symbolize(ast, SymTab())
+  return type_check(type_annotate(ast))
+
+def analyze(ast):
+  # notes would be printed at exit, drop them
+  DIAGNOSTICS.reset('quiet')
+  flow_analysis(ast, LOW, SecurityContext())
+  DIAGNOSTICS.reset()
+
+def main():
+  argp = argparse.ArgumentParser(description=__doc__)
+  argp.add_argument('--sizes', default='100,1000,3000')
+  argp.add_argument('--depths', default='50,100,200')
+  argp.add_argument('--vars', default='50,10000')
+  argp.add_argument('--lengths', default='1000,100000,1000000')
+  argp.add_argument('--repeat', type=int, default=3)
+  args = argp.parse_args()
+
+  row('shape', 'variables', 'branches', 'flow ms')
+  for nvars in map(int, args.vars.split(',')):
+    for shape, sizes in [('sequence', args.sizes), ('nested', args.depths)]:
+      for size in map(int, sizes.split(',')):
+        ast = build(generate(shape, size, nvars))
+        row(shape, nvars, size, f'{best_of(lambda: analyze(ast), args.repeat) * 1000:.2f}')
+  for length in map(int, args.lengths.split(',')):
+    ast = build(generate_array(length))
+    row('array', length, 100, f'{best_of(lambda: analyze(ast), args.repeat) * 1000:.2f}')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,68 @@
+'''Keystroke-to-diagnostics latency of the language server.
+
+A file is opened, then edited one keystroke at a time in a function body,
+in a top-level statement and in its last statement, each time asking for
+the diagnostics of the whole file. `open` is the compile of the whole file
+when it is opened.
+
+usage: python bench/bench_lsp.py [--stmts N,N,...] [--keys N]
+'''
+import argparse
+import os
+import time
+from contextlib import redirect_stdout
+from statistics import median
+from bench_astfile import generate
+from common import row
+from lsp import Document
+from lib.ast import SourceFile
+
+def position(text: str, offset: int) -> dict:
+  src = SourceFile(text)
+  lnum = src.lnum_of(offset)
+  return {'line': lnum, 'character': offset - src.line_starts[lnum]}
+
+def type_at(doc: Document, offset: int, keys: str) -> list[float]:
+  '''Type `keys` at `offset`, then delete them again; seconds per keystroke.'''
+  times = []
+  edits = [(offset + idx, offset + idx, key) for idx, key in enumerate(keys)]
+  edits += [(offset + idx - 1, offset + idx, '') for idx in range(len(keys), 0, -1)]
+  for start, end, key in edits:
+    t = time.perf_counter()
+    doc.edit({'start': position(doc.text, start), 'end': position(doc.text, end)}, key)
+    doc.analyze()
+    doc.diagnostics()
+    times.append(time.perf_counter() - t)
+  return times
+
+def main():
+  argp = argparse.ArgumentParser(description=__doc__)
+  argp.add_argument('--stmts', default='1000,3500')
+  argp.add_argument('--keys', type=int, default=6)
+  args = argp.parse_args()
+
+  keys = ' + b * 2'[:args.keys]
+  row('statements', 'lines', 'open ms', 'fn body ms', 'stmt ms', 'last ms', 'worst ms')
+  # errors are printed on their way into the diagnostics
+  with open(os.devnull, 'w') as null, redirect_stdout(null):
+    rows = [measure(stmts, keys) for stmts in map(int, args.stmts.split(','))]
+  for cols in rows:
+    row(*cols)
+
+def measure(stmts: int, keys: str) -> list:
+  text = generate(stmts)
+  start = time.perf_counter()
+  doc = Document('file:///bench.pls', text, 0, 'utf-32')
+  doc.analyze()
+  opened = time.perf_counter() - start
+  middle = text.index('fn f', len(text) // 2)
+  body = text.index('return p', middle) + len('return p')
+  stmt = text.index(' := a + ', len(text) // 2) + len(' := a')
+  last = text.rindex(';')
+  times = [type_at(doc, offset, keys) for offset in (body, stmt, last)]
+  return [stmts, text.count('\n'), f'{opened * 1000:.1f}',
+          *(f'{median(ts) * 1000:.1f}' for ts in times),
+          f'{max(map(max, times)) * 1000:.1f}']
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,55 @@
+'''Parse throughput on long machine-generated expressions.
+
+usage: python bench/bench_parser.py [--terms N ...] [--repeat N]
+'''
+import argparse
+import sys
+from common import best_of, row
+from tokenizer import RegexTokenizer
+from parser import Parser
+
+def flat(n: int) -> str:
+  # a + b - a + b ...
+  return ' '.join(f'{"ab"[i % 2]} {"+-"[i % 2]}' for i in range(n - 1)) + ' a'
+
+def mixed(n: int) -> str:
+  # alternating precedence levels: a * b + a * b ...
+  return ' '.join(f'{"ab"[i % 2]} {"*+"[i % 2]}' for i in range(n - 1)) + ' b'
+
+def unary(n: int) -> str:
+  return '-' * (n - 1) + 'a'
+
+def parens(n: int) -> str:
+  return '(' * (n - 1) + 'a' + ' + a)' * (n - 1)
+
+SHAPES = {
+  'flat': flat,
+  'mixed': mixed,
+  'unary chain': unary,
+  'nested parens': parens,
+}
+
+def program(expr: str) -> str:
+  return f'in {{\n  low a: int;\n  low b: int;\n}}\nout {{}}\nx := {expr};\n'
+
+def parse(src: str):
+  tokenizer = RegexTokenizer(src)
+  tokenizer.tokenize()
+  return Parser(tokenizer.buffer).parse()
+
+def main():
+  argp = argparse.ArgumentParser(description=__doc__)
+  argp.add_argument('--terms', type=int, nargs='*', default=[10_000, 100_000])
+  argp.add_argument('--repeat', type=int, default=3)
+  args = argp.parse_args()
+
+  print(f'recursion limit: {sys.getrecursionlimit()}')
+  row('shape', 'terms', 'seconds', 'kterms/s')
+  for name, shape in SHAPES.items():
+    for terms in args.terms:
+      src = program(shape(terms))
+      secs = best_of(lambda: parse(src), args.repeat)
+      row(name, terms, f'{secs:.3f}', f'{terms / secs / 1000:.0f}')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,75 @@
+'''Cold start of the `palisade` command, in fresh processes.
+
+`python` is an interpreter that does nothing, the floor for everything else.
+`compile` has a cache of its own that starts out empty, so the first run
+compiles and the `cached` ones replay the report; `--no-cache` always
+compiles. The same commands are then run from a bundle (`palisade bundle`).
+
+With --imports, the modules a `compile --no-cache` imports are listed by
+the time spent in each, from `python -X importtime`.
+
+usage: python bench/bench_startup.py [--file F] [--repeat N] [--imports N]
+'''
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from common import ROOT, row
+from bundle import build_bundle
+
+def wall(cmd: list[str], env: dict, repeat: int) -> float:
+  '''Fastest wall time of running `cmd` in seconds.'''
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    subprocess.run(cmd, env=env, cwd=ROOT, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+    best = min(best, time.perf_counter() - start)
+  return best
+
+def import_times(cmd: list[str], env: dict) -> list[tuple[int, int, str]]:
+  '''(self us, cumulative us, module) of every module `cmd` imports.'''
+  proc = subprocess.run([sys.executable, '-X', 'importtime', *cmd], env=env, cwd=ROOT,
+                        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+  times = []
+  for line in proc.stderr.splitlines():
+    if not line.startswith('import time:') or 'self [us]' in line:
+      continue
+    own, total, name = line[len('import time:'):].split('|')
+    times.append((int(own), int(total), name.rstrip()))
+  return times
+
+def main():
+  argp = argparse.ArgumentParser(description=__doc__)
+  argp.add_argument('--file', default='tests/functions1.pls')
+  argp.add_argument('--repeat', type=int, default=10)
+  argp.add_argument('--imports', metavar='N', type=int, default=15,
+    help='list the N modules that take longest to import (0 for none)')
+  args = argp.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmpdir:
+    env = dict(os.environ, PALISADE_CACHE_DIR=os.path.join(tmpdir, 'cache'))
+    pyz = os.path.join(tmpdir, 'palisade.pyz')
+    build_bundle(pyz)
+    row('command', 'script ms', 'bundle ms')
+    row('python', f'{wall([sys.executable, "-c", "pass"], env, args.repeat) * 1000:.1f}', '')
+    for name, argv in [('--help', ['--help']),
+                       ('compile --no-cache', ['compile', '--no-cache', args.file]),
+                       ('compile, cached', ['compile', args.file])]:
+      cols = [wall([sys.executable, entry, *argv], env, args.repeat)
+              for entry in ('palisade', pyz)]
+      row(name, *(f'{t * 1000:.1f}' for t in cols))
+
+    if args.imports > 0:
+      times = import_times(['palisade', 'compile', '--no-cache', args.file], env)
+      print()
+      print(f'imports of compile --no-cache: {len(times)} modules, '
+            f'{sum(own for own, _, _ in times) / 1000:.1f} ms')
+      row('module', 'self ms', 'total ms')
+      for own, total, name in sorted(times, reverse=True)[:args.imports]:
+        row(name.strip(), f'{own / 1000:.1f}', f'{total / 1000:.1f}')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,46 @@
+'''Symbolize time on deeply nested scopes.
+
+Every level of nesting defines a few variables and reads variables from all
+levels above it, so the cost of a lookup as a function of the depth shows.
+
+usage: python bench/bench_symbolize.py [--depths N,N,...] [--reads N] [--repeat N]
+'''
+import argparse
+from common import best_of, row
+from tokenizer import RegexTokenizer
+from parser import Parser
+from symbolize import symbolize
+from lib.ast import SymTab
+
+def generate(depth: int, reads: int) -> str:
+  parts = ['in {\n  low a: int;\n}\nout {}\n']
+  for level in range(depth):
+    parts.append(f'x{level} := a;\n')
+    parts.extend(f'x{level} = x{level} + x{i * 7 % (level + 1)};\n' for i in range(reads))
+    parts.append('if (a > 0) {\n')
+  parts.append('}\n' * depth)
+  return ''.join(parts)
+
+def parse(src: str):
+  tokenizer = RegexTokenizer(src)
+  tokenizer.tokenize()
+  return Parser(tokenizer.buffer).parse()
+
+def main():
+  argp = argparse.ArgumentParser(description=__doc__)
+  argp.add_argument('--depths', default='50,100,200')
+  argp.add_argument('--reads', type=int, default=50)
+  argp.add_argument('--repeat', type=int, default=3)
+  args = argp.parse_args()
+
+  row('depth', 'reads', 'symbolize ms')
+  for depth in map(int, args.depths.split(',')):
+    # symbolize fills in the table of the file it is given, parse a fresh one
+    # for every run
+    src = generate(depth, args.reads)
+    asts = iter([parse(src) for _ in range(args.repeat)])
+    secs = best_of(lambda: symbolize(next(asts), SymTab()), args.repeat)
+    row(depth, depth * args.reads, f'{secs * 1000:.2f}')
+
+if __name__ == '__main__':
+  main()
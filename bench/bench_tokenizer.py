@@ -0,0 +1,70 @@
+'''Compare the regex tokenizer engine against the state machine, and the
+memory held by the packed token buffer against a list of Token objects.
+
+usage: python bench/bench_tokenizer.py [--size MB] [--repeat N]
+'''
+import argparse
+import tracemalloc
+from common import best_of, row
+from tokenizer import TOKENIZERS
+
+STMTS = [
+  'x{i} := {i} + 0x1F * (y{i} << 2);\n',
+  'if (a{i} >= 0b101 && b{i} != 0o17) {{\n  z{i} = declassify z{i} / 3;\n}}\n',
+  '// comment line number {i}\n',
+  'while (c{i} < 10) {{ c{i} = c{i} + 1; }}\n',
+  'arr{i}[2] := [true, false];\n',
+]
+
+def generate(size: int) -> str:
+  parts = ['in {\n  high secret: int;\n}\nout {\n  low result: int;\n}\n']
+  total = 0
+  i = 0
+  while total < size:
+    stmt = STMTS[i % len(STMTS)].format(i=i)
+    parts.append(stmt)
+    total += len(stmt)
+    i += 1
+  return ''.join(parts)
+
+def tokenize(engine: str, src: str):
+  tokenizer = TOKENIZERS[engine](src)
+  tokenizer.tokenize()
+  return tokenizer.buffer
+
+def same_stream(a, b) -> bool:
+  return a.types == b.types and a.starts == b.starts and a.ends == b.ends
+
+def traced_bytes(fn) -> tuple[object, int]:
+  tracemalloc.start()
+  result = fn()
+  size = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  return result, size
+
+def main():
+  argp = argparse.ArgumentParser(description=__doc__)
+  argp.add_argument('--size', type=float, default=2.0, help='source size in MB')
+  argp.add_argument('--repeat', type=int, default=3)
+  args = argp.parse_args()
+
+  src = generate(int(args.size * 1024 * 1024))
+  if not same_stream(tokenize('fsm', src), tokenize('regex', src)):
+    raise SystemExit('token streams differ')
+  ntokens = len(tokenize('regex', src))
+  print(f'source: {len(src) / 1024 / 1024:.2f} MB, {ntokens} tokens')
+  row('engine', 'seconds', 'MB/s', 'Mtok/s')
+  results = {}
+  for engine in TOKENIZERS:
+    secs = best_of(lambda: tokenize(engine, src), args.repeat)
+    results[engine] = secs
+    row(engine, f'{secs:.3f}', f'{len(src) / secs / 1024 / 1024:.2f}', f'{ntokens / secs / 1e6:.2f}')
+  print(f'speedup: {results["fsm"] / results["regex"]:.1f}x')
+
+  buffer, buffer_bytes = traced_bytes(lambda: tokenize('regex', src))
+  _, list_bytes = traced_bytes(buffer.tokens)
+  print(f'token buffer: {buffer_bytes / ntokens:.1f} bytes/token, '
+    f'Token list: {list_bytes / ntokens:.1f} bytes/token')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,72 @@
+'''Time and memory of the tree traversal helpers on a large annotated AST.
+
+usage: python bench/bench_traverse.py [--stmts N] [--repeat N]
+'''
+import argparse
+import tracemalloc
+from common import best_of, row
+from tokenizer import RegexTokenizer
+from parser import Parser
+from symbolize import symbolize
+from type_check import type_annotate, type_check_return
+from traverse import map_tree, walk_tree, iter_tree
+from lib.ast import SymTab
+from lib.types import TInt
+
+STMTS = [
+  'x{i} := a + {i} * (b - -a);\n',
+  'if (a < {i}) {{\n  y{i} := [a, b, {i}];\n  while (b > 0) {{ b = b - y{i}[1]; }}\n}}\n',
+  'try {{ a = a + 1; }} catch {{ b = b * 2; }}\n',
+]
+
+def generate(stmts: int) -> str:
+  parts = ['in {\n  low a: int;\n  low b: int;\n}\nout {}\n']
+  parts.extend(STMTS[i % len(STMTS)].format(i=i) for i in range(stmts))
+  return ''.join(parts)
+
+def build(src: str):
+  tokenizer = RegexTokenizer(src)
+  tokenizer.tokenize()
+  ast = Parser(tokenizer.buffer).parse()
+  ast = symbolize(ast, SymTab())
+  return type_annotate(ast)
+
+def identity(node):
+  return map_tree(identity, node)
+
+def walk(node):
+  walk_tree(walk, node)
+
+def iterate(node):
+  for _ in iter_tree(node):
+    pass
+
+def traced_peak(fn) -> int:
+  tracemalloc.start()
+  fn()
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return peak
+
+def main():
+  argp = argparse.ArgumentParser(description=__doc__)
+  argp.add_argument('--stmts', type=int, default=20_000)
+  argp.add_argument('--repeat', type=int, default=3)
+  args = argp.parse_args()
+
+  ast = build(generate(args.stmts))
+  nodes = sum(1 for _ in iter_tree(ast))
+  assert identity(ast) is ast
+  print(f'{nodes} nodes')
+  row('traversal', 'seconds', 'peak KiB')
+  for name, fn in [
+    ('map_tree (identity)', lambda: identity(ast)),
+    ('walk_tree', lambda: walk(ast)),
+    ('iter_tree', lambda: iterate(ast)),
+    ('type_check_return', lambda: type_check_return(ast, TInt())),
+  ]:
+    secs = best_of(fn, args.repeat)
+    row(name, f'{secs:.3f}', f'{traced_peak(fn) / 1024:.1f}')
+
+if __name__ == '__main__':
+  main()
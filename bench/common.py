@@ -0,0 +1,21 @@
+'''Helpers shared by the benchmark scripts in this directory.'''
+import os
+import sys
+import time
+
+# make the compiler modules importable when running `python bench/<script>.py`
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+  sys.path.insert(0, ROOT)
+
+def best_of(fn, repeat: int = 3) -> float:
+  '''Run `fn` `repeat` times and return the fastest wall time in seconds.'''
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    fn()
+    best = min(best, time.perf_counter() - start)
+  return best
+
+def row(*cols):
+  print(''.join(f'{col:>14}' if i else f'{col:<28}' for i, col in enumerate(cols)))
@@ -0,0 +1,48 @@
+'''
+A single-file build of the compiler for `palisade bundle`: a zipapp that
+holds the sources together with their bytecode, compiled ahead of time, so
+that a fresh install or a read-only checkout never compiles a module on
+start up. It runs with any Python that has click:
+
+  ./palisade bundle -o palisade.pyz
+  python palisade.pyz compile prog.pls
+
+The bytecode is unchecked (see PEP 552): it is used as is, without looking
+at the sources next to it, which are only there for tracebacks. The compile
+cache keys entries written by a bundle by the bundle's own hash, see
+`lib.cache.compiler_version`.
+'''
+
+import os
+import py_compile
+import tempfile
+import zipfile
+from glob import glob
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+def sources() -> list[tuple[str, str]]:
+  '''(path, name in the bundle) of every file of the compiler.'''
+  paths = sorted(glob(os.path.join(ROOT, '*.py')) + glob(os.path.join(ROOT, 'lib', '*.py')))
+  files = [(path, os.path.relpath(path, ROOT)) for path in paths]
+  # the script is the bundle's entry point
+  files.append((os.path.join(ROOT, 'palisade'), '__main__.py'))
+  return files
+
+def build_bundle(out: str, interpreter: str = '/usr/bin/env python3') -> int:
+  '''Write the bundle to `out` and return its size in bytes.'''
+  fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(out)))
+  with tempfile.TemporaryDirectory() as tmpdir, os.fdopen(fd, 'wb') as fp:
+    fp.write(f'#!{interpreter}\n'.encode())
+    # stored, not deflated: the point is to load fast
+    with zipfile.ZipFile(fp, 'w', zipfile.ZIP_STORED) as zf:
+      for path, name in sources():
+        pyc = os.path.join(tmpdir, 'pyc')
+        py_compile.compile(path, pyc, name, doraise=True,
+                           invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+        zf.write(path, name)
+        # zipimport looks for the bytecode of `x.py` in `x.pyc` beside it
+        zf.write(pyc, name + 'c')
+  os.chmod(tmp, 0o755)
+  os.replace(tmp, out)
+  return os.path.getsize(out)
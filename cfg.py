@@ -0,0 +1,150 @@
+'''
+Lowering of statements to a control-flow graph, for flow analysis.
+
+# example:
+blocks = lower_stmts(file.stmts)
+for block in blocks:
+  for stmt in block.stmts: ...
+
+Blocks hold straight-line statements only (definitions, assignments, returns,
+throws, debug statements). `if` and `while` end a block with their clause
+and become edges; scopes and `try`/`catch` disappear into edges entirely.
+Blocks are numbered in program order, so every edge but the back edge of a
+`while` goes from a lower to a higher index.
+'''
+
+from lib.ast import *
+from lib.utils import *
+from passes import Pass
+from traverse import iter_tree
+
+@dataclass(slots=True, eq=False)
+class Block:
+  index: int
+  # innermost block whose branch decides whether this one runs, None at the
+  # top level of the program or of a function body
+  ctl: 'Block|None'
+  stmts: list[Stmt] = field(default_factory=list)
+  # SIf or SWhile whose clause is evaluated at the end of the block
+  branch: SIf|SWhile|None = None
+  succs: list['Block'] = field(default_factory=list)
+  # blocks controlled by the branch are the ones after this block, up to and
+  # including `region_end`
+  region_end: int = -1
+
+  def __repr__(self) -> str:
+    return f'<block {self.index}>'
+
+class CFG:
+  def __init__(self):
+    self.blocks: list[Block] = []
+    self.current = self.new_block(None)
+    # for each enclosing try, the blocks that may throw into its catch
+    self.handlers: list[list[Block]] = []
+
+  def new_block(self, ctl: Block|None, *preds: Block) -> Block:
+    block = Block(len(self.blocks), ctl)
+    self.blocks.append(block)
+    for pred in preds:
+      pred.succs.append(block)
+    return block
+
+  def start(self, ctl: Block|None, *preds: Block) -> Block:
+    self.current = self.new_block(ctl, *preds)
+    return self.current
+
+  def may_throw(self):
+    '''Note that the end of the current block may continue at the catch of
+    the innermost try.'''
+    if self.handlers:
+      self.handlers[-1].append(self.current)
+
+def has_call(node: AstNode) -> bool:
+  return any(isinstance(n, ECall) for n in iter_tree(node))
+
+lower = Pass('lower')
+
+@lower.otherwise
+def lower_stmt(pass_, node: Stmt, cfg: CFG):
+  if cfg.handlers and has_call(node):
+    # the called function may throw, and it would do so before the
+    # statement finishes, so the catch sees the state before it
+    cfg.may_throw()
+    cfg.start(cfg.current.ctl, cfg.current)
+  cfg.current.stmts.append(node)
+
+@lower.on(SFnDef)
+def lower_sfndef(pass_, node: SFnDef, cfg: CFG):
+  # bodies are lowered separately, when the function is summarized
+  pass
+
+@lower.on(SScope)
+def lower_sscope(pass_, node: SScope, cfg: CFG):
+  for stmt in node.stmts:
+    yield pass_.step(stmt, cfg)
+
+@lower.on(SThrow)
+def lower_sthrow(pass_, node: SThrow, cfg: CFG):
+  cfg.current.stmts.append(node)
+  if cfg.handlers:
+    cfg.may_throw()
+    # code after a throw is still analyzed, as if the throw may not happen
+    cfg.start(cfg.current.ctl, cfg.current)
+
+@lower.on(SIf)
+def lower_sif(pass_, node: SIf, cfg: CFG):
+  match node:
+    case SIf(_, clause, body, els):
+      branch = cfg.current
+      branch.branch = node
+      if cfg.handlers and has_call(clause):
+        cfg.may_throw()
+      cfg.start(branch, branch)
+      yield pass_.step(body, cfg)
+      ends = [cfg.current]
+      if els:
+        cfg.start(branch, branch)
+        yield pass_.step(els, cfg)
+        ends.append(cfg.current)
+      else:
+        ends.append(branch)
+      branch.region_end = len(cfg.blocks) - 1
+      cfg.start(branch.ctl, *ends)
+
+@lower.on(SWhile)
+def lower_swhile(pass_, node: SWhile, cfg: CFG):
+  match node:
+    case SWhile(_, clause, body):
+      # the clause gets a block of its own, since it is entered again from
+      # the end of the body
+      header = cfg.start(cfg.current.ctl, cfg.current)
+      header.branch = node
+      if cfg.handlers and has_call(clause):
+        cfg.may_throw()
+      cfg.start(header, header)
+      yield pass_.step(body, cfg)
+      cfg.current.succs.append(header)
+      header.region_end = len(cfg.blocks) - 1
+      cfg.start(header.ctl, header)
+
+@lower.on(STryCatch)
+def lower_strycatch(pass_, node: STryCatch, cfg: CFG):
+  match node:
+    case STryCatch(_, tryBody, catchBody):
+      cfg.handlers.append([])
+      yield pass_.step(tryBody, cfg)
+      throwing = cfg.handlers.pop()
+      try_end = cfg.current
+      # the catch is also entered from the end of the try body, which makes
+      # it see everything the try body did
+      cfg.start(try_end.ctl, *throwing, try_end)
+      yield pass_.step(catchBody, cfg)
+      cfg.start(try_end.ctl, try_end, cfg.current)
+
+def lower_stmts(stmts: list[Stmt]) -> list[Block]:
+  '''Lower a program or a function body. The entry is the first block, the
+  exit (where execution falls off the end) the last one.'''
+  cfg = CFG()
+  for stmt in stmts:
+    lower(stmt, cfg)
+  return cfg.blocks
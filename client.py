@@ -0,0 +1,31 @@
+'''
+Client side of the compile daemon in server.py. Kept apart from it, so that
+`palisade client` imports nothing of the compiler.
+'''
+
+import json
+import os
+import socket
+
+def default_socket_path() -> str:
+  '''$PALISADE_SOCKET, or palisade.sock in $XDG_RUNTIME_DIR (the temporary
+  directory, with the user id in the name, if that is not set).'''
+  path = os.environ.get('PALISADE_SOCKET')
+  if path:
+    return path
+  runtime = os.environ.get('XDG_RUNTIME_DIR')
+  if runtime:
+    return os.path.join(runtime, 'palisade.sock')
+  import tempfile
+  return os.path.join(tempfile.gettempdir(), f'palisade-{os.getuid()}.sock')
+
+def request(path: str, message: dict) -> dict:
+  '''Send `message` to the daemon on socket `path` and return its response.'''
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+    sock.connect(path)
+    sock.sendall(json.dumps(message).encode() + b'\n')
+    with sock.makefile('rb') as fp:
+      line = fp.readline()
+  if not line:
+    raise ConnectionError('the daemon closed the connection')
+  return json.loads(line)
@@ -0,0 +1,328 @@
+'''
+Compiling programs for the `palisade` commands: a single file with its
+report written to stdout, or any number of files across a pool of worker
+processes with their reports collected in order.
+
+# example:
+secure = run_compile('prog.pls', CompileOptions(), PassTimer(), None)
+for path, result in compile_batch(['prog.pls', 'tests/'], CompileOptions(), jobs=4):
+  print(result.output)
+'''
+
+import io
+import os
+import time
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from lib.ast import SourceFile, FAKE_SPAN
+from lib.cache import CompileCache, report_key
+from lib.timing import PassTimer, profiled
+from lib.utils import *
+
+@dataclass(slots=True)
+class CompileOptions:
+  '''Options of `palisade compile` that change what a compile prints.'''
+  color: bool = True
+  tokenizer_engine: str = 'regex'
+  p_tokens: bool = False
+  p_parse: bool = False
+  p_symbolize: bool = False
+  p_type_annot: bool = False
+  p_sec_labels: bool = False
+  p_type_check: bool = False
+  diagnostics: str = 'full'
+  max_notes: int|None = None
+  # write the type-checked AST here and stop
+  emit_ast: str|None = None
+  # the file is a binary AST, see lib/astfile.py
+  load_ast: bool = False
+
+  def dumps(self) -> bool:
+    '''Whether trees or tokens from the middle of the compile are printed.'''
+    return any([self.p_tokens, self.p_parse, self.p_symbolize, self.p_type_annot,
+                self.p_sec_labels, self.p_type_check])
+
+@dataclass(slots=True)
+class CompileResult:
+  # everything the compile printed
+  output: str
+  # exit status, nonzero after an error
+  code: int
+  # whether no output ended up above its declared label
+  secure: bool
+  # whether anything was added to the cache
+  stored: bool = False
+
+def run_compile(file: str, options: CompileOptions, timer: PassTimer,
+                cache: CompileCache|None) -> bool:
+  '''Compile `file`, or replay the output of an earlier compile of the same
+  source with the same options from `cache`. Returns whether the program is
+  secure; errors exit.'''
+  DIAGNOSTICS.reset(options.diagnostics, options.max_notes)
+  use_color(options.color)
+
+  if options.load_ast:
+    from traverse import count_nodes
+    from lib.astfile import load_ast, AstFormatError
+    with timer.stage('load_ast') as record:
+      try:
+        ast = load_ast(file)
+      except (OSError, AstFormatError) as e:
+        report_error(f'cannot load {file}: {e}', FAKE_SPAN)
+    if record is not None: record.nodes = count_nodes(ast)
+    return analyze_ast(ast, options, timer, None)
+
+  try:
+    with open(file) as fp:
+      SRC = SourceFile(fp.read(), file)
+  except (OSError, UnicodeDecodeError) as e:
+    report_error(f'cannot read {file}: {e}', FAKE_SPAN)
+  return run_source(SRC, options, timer, cache)
+
+def compile_file(file: str, options: CompileOptions, cache: CompileCache|None,
+                 timer: PassTimer, time_format: str = 'text', profile: str|None = None):
+  '''`palisade compile` of a single file: `run_compile` under the profiler,
+  if `profile` is given, then the report of `timer` and eviction from `cache`.
+  Timed and profiled compiles do not use `cache`, they are there to measure
+  the compile itself rather than a replay of its results.'''
+  if timer.enabled or profile is not None:
+    cache = None
+  try:
+    with profiled(profile):
+      run_compile(file, options, timer, cache)
+  finally:
+    timer.report(time_format)
+    if cache is not None and cache.stored:
+      cache.evict()
+
+def run_source(SRC: SourceFile, options: CompileOptions, timer: PassTimer,
+               cache: CompileCache|None) -> bool:
+  '''`run_compile` for a source that has been read already.'''
+  # every compile counts and hides its own notes, also in a worker that
+  # compiled other files before
+  DIAGNOSTICS.reset(options.diagnostics, options.max_notes)
+  use_color(options.color)
+  if cache is None:
+    return compile_source(SRC, options, timer, cache)
+
+  key = report_key(cache, SRC.text, options.diagnostics, options.max_notes, options.color)
+  with timer.stage('load_report'):
+    report = cache.load('report', key)
+  if report is not None:
+    output, code, secure = report
+    DIAGNOSTICS.out().write(output)
+    if code:
+      exit(code)
+    DIAGNOSTICS.flush()
+    return secure
+
+  DIAGNOSTICS.transcript = io.StringIO()
+  code = None
+  secure = False
+  try:
+    secure = compile_source(SRC, options, timer, cache)
+    code = 0
+  except SystemExit as e:
+    code = e.code
+    raise
+  finally:
+    # errors are as much a result as anything else, only crashes are not kept
+    if DIAGNOSTICS.transcript is not None and code is not None:
+      cache.store('report', key, (DIAGNOSTICS.transcript.getvalue(), code, secure))
+    DIAGNOSTICS.transcript = None
+  return secure
+
+def compile_source(SRC: SourceFile, options: CompileOptions, timer: PassTimer,
+                   cache: CompileCache|None) -> bool:
+  ast = None
+  if cache is not None:
+    # the source file is the one thing in the tree that is not a result
+    ast_key = cache.key('ast', SRC.text)
+    with timer.stage('load_ast'):
+      ast = cache.load('ast', ast_key, lambda pid: SRC)
+
+  if ast is None:
+    ast = compile_ast(SRC, options, timer)
+    # debug statements print the tree halfway through type checking, which
+    # a cached tree cannot reproduce
+    if cache is not None and 'debug' not in ast.features:
+      cache.store('ast', ast_key, ast, lambda obj: 'src' if obj is SRC else None)
+
+  if options.emit_ast:
+    from lib.astfile import dump_ast, AstFormatError
+    with timer.stage('emit_ast'):
+      try:
+        dump_ast(ast, options.emit_ast)
+      except (OSError, AstFormatError) as e:
+        report_error(f'cannot write {options.emit_ast}: {e}', FAKE_SPAN)
+    DIAGNOSTICS.flush()
+    return True
+
+  return analyze_ast(ast, options, timer, cache)
+
+def analyze_ast(ast, options: CompileOptions, timer: PassTimer,
+                cache: CompileCache|None) -> bool:
+  '''Flow analysis of a type-checked `ast`, and the report on its outputs.
+  Returns whether no output ended up above its declared label.'''
+  from traverse import count_nodes
+  # from security import assign_security_labels
+  from lib.ast import SGlobal
+
+  from flow_analysis import flow_analysis, SecurityContext, SummaryCache, LOW, integrate_labels
+  with timer.stage('flow_analysis') as record:
+    ctx = SecurityContext(summaries=SummaryCache(disk=cache))
+    flow_analysis(ast, LOW, ctx)
+    # integrate new security labels into the symbols
+    integrate_labels(ast, ctx)
+  if record is not None: record.nodes = count_nodes(ast)
+  if options.p_sec_labels: pprint(ast)
+
+  from lib.ast import EId, EArray
+
+  secure = True
+  def pprint_global(node: SGlobal):
+    nonlocal secure
+    match node.expr:
+      case EId(sym=sym) | EArray(expr=EId(sym=sym)):
+        currsec = str(sym.secure)
+        origsec = str(node.orig_secure)
+        name = blue(sym.name)
+        if origsec == currsec:
+          stat = green(' OK ')
+        elif not ast.lattice.leq(sym.secure.mask, node.orig_secure.mask):
+          stat = red('FAIL')
+          secure = False
+        else:
+          stat = yellow(' OK ')
+        origsec = f'{origsec:4}'
+        emit(f'[{stat}] {yellow(origsec)} {name} is {yellow(currsec)}')
+      case _:
+        raise RuntimeError()
+
+  with timer.stage('output') as record:
+    DIAGNOSTICS.report_hidden()
+    for out in ast.outputs:
+      pprint_global(out)
+    DIAGNOSTICS.flush()
+  if record is not None: record.nodes = len(ast.outputs)
+  return secure
+
+def compile_ast(SRC: SourceFile, options: CompileOptions, timer: PassTimer):
+  '''Tokenize, parse and type check `SRC`.'''
+  from tokenizer import TOKENIZERS
+  from parser import Parser
+  from passes import PassManager
+  from traverse import count_nodes
+  from symbolize import symbolize
+  from type_check import type_annotate, type_check
+  from debug import debug_ast
+
+  with timer.stage('tokenize') as record:
+    tokenizer = TOKENIZERS[options.tokenizer_engine](SRC)
+    tokenizer.tokenize()
+  if record is not None: record.nodes = len(tokenizer.buffer)
+  if options.p_tokens: pprint(tokenizer.tokens)
+
+  with timer.stage('parse') as record:
+    parser = Parser(tokenizer.buffer)
+    ast = parser.parse()
+  if record is not None: record.nodes = count_nodes(ast)
+  if options.p_parse: pprint(ast)
+
+  passes = PassManager([symbolize, type_annotate, debug_ast, type_check])
+  dumps = {symbolize: options.p_symbolize, type_annotate: options.p_type_annot,
+           type_check: options.p_type_check}
+  return passes.run(ast, {pass_ for pass_, dump in dumps.items() if dump}, timer)
+
+def capture(run, *args) -> CompileResult:
+  '''Call `run_compile` or `run_source` with `args` in this process and
+  return what it printed, instead of printing it.'''
+  out = io.StringIO()
+  code = 0
+  secure = False
+  with redirect_stdout(out):
+    try:
+      secure = run(*args)
+    except SystemExit as e:
+      code = e.code or 0
+    except Exception:
+      import traceback
+      DIAGNOSTICS.flush()
+      out.write(traceback.format_exc())
+      code = 1
+  return CompileResult(out.getvalue(), code, secure)
+
+def compile_captured(SRC: SourceFile, options: CompileOptions,
+                     cache: CompileCache|None = None) -> CompileResult:
+  '''Compile `SRC` in this process and return what it printed.'''
+  result = capture(run_source, SRC, options, PassTimer(), cache)
+  result.stored = cache is not None and cache.stored
+  return result
+
+def run_test(path: str, expected: str) -> tuple[str, float]:
+  '''Output of compiling the test program `path` in this process, and the
+  seconds it took. If it is as `expected`, the output of compiling it again
+  in two steps, through a binary AST, which must not change a thing.'''
+  start = time.perf_counter()
+  actual = capture(run_compile, path, CompileOptions(), PassTimer(), None).output
+  if actual == expected:
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmpdir:
+      ast = os.path.join(tmpdir, 'ast')
+      actual = capture(run_compile, path, CompileOptions(emit_ast=ast), PassTimer(), None).output
+      if os.path.exists(ast):
+        actual += capture(run_compile, ast, CompileOptions(load_ast=True), PassTimer(), None).output
+  return actual, time.perf_counter() - start
+
+def _compile_text(name: str, text: str, options: CompileOptions,
+                  cache: CompileCache|None) -> CompileResult:
+  return compile_captured(SourceFile(text, name), options, cache)
+
+def _read(path: str) -> str|CompileResult:
+  try:
+    with open(path) as fp:
+      return fp.read()
+  except (OSError, UnicodeDecodeError) as e:
+    return CompileResult(red('error: ') + f'cannot read {path}: {e}\n', 1, False)
+
+def expand_paths(paths: list[str]) -> list[str]:
+  '''`paths`, with every directory replaced by the .pls files under it in
+  sorted order.'''
+  files = []
+  for path in paths:
+    if not os.path.isdir(path):
+      files.append(path)
+      continue
+    found = []
+    for dirpath, dirnames, filenames in os.walk(path):
+      dirnames.sort()
+      found.extend(os.path.join(dirpath, name) for name in filenames if name.endswith('.pls'))
+    files.extend(sorted(found))
+  return files
+
+def compile_batch(paths: list[str], options: CompileOptions, jobs: int|None = None,
+                  cache: CompileCache|None = None):
+  '''Compile every file of `paths` with `jobs` worker processes (one per CPU
+  by default) and yield (path, `CompileResult`) in the order of `paths`, each
+  as soon as it and all before it are done.
+
+  Files are read on threads of this process ahead of the workers, which get
+  the text, so no worker waits for a read.'''
+  from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+  jobs = jobs or os.cpu_count() or 1
+  with ThreadPoolExecutor(min(jobs, 8)) as readers:
+    texts = readers.map(_read, paths)
+    if jobs == 1:
+      for path, text in zip(paths, texts):
+        if isinstance(text, str):
+          text = _compile_text(path, text, options, cache)
+        yield path, text
+      return
+    with ProcessPoolExecutor(jobs) as workers:
+      pending = []
+      for path, text in zip(paths, texts):
+        if isinstance(text, str):
+          text = workers.submit(_compile_text, path, text, options, cache)
+        pending.append((path, text))
+      for path, result in pending:
+        yield path, result if isinstance(result, CompileResult) else result.result()
@@ -0,0 +1,141 @@
+'''
+`palisade compile FILE` without click. The `palisade` script hands its
+arguments here before importing click; a single file with options this
+module knows is compiled right away, and a report found in the compile
+cache is replayed without importing the compiler at all. Anything else
+(several files, a directory, -j, --help, a value click would reject) is left
+to the click command, which has the last word on every error.
+
+Keep the tables below in step with the options of `palisade compile`.
+
+# example:
+compile_main(['--diagnostics', 'quiet', 'prog.pls'])  # exits, or returns
+'''
+
+import os
+import sys
+
+# options without a value: (parameter, value)
+FLAGS = {
+  '--color': ('color', True),
+  '--no-color': ('color', False),
+  '--p-tokens': ('p_tokens', True),
+  '--p-parse': ('p_parse', True),
+  '--p-symbolize': ('p_symbolize', True),
+  '--p-type-annot': ('p_type_annot', True),
+  '--p-sec-labels': ('p_sec_labels', True),
+  '--p-type-check': ('p_type_check', True),
+  '--time-passes': ('time_passes', True),
+  '--mem-report': ('mem_report', True),
+  '--load-ast': ('load_ast', True),
+  '--cache': ('use_cache', True),
+  '--no-cache': ('use_cache', False),
+  '--explicit-flows': ('explicit_flows', True),
+  '--no-explicit-flows': ('explicit_flows', False),
+  '--implicit-flows': ('implicit_flows', True),
+  '--no-implicit-flows': ('implicit_flows', False),
+}
+
+# options with a value: (parameter, type or tuple of choices)
+VALUES = {
+  '--tokenizer': ('tokenizer_engine', ('regex', 'fsm')),
+  '--diagnostics': ('diagnostics', ('quiet', 'summary', 'full')),
+  '--max-notes': ('max_notes', int),
+  '--time-format': ('time_format', ('text', 'json')),
+  '--profile': ('profile', str),
+  '--emit-ast': ('emit_ast', str),
+  '--cache-dir': ('cache_dir', str),
+  '--cache-size': ('cache_size', int),
+}
+
+DEFAULTS = {
+  'color': True, 'tokenizer_engine': 'regex', 'p_tokens': False, 'p_parse': False,
+  'p_symbolize': False, 'p_type_annot': False, 'p_sec_labels': False,
+  'p_type_check': False, 'diagnostics': 'full', 'max_notes': None, 'time_passes': False,
+  'time_format': 'text', 'mem_report': False, 'profile': None, 'emit_ast': None,
+  'load_ast': False, 'use_cache': True, 'cache_dir': None, 'cache_size': 64,
+  'explicit_flows': True, 'implicit_flows': True,
+}
+
+# parameters that are not fields of CompileOptions
+RUN_PARAMS = ('time_passes', 'time_format', 'mem_report', 'profile', 'use_cache',
+              'cache_dir', 'cache_size', 'explicit_flows', 'implicit_flows')
+
+def parse_args(argv: list[str]) -> tuple[str, dict]|None:
+  '''The file and parameters of `palisade compile` with arguments `argv`, or
+  None if the fast path does not handle them.'''
+  params = dict(DEFAULTS)
+  files = []
+  args = iter(argv)
+  for arg in args:
+    if not arg.startswith('-') or arg == '-':
+      files.append(arg)
+      continue
+    name, eq, value = arg.partition('=')
+    if name in FLAGS and not eq:
+      param, params[param] = FLAGS[name]
+      continue
+    if name not in VALUES:
+      return None
+    if not eq:
+      value = next(args, None)
+      if value is None:
+        return None
+    param, kind = VALUES[name]
+    if isinstance(kind, tuple):
+      if value not in kind:
+        return None
+    else:
+      try:
+        value = kind(value)
+      except ValueError:
+        return None
+    params[param] = value
+  if len(files) != 1 or files[0] == '-' or os.path.isdir(files[0]):
+    return None
+  params['time_passes'] = params['time_passes'] or params['mem_report']
+  return files[0], params
+
+def replay(file: str, params: dict, cache) -> bool:
+  '''Write the cached report of compiling `file` and exit with its status,
+  or return False if there is none.'''
+  from lib.cache import report_key
+  try:
+    with open(file) as fp:
+      text = fp.read()
+  except (OSError, UnicodeDecodeError):
+    # the compiler reports that
+    return False
+  key = report_key(cache, text, params['diagnostics'], params['max_notes'], params['color'])
+  report = cache.load('report', key)
+  if report is None:
+    return False
+  output, code, secure = report
+  sys.stdout.write(output)
+  sys.stdout.flush()
+  sys.exit(code)
+
+def compile_main(argv: list[str]):
+  '''Run `palisade compile` with arguments `argv` and exit, or return if
+  the arguments need the click command.'''
+  parsed = parse_args(argv)
+  if parsed is None:
+    return
+  file, params = parsed
+  dumps = any(params[p] for p in ('p_tokens', 'p_parse', 'p_symbolize', 'p_type_annot',
+                                  'p_sec_labels', 'p_type_check'))
+  cache = None
+  # as in the click command: trees and tokens are only there when compiling
+  if params['use_cache'] and not dumps and not params['emit_ast'] and not params['load_ast']:
+    from lib.cache import CompileCache, default_cache_dir
+    cache = CompileCache(params['cache_dir'] or default_cache_dir(),
+                         params['cache_size'] * 1024 * 1024)
+    if not params['time_passes'] and params['profile'] is None:
+      replay(file, params, cache)
+
+  from driver import CompileOptions, compile_file
+  from lib.timing import PassTimer
+  options = CompileOptions(**{p: v for p, v in params.items() if p not in RUN_PARAMS})
+  timer = PassTimer(params['time_passes'], params['mem_report'])
+  compile_file(file, options, cache, timer, params['time_format'], params['profile'])
+  sys.exit(0)
@@ -1,288 +1,934 @@
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right, insort
+from heapq import heappush, heappop
 from lib.ast import *
 from lib.utils import *
 from lib.types import *
 from traverse import *
+from passes import Pass
+from cfg import Block, lower_stmts
+from lib.cache import CompileCache, Uncacheable
+
+# Labels are bitmasks over the sources of information a value may depend on.
+# The low bits are the compartments of the program's lattice (just high in
+# the two-point lattice, so LOW is 0 and high is 1). While a function body is
+# summarized, the bit above them stands for the label of the call site's pc
+# and every parameter gets a bit of its own above that.
+LOW = 0
+
+def pc_bit(lattice: Lattice) -> int:
+  return 1 << lattice.width
+
+def param_bit(lattice: Lattice, idx: int) -> int:
+  return 1 << (lattice.width + 1 + idx)
+
+def mask_of(seclabel: SecLabel) -> int:
+  return seclabel.mask
+
+def substitute(lattice: Lattice, mask: int, pc: int, args: list[int]) -> int:
+  '''Replace the pc and parameter bits of a summary label with the labels
+  they stand for at a call site.'''
+  result = mask & lattice.top
+  mask >>= lattice.width
+  if mask & 1:
+    result |= pc
+  mask >>= 1
+  idx = 0
+  while mask:
+    if mask & 1:
+      result |= args[idx]
+    mask >>= 1
+    idx += 1
+  return result
+
+@dataclass(slots=True)
+class FnSummary:
+  '''Everything a call site needs to know about a function body.
+
+  `returns` is the label of the returned value. `events` are the checks and
+  notes the body would raise, in order, with their labels left symbolic; a
+  call replays them after substituting its own pc and arguments.'''
+  returns: int = LOW
+  # ('notes', events, start, end, pc, args, site) stands for the notes
+  # events[start:end] of a callee, raised with the given pc and arguments by
+  # the call at span `site`
+  events: list[tuple] = field(default_factory=list)
+  # checks already in `events`, by kind, label and span: a repeated one can
+  # only fail if the first one did
+  checks: set[tuple] = field(default_factory=set)
+
+NOTES = ('note_var', 'note_index', 'note_array', 'notes')
+
+# maximum number of function summaries kept around, evicted ones are rebuilt
+SUMMARY_CACHE_SIZE = 1024
+
+class SummaryCache:
+  '''Function summaries by function symbol, least recently used first out.
+
+  Also remembers the call graph, and holds the provisional summaries of the
+  functions of a recursive component while it is iterated to a fixpoint.
+
+  With a `disk` cache, summaries of functions outside recursive components
+  are also kept across compiles, keyed by the text of the function, the
+  outside variables it uses and the keys of the functions it calls (see
+  `disk_key`). Spans in them are stored relative to the function they point
+  into, so a function that only moved within the file still hits.'''
+  def __init__(self, maxsize: int = SUMMARY_CACHE_SIZE, disk: CompileCache|None = None):
+    self.maxsize = maxsize
+    self.entries: OrderedDict[Symbol, FnSummary] = OrderedDict()
+    self.pending: dict[Symbol, FnSummary] = {}
+    self.callgraph: dict[Symbol, list[Symbol]] = {}
+    self.disk = disk
+    # disk key of each function seen, None if it cannot be cached
+    self.keys: dict[Symbol, str|None] = {}
+    # start offset and line of the function with a given key in this file,
+    # and the (start, end, key) of all such functions, by start
+    self.places: dict[str, tuple[int, int]] = {}
+    self.ranges: list[tuple[int, int, str]] = []
+    self.src: SourceFile|None = None
+
+  def get(self, sym: Symbol) -> FnSummary|None:
+    summary = self.pending.get(sym)
+    if summary is not None:
+      return summary
+    summary = self.entries.get(sym)
+    if summary is not None:
+      self.entries.move_to_end(sym)
+    return summary
+
+  def put(self, sym: Symbol, summary: FnSummary):
+    self.entries[sym] = summary
+    self.entries.move_to_end(sym)
+    if len(self.entries) > self.maxsize:
+      old, _ = self.entries.popitem(last=False)
+      self.forget(old)
+
+  def forget(self, sym: Symbol):
+    '''Drop the callees and disk key of function `sym` along with its
+    summary. They are found again when the summary is rebuilt, callees
+    first, so callers that used the key see the same one.'''
+    self.callgraph.pop(sym, None)
+    key = self.keys.pop(sym, None)
+    if key is not None:
+      start, _ = self.places.pop(key)
+      del self.ranges[bisect_left(self.ranges, (start,))]
+
+  def callees(self, sym: Symbol) -> list[Symbol]:
+    '''Functions called from the body of function `sym`, each listed once.'''
+    callees = self.callgraph.get(sym)
+    if callees is None:
+      calls = (node.name.sym for node in iter_tree(sym.type.sfndef.body)
+               if isinstance(node, ECall))
+      callees = self.callgraph[sym] = list(dict.fromkeys(calls))
+    return callees
+
+  def disk_key(self, sym: Symbol, lattice: Lattice) -> str|None:
+    '''Key of the summary of function `sym` on disk, None if it cannot be
+    cached. Everything it calls must have been keyed already.'''
+    if sym in self.keys:
+      return self.keys[sym]
+    self.keys[sym] = None
+    sfndef = sym.type.sfndef
+    callees = [self.keys.get(callee) for callee in self.callees(sym)]
+    if self.disk is None or None in callees:
+      return None
+    start = sfndef.span.off_start
+    end = max(node.span.off_end for node in iter_tree(sfndef))
+    # outside variables: their declared labels and sizes go into the summary
+    outside = set()
+    for node in iter_tree(sfndef.body):
+      if isinstance(node, EId) and not isinstance(node.sym.type, TFn) \
+         and not start <= node.sym.origin.off_start < end:
+        outside.add(f'{node.sym.name} {node.sym.secure} {node.sym.type!r}')
+    src = sfndef.span.src
+    key = self.disk.key('summary', ' '.join(lattice.compartments), str(sfndef.span.cstart),
+                        src.text[start:end], *sorted(outside), *callees)
+    if key in self.places:
+      # the same function twice, spans can only point into one of them
+      return None
+    self.src = src
+    self.keys[sym] = key
+    self.places[key] = (start, sfndef.span.lnum)
+    insort(self.ranges, (start, end, key))
+    return key
+
+  def load(self, key: str) -> FnSummary|None:
+    return self.disk.load('summary', key, self.span_of_id)
+
+  def store(self, key: str, summary: FnSummary):
+    self.disk.store('summary', key, FnSummary(summary.returns, summary.events),
+                    self.id_of_span)
+
+  def id_of_span(self, obj):
+    if type(obj) is Span:
+      idx = bisect_right(self.ranges, (obj.off_start, float('inf'))) - 1
+      if idx < 0 or obj.off_start >= self.ranges[idx][1]:
+        raise Uncacheable(obj)
+      key = self.ranges[idx][2]
+      start, lnum = self.places[key]
+      return (key, obj.off_start - start, obj.off_end - start, obj.lnum - lnum,
+              obj.cstart, obj.cend)
+    elif type(obj) is SourceFile:
+      raise Uncacheable(obj)
+    return None
+
+  def span_of_id(self, pid: tuple) -> Span:
+    key, off_start, off_end, lnum, cstart, cend = pid
+    start, line = self.places[key]
+    return Span(start + off_start, start + off_end, line + lnum, cstart, cend, self.src)
+
+def runs_of(cells) -> tuple[tuple[int, ...], tuple[int, ...]]:
+  '''Merge (start, label) pairs, in order of start, into runs of different
+  labels.'''
+  starts, labels = [], []
+  for start, seclabel in cells:
+    if labels and labels[-1] == seclabel:
+      continue
+    if starts and starts[-1] == start:
+      labels[-1] = seclabel
+      if len(labels) > 1 and labels[-2] == seclabel:
+        starts.pop()
+        labels.pop()
+      continue
+    starts.append(start)
+    labels.append(seclabel)
+  return tuple(starts), tuple(labels)
+
+@dataclass(slots=True, frozen=True)
+class ArrayLabels:
+  '''Labels of the cells of an array, as runs of equal labels: run k covers
+  the cells from `starts[k]` up to the next start (or the end of the array)
+  and has label `labels[k]`. Neighbouring runs always have different labels.
+  Never changed in place, so contexts share them until one writes.'''
+  length: int
+  starts: tuple[int, ...]
+  labels: tuple[int, ...]
+  # join of all labels, what a read at an unknown index sees
+  joined: int
+
+  @staticmethod
+  def uniform(length: int, seclabel: int) -> 'ArrayLabels':
+    return ArrayLabels(length, (0,), (seclabel,), seclabel)
+
+  @staticmethod
+  def of_runs(length: int, cells) -> 'ArrayLabels':
+    starts, labels = runs_of(cells)
+    joined = LOW
+    for seclabel in labels:
+      joined |= seclabel
+    return ArrayLabels(length, starts, labels, joined)
+
+  @staticmethod
+  def of_list(seclabels: list[int]) -> 'ArrayLabels':
+    return ArrayLabels.of_runs(len(seclabels), enumerate(seclabels))
+
+  def at(self, idx: int) -> int:
+    if not 0 <= idx < self.length:
+      # there is no bounds checking, any cell may be read instead
+      return self.joined
+    return self.labels[bisect_right(self.starts, idx) - 1]
+
+  def runs(self):
+    '''Yield (start, end, label) for every run.'''
+    ends = self.starts[1:] + (self.length,)
+    return zip(self.starts, ends, self.labels)
+
+  def with_cell(self, idx: int, seclabel: int) -> 'ArrayLabels':
+    if not 0 <= idx < self.length or self.at(idx) == seclabel:
+      return self
+    run = bisect_right(self.starts, idx) - 1
+    cells = [*zip(self.starts[:run + 1], self.labels[:run + 1]), (idx, seclabel)]
+    if idx + 1 < self.length:
+      cells.append((idx + 1, self.labels[run]))
+    cells.extend(zip(self.starts[run + 1:], self.labels[run + 1:]))
+    return ArrayLabels.of_runs(self.length, cells)
+
+  def join_all(self, seclabel: int) -> 'ArrayLabels':
+    if all(l | seclabel == l for l in self.labels):
+      return self
+    return ArrayLabels.of_runs(self.length, zip(self.starts, (l | seclabel for l in self.labels)))
+
+  def segments(self, other: 'ArrayLabels'):
+    '''Yield (start, end, mine, theirs) over the common refinement of the
+    runs of two arrays of the same length.'''
+    mine, theirs = self.runs(), other.runs()
+    mstart, mend, mlabel = next(mine)
+    tstart, tend, tlabel = next(theirs)
+    start = 0
+    while start < self.length:
+      end = min(mend, tend)
+      yield start, end, mlabel, tlabel
+      start = end
+      if start == mend and start < self.length:
+        mstart, mend, mlabel = next(mine)
+      if start == tend and start < self.length:
+        tstart, tend, tlabel = next(theirs)
+
+  def join(self, other: 'ArrayLabels') -> 'ArrayLabels':
+    if other is self:
+      return self
+    joined = ArrayLabels.of_runs(self.length, ((start, mine | theirs)
+                                 for start, _, mine, theirs in self.segments(other)))
+    return self if joined == self else joined
+
+# number of written labels kept aside before they are folded into the planes
+FOLD_LIMIT = 64
 
 @dataclass
 class SecurityContext:
-  ctxvar: dict[Symbol, SecLabel]
-  ctxarr: dict[Symbol, list[SecLabel]]
+  '''Labels of variables and array cells, by the slots symbolize gave them.
+
+  Labels of arrays are `ArrayLabels` in `arrays`. Labels of other variables
+  are stored in bit planes: bit `slot` of `planes[b]` is set when the
+  label at that slot has label bit b. In the program itself there is only
+  high and so only one plane. Planes are never changed in place, copies of a
+  context share them.
+
+  Writes go to `dirty` first and are folded into the planes once there are
+  more than FOLD_LIMIT of them, so a write does not rebuild every plane. Two
+  contexts with the same planes, like the ends of the two arms of an if, are
+  joined by looking at their dirty slots only.'''
+  planes: list[int] = field(default_factory=list)
+  # slots defined in the planes, any slot not defined here or in `dirty`
+  # falls back to its declared label
+  known: int = 0
+  # slot -> label written since the last fold
+  dirty: dict[int, int] = field(default_factory=dict)
+  arrays: dict[int, ArrayLabels] = field(default_factory=dict)
+  lattice: Lattice = TWO_POINT
+  summaries: SummaryCache = field(default_factory=SummaryCache)
+  # summary being built while analyzing a function body, checks and notes are
+  # recorded in it instead of being reported
+  summary: FnSummary|None = None
+  # keys of the notes raised so far by the blocks being solved, shared by
+  # their contexts: going around a loop again only raises the notes about
+  # labels that changed to something new
+  noted: set[tuple]|None = None
+  # ids of the spans of the calls the notes being replayed come through,
+  # outermost first
+  sites: tuple[int, ...] = ()
 
   def copy(self) -> 'SecurityContext':
-    return SecurityContext(self.ctxvar.copy(), self.ctxarr.copy())
+    return SecurityContext(self.planes[:], self.known, self.dirty.copy(), self.arrays.copy(),
+                           self.lattice, self.summaries,
+                           self.summary, self.noted)
+
+  def knows_slot(self, slot: int) -> bool:
+    return slot in self.dirty or self.known >> slot & 1 == 1
 
-  def label_of(self, sym: Symbol, default: SecLabel|None = None) -> SecLabel:
-    if sym in self.ctxvar:
-      return self.ctxvar[sym]
-    elif sym in self.ctxarr:
-      return SecLabel.LOW.join(*self.ctxarr[sym])
+  def knows(self, sym: Symbol) -> bool:
+    return sym.slot in self.arrays or self.knows_slot(sym.slot)
+
+  def base_label(self, slot: int) -> int:
+    seclabel = LOW
+    for bit, plane in enumerate(self.planes):
+      if plane >> slot & 1:
+        seclabel |= 1 << bit
+    return seclabel
+
+  def label_at(self, slot: int) -> int:
+    seclabel = self.dirty.get(slot)
+    return self.base_label(slot) if seclabel is None else seclabel
+
+  def set_label(self, slot: int, seclabel: int):
+    self.dirty[slot] = seclabel
+    if len(self.dirty) > FOLD_LIMIT:
+      self.fold()
+
+  def fold(self):
+    '''Move the written labels into (new) planes.'''
+    dirty = self.dirty
+    if not dirty:
+      return
+    nbytes = (max(max(dirty) + 1, self.known.bit_length()) + 7) // 8
+    planes = self.planes
+    width = max(seclabel.bit_length() for seclabel in dirty.values())
+    while len(planes) < width:
+      planes.append(0)
+    # one pass over the bytes of each plane instead of a new int per slot
+    for bit, plane in enumerate(planes):
+      buf = bytearray(plane.to_bytes(nbytes, 'little'))
+      for slot, seclabel in dirty.items():
+        if seclabel >> bit & 1:
+          buf[slot >> 3] |= 1 << (slot & 7)
+        else:
+          buf[slot >> 3] &= ~(1 << (slot & 7))
+      planes[bit] = int.from_bytes(buf, 'little')
+    buf = bytearray(self.known.to_bytes(nbytes, 'little'))
+    for slot in dirty:
+      buf[slot >> 3] |= 1 << (slot & 7)
+    self.known = int.from_bytes(buf, 'little')
+    self.dirty = {}
+
+  def label_of(self, sym: Symbol, default: int|None = None) -> int:
+    '''Label of a variable, the join of all elements for an array.'''
+    if sym.slot in self.arrays:
+      return self.arrays[sym.slot].joined
+    elif self.knows_slot(sym.slot):
+      return self.label_at(sym.slot)
     elif default is not None:
       return default
     else:
-      raise RuntimeError(sym)
+      return mask_of(sym.secure)
 
-  def label_of_var(self, sym: Symbol, default: SecLabel|None = None) -> SecLabel:
-    if sym in self.ctxvar:
-      return self.ctxvar[sym]
+  def label_of_var(self, sym: Symbol, default: int|None = None) -> int:
+    if self.knows_slot(sym.slot):
+      return self.label_at(sym.slot)
     elif default is not None:
       return default
     else:
       raise RuntimeError(sym)
 
-  def register_var(self, sym: Symbol, seclabel: SecLabel):
-    assert(sym not in self.ctxvar)
-    self.ctxvar[sym] = seclabel
-
-  def relabel_var(self, sym: Symbol, seclabel: SecLabel):
-    if not sym in self.ctxvar:
-      pprint(self)
-    assert(sym in self.ctxvar)
-    self.ctxvar[sym] = seclabel
-
-
-  def register_array(self, sym: Symbol, seclabels: list[SecLabel]):
-    assert(sym not in self.ctxarr)
-    self.ctxarr[sym] = seclabels
-
-  def register_array_basic(self, sym: Symbol, size: int, seclabel: SecLabel):
-    assert(sym not in self.ctxarr)
-    self.ctxarr[sym] = [seclabel] * size
-
-  def label_of_array_index(self, sym: Symbol, idx: int) -> SecLabel:
-    return self.ctxarr[sym][idx]
-
-  def labels_of_array(self, sym: Symbol) -> list[SecLabel]:
-    return self.ctxarr[sym][::]
-
-  def relabel_array_index(self, sym: Symbol, idx: int, seclabel: SecLabel):
-    self.ctxarr[sym][idx] = seclabel
-
-  def relabel_array(self, sym: Symbol, seclabel: SecLabel):
-    assert(sym in self.ctxarr)
-    self.ctxarr[sym] = [seclabel] * len(self.ctxarr[sym])
-
-  def merge(self, other: 'SecurityContext'):
-    # merge variables
-    for sym, seclabel in other.ctxvar.items():
-      newlabel = seclabel.join(self.label_of_var(sym, SecLabel.LOW))
-      self.relabel_var(sym, newlabel)
-    # merge arrays
-    for sym, seclabels in other.ctxarr.items():
-      assert(sym in self.ctxarr)
-      if sym in self.ctxarr:
-        for idx, seclabel in enumerate(seclabels):
-          nseclabel = seclabel.join(self.label_of_array_index(sym, idx))
-          self.relabel_array_index(sym, idx, nseclabel)
+  def register_var(self, sym: Symbol, seclabel: int):
+    # a definition in a loop body is seen again on every pass through it
+    self.set_label(sym.slot, seclabel)
+
+  def relabel_var(self, sym: Symbol, seclabel: int):
+    assert(self.knows_slot(sym.slot))
+    self.set_label(sym.slot, seclabel)
+
+  def register_array(self, sym: Symbol, seclabels: ArrayLabels):
+    self.arrays[sym.slot] = seclabels
+
+  def register_array_basic(self, sym: Symbol, size: int, seclabel: int):
+    self.arrays[sym.slot] = ArrayLabels.uniform(size, seclabel)
+
+  def label_of_array_index(self, sym: Symbol, idx: int) -> int:
+    if sym.slot in self.arrays:
+      return self.arrays[sym.slot].at(idx)
+    return mask_of(sym.secure)
+
+  def labels_of_array(self, sym: Symbol) -> ArrayLabels:
+    if sym.slot in self.arrays:
+      return self.arrays[sym.slot]
+    return ArrayLabels.uniform(sym.type.length, mask_of(sym.secure))
+
+  def relabel_array_index(self, sym: Symbol, idx: int, seclabel: int):
+    self.arrays[sym.slot] = self.labels_of_array(sym).with_cell(idx, seclabel)
+
+  def relabel_array_join(self, sym: Symbol, seclabel: int):
+    '''Join `seclabel` into the label of every element.'''
+    self.arrays[sym.slot] = self.labels_of_array(sym).join_all(seclabel)
+
+  def join_arrays(self, other: 'SecurityContext') -> bool:
+    changed = False
+    arrays = self.arrays
+    for slot, theirs in other.arrays.items():
+      mine = arrays.get(slot)
+      if mine is None:
+        arrays[slot] = theirs
+        changed = True
+      elif mine is not theirs:
+        joined = mine.join(theirs)
+        if joined is not mine:
+          arrays[slot] = joined
+          changed = True
+    return changed
+
+  def join(self, other: 'SecurityContext') -> bool:
+    '''Join the labels of `other` into these, return whether any changed.'''
+    changed = self.join_arrays(other)
+    if (self.known is other.known and len(self.planes) == len(other.planes)
+        and all(mine is theirs for mine, theirs in zip(self.planes, other.planes))):
+      return self.join_dirty(other) or changed
+    # different planes, fold and OR them
+    self.fold()
+    if other.dirty:
+      other = other.copy()
+      other.fold()
+    planes = self.planes
+    for bit, plane in enumerate(other.planes):
+      if bit == len(planes):
+        planes.append(0)
+      joined = planes[bit] | plane
+      if joined != planes[bit]:
+        planes[bit] = joined
+        changed = True
+    if self.known | other.known != self.known:
+      self.known |= other.known
+      changed = True
+    return changed
+
+  def join_dirty(self, other: 'SecurityContext') -> bool:
+    '''Join `other` into these when both have the same planes: only slots
+    written in either one since then can differ.'''
+    changed = False
+    dirty = self.dirty
+    for slot, mine in dirty.items():
+      if slot not in other.dirty and self.known >> slot & 1:
+        joined = mine | self.base_label(slot)
+        if joined != mine:
+          dirty[slot] = joined
+          changed = True
+    for slot, theirs in other.dirty.items():
+      if slot in dirty:
+        mine = dirty[slot]
+      elif self.known >> slot & 1:
+        mine = self.base_label(slot)
       else:
-        assert(False)
-        self.regarr(sym)
+        # only defined in other
+        dirty[slot] = theirs
+        changed = True
+        continue
+      if mine | theirs != mine:
+        dirty[slot] = mine | theirs
+        changed = True
+    if len(dirty) > FOLD_LIMIT:
+      self.fold()
+    return changed
 
-def fold_fn_returns(acc: list[SecLabel], node: AstNode):
-  match node:
-    case SReturn(secure=sec):
-      return acc + [sec]
-    case _:
-      return fold_tree(fold_fn_returns, acc, node)
+  # checks and notes: reported right away for the program itself, recorded
+  # into the summary for a function body
+
+  def record(self, event: tuple):
+    self.summary.events.append(event)
+
+  def must_be_low(self, seclabel: int, msg: str, span: Span):
+    if self.summary is None:
+      if seclabel & self.lattice.top:
+        report_security_error(msg, span)
+    elif seclabel != LOW:
+      key = ('must_be_low', seclabel, id(span))
+      if key not in self.summary.checks:
+        self.summary.checks.add(key)
+        self.record(('must_be_low', seclabel, msg, span))
+
+  def must_be_high(self, seclabel: int, msg: str, span: Span):
+    if self.summary is None:
+      if not seclabel & self.lattice.top:
+        report_security_error(msg, span)
+    elif not seclabel & self.lattice.top:
+      key = ('must_be_high', seclabel, id(span))
+      if key not in self.summary.checks:
+        self.summary.checks.add(key)
+        self.record(('must_be_high', seclabel, msg, span))
 
-def flow_analysis(node: AstNode, pc: SecLabel, ctx: SecurityContext):
+  def new_note(self, *key) -> bool:
+    '''Whether the note with `key` was not raised yet, now that it is.'''
+    if self.noted is None:
+      return True
+    key = (self.sites, *key)
+    if key in self.noted:
+      return False
+    self.noted.add(key)
+    return True
+
+  def note_var(self, name: str, old: int, new: int, span: Span):
+    if old == new or not self.new_note(id(span), name, new):
+      return
+    if self.summary is None:
+      label = self.lattice.name_of(new)
+      report_note(f'label of {blue(name)} set to {yellow(label)}', span,
+                  preamble_lines=0)
+    else:
+      self.record(('note_var', name, old, new, span))
+
+  def note_index(self, name: str, start: int, end: int, old: int, new: int, span: Span):
+    '''Note that the elements `start` up to `end` of an array changed their
+    label from `old` to `new`.'''
+    if old == new or not self.new_note(id(span), name, start, end, new):
+      return
+    if self.summary is None:
+      # consecutive indices are collapsed into a single range note
+      report_index_note(name, start, end - 1, self.lattice.name_of(new), span)
+    else:
+      self.record(('note_index', name, start, end, old, new, span))
+
+  def note_array(self, name: str, seclabel: int, span: Span):
+    if self.summary is None:
+      if seclabel & self.lattice.top and self.new_note(id(span), name, seclabel):
+        label = self.lattice.name_of(seclabel)
+        report_note(f'label of whole array {blue(name)} set to {yellow(label)}', span,
+          preamble_lines=0)
+    elif seclabel != LOW and self.new_note(id(span), name, seclabel):
+      self.record(('note_array', name, seclabel, span))
+
+  def replay(self, summary: FnSummary, pc: int, args: list[int], site: Span,
+             notes: bool = True):
+    '''Raise the checks and notes of a called function's body, called at
+    span `site`.'''
+    events = summary.events
+    run = None
+    for idx, event in enumerate(events):
+      if event[0] in NOTES:
+        if notes and run is None:
+          run = idx
+        continue
+      if run is not None:
+        self.replay_notes(events, run, idx, pc, args, site)
+        run = None
+      match event:
+        case ('must_be_low', seclabel, msg, span):
+          self.must_be_low(substitute(self.lattice, seclabel, pc, args), msg, span)
+        case ('must_be_high', seclabel, msg, span):
+          self.must_be_high(substitute(self.lattice, seclabel, pc, args), msg, span)
+    if run is not None:
+      self.replay_notes(events, run, len(events), pc, args, site)
+
+  def replay_notes(self, events: list[tuple], start: int, end: int, pc: int, args: list[int],
+                   site: Span):
+    '''Raise the notes `events[start:end]` of a called function's body.
+
+    While summarizing, they are not copied but recorded as a single 'notes'
+    event pointing back into the callee's events, so that a summary stays the
+    size of its own body no matter how deep the calls below it go.
+
+    Each note is told apart by the chain of calls it comes through, so the
+    same callee reports again for every call of it, but not for a call gone
+    through again with the same labels.'''
+    if self.summary is not None:
+      if self.new_note(id(site), id(events), start, pc, tuple(args)):
+        self.record(('notes', events, start, end, pc, args, site))
+      return
+    lattice = self.lattice
+    outer = self.sites
+    # nested runs are expanded with an explicit stack, call chains can be long
+    stack = [(events, start, end, pc, args, (*outer, id(site)))]
+    while stack:
+      events, start, end, pc, args, sites = stack.pop()
+      self.sites = sites
+      for idx in range(start, end):
+        match events[idx]:
+          case ('note_var', name, old, new, span):
+            self.note_var(name, substitute(lattice, old, pc, args),
+                          substitute(lattice, new, pc, args), span)
+          case ('note_index', name, start, end, old, new, span):
+            self.note_index(name, start, end, substitute(lattice, old, pc, args),
+                            substitute(lattice, new, pc, args),
+                            span)
+          case ('note_array', name, seclabel, span):
+            self.note_array(name, substitute(lattice, seclabel, pc, args), span)
+          case ('notes', nevents, nstart, nend, npc, nargs, nsite):
+            # finish the rest of this run after the nested one
+            stack.append((events, idx + 1, end, pc, args, sites))
+            stack.append((nevents, nstart, nend, substitute(lattice, npc, pc, args),
+                          [substitute(lattice, arg, pc, args) for arg in nargs],
+                          (*sites, id(nsite))))
+            break
+    self.sites = outer
+
+def summarize(pass_, sfndef: SFnDef, summaries: SummaryCache, lattice: Lattice) -> FnSummary:
+  '''Analyze a function body once, with its pc and parameters left symbolic.'''
+  summary = FnSummary()
+  fnctx = SecurityContext(lattice=lattice, summaries=summaries, summary=summary)
+  for idx, param in enumerate(sfndef.params):
+    fnctx.register_var(param.sym, param_bit(lattice, idx))
+  solve(pass_, lower_stmts(sfndef.body.stmts), pc_bit(lattice), fnctx)
+  return summary
+
+def call_sccs(root: Symbol, summaries: SummaryCache) -> list[list[Symbol]]:
+  '''Strongly connected components of the call graph below function `root`,
+  callees before callers. Functions with a summary already are left out.
+
+  This is Tarjan's algorithm with an explicit stack, so that long call
+  chains do not run into the recursion limit.'''
+  def callees(sym: Symbol):
+    return iter([callee for callee in summaries.callees(sym)
+                 if summaries.get(callee) is None])
+
+  index = {root: 0}
+  lowlink = {root: 0}
+  stack = [root]
+  onstack = {root}
+  work = [(root, callees(root))]
+  sccs = []
+  while work:
+    sym, it = work[-1]
+    for callee in it:
+      if callee not in index:
+        index[callee] = lowlink[callee] = len(index)
+        stack.append(callee)
+        onstack.add(callee)
+        work.append((callee, callees(callee)))
+        break
+      elif callee in onstack:
+        lowlink[sym] = min(lowlink[sym], index[callee])
+    else:
+      # all callees of sym are done
+      work.pop()
+      if work:
+        caller = work[-1][0]
+        lowlink[caller] = min(lowlink[caller], lowlink[sym])
+      if lowlink[sym] == index[sym]:
+        scc = []
+        while True:
+          member = stack.pop()
+          onstack.remove(member)
+          scc.append(member)
+          if member is sym:
+            break
+        sccs.append(scc)
+  return sccs
+
+def summarize_scc(pass_, scc: list[Symbol], summaries: SummaryCache, lattice: Lattice):
+  '''Summarize a strongly connected component of the call graph.
+
+  The functions of a recursive component start out returning LOW and raising
+  nothing, and are summarized again and again, each time using the summaries
+  of the previous round for calls within the component, until no return label
+  or check changes. Labels only grow and there are finitely many of them, so
+  this terminates.'''
+  recursive = len(scc) > 1 or scc[0] in summaries.callees(scc[0])
+  if not recursive:
+    sym = scc[0]
+    key = summaries.disk_key(sym, lattice)
+    summary = summaries.load(key) if key is not None else None
+    if summary is None:
+      summary = summarize(pass_, sym.type.sfndef, summaries, lattice)
+      if key is not None:
+        summaries.store(key, summary)
+    summaries.put(sym, summary)
+    return
+  pending = summaries.pending
+  for sym in scc:
+    pending[sym] = FnSummary()
+  changed = True
+  while changed:
+    changed = False
+    for sym in scc:
+      summary = summarize(pass_, sym.type.sfndef, summaries, lattice)
+      old = pending[sym]
+      if summary.returns != old.returns or summary.checks != old.checks:
+        changed = True
+      pending[sym] = summary
+  for sym in scc:
+    summaries.put(sym, pending.pop(sym))
+
+def summary_of(pass_, sym: Symbol, summaries: SummaryCache, lattice: Lattice) -> FnSummary:
+  summary = summaries.get(sym)
+  if summary is None:
+    # summarize everything it calls first, bottom-up
+    for scc in call_sccs(sym, summaries):
+      summarize_scc(pass_, scc, summaries, lattice)
+    summary = summaries.get(sym)
+  return summary
+
+def solve(pass_, blocks: list[Block], pc: int, ctx: SecurityContext):
+  '''Propagate labels through the blocks of a program or function body until
+  nothing changes, starting from the labels in `ctx` at `pc`. The labels at
+  the exit block are left in `ctx`.
+
+  Blocks are taken from the worklist in program order, so that straight-line
+  code and branches are analyzed once each, in the same order as the source,
+  and only loops are gone through again. A block is analyzed again only when
+  the labels flowing into it changed, or the pc of the branch controlling it.'''
+  inputs: list[SecurityContext|None] = [None] * len(blocks)
+  inputs[0] = ctx.copy()
+  # pc within the region of each branch block, as of its last visit
+  pcs: dict[int, int] = {}
+  visited = set()
+  noted = set()
+  worklist = [0]
+  queued = {0}
+  def enqueue(idx: int):
+    if idx not in queued:
+      queued.add(idx)
+      heappush(worklist, idx)
+  while worklist:
+    idx = heappop(worklist)
+    queued.remove(idx)
+    block = blocks[idx]
+    first = idx not in visited
+    visited.add(idx)
+    bpc = pc if block.ctl is None else pcs[block.ctl.index]
+    bctx = inputs[idx].copy()
+    bctx.noted = noted
+    for stmt in block.stmts:
+      pass_(stmt, bpc, bctx)
+    match block.branch:
+      case SIf(clause=clause):
+        npc = bpc | pass_(clause, bpc, bctx)
+      case SWhile(clause=clause):
+        # TODO: better error message if inside high if ()
+        npc = bpc | pass_(clause, bpc, bctx)
+        if first:
+          bctx.must_be_low(npc, 'insecure implicit flow - while loop with a high guard', clause.span)
+        else:
+          bctx.must_be_low(npc, 'insecure implicit flow - while loop with a high guard after iteration',
+            clause.span)
+      case _:
+        npc = None
+    if npc is not None and pcs.get(idx) != npc:
+      if idx in pcs:
+        # the branch got more secret, go over everything it controls again
+        for ridx in range(idx + 1, block.region_end + 1):
+          if ridx in visited:
+            enqueue(ridx)
+      pcs[idx] = npc
+    for succ in block.succs:
+      sidx = succ.index
+      if inputs[sidx] is None:
+        inputs[sidx] = bctx.copy()
+        enqueue(sidx)
+      elif inputs[sidx].join(bctx):
+        enqueue(sidx)
+    if idx == len(blocks) - 1:
+      ctx.planes, ctx.known, ctx.dirty, ctx.arrays = \
+        bctx.planes, bctx.known, bctx.dirty, bctx.arrays
+
+def integrate_labels(ast: File, ctx: SecurityContext):
+  '''Store the labels at the end of the program into the symbols of its
+  variables.'''
+  for node in iter_tree(ast):
+    match node:
+      case SGlobal(expr=EId(sym=sym) | EArray(expr=EId(sym=sym))) | \
+           SVarDef(lhs=EId(sym=sym) | EArray(expr=EId(sym=sym))) if ctx.knows(sym):
+        sym.secure = ctx.lattice.label(ctx.label_of(sym))
+
+# Expressions evaluate to their label, statements to None. The tree is only
+# read, never rebuilt.
+flow_analysis = Pass('flow_analysis')
+
+@flow_analysis.otherwise
+def flow_analysis_unhandled(pass_, node: AstNode, pc: int, ctx: SecurityContext):
+  report_error('unhandled node in flow analysis', node.span)
+
+@flow_analysis.on(File)
+def flow_analysis_file(pass_, node: File, pc: int, ctx: SecurityContext):
+  ctx.lattice = node.lattice
+  solve(pass_, lower_stmts([*node.inputs, *node.outputs, *node.stmts]), pc, ctx)
+
+@flow_analysis.on(SDebug)
+def flow_analysis_sdebug(pass_, node: SDebug, pc: int, ctx: SecurityContext):
+  # debug statements were printed by the front end and carry no flows
+  pass
+
+@flow_analysis.on(EId)
+def flow_analysis_eid(pass_, node: EId, pc: int, ctx: SecurityContext):
+  return ctx.label_of_var(node.sym, mask_of(node.sym.secure))
+
+@flow_analysis.on(EInt, EBool, EArrayLiteral)
+def flow_analysis_literal(pass_, node: Expr, pc: int, ctx: SecurityContext):
+  return LOW
+
+@flow_analysis.on(EArray)
+def flow_analysis_earray(pass_, node: EArray, pc: int, ctx: SecurityContext):
   match node:
-    case EId(span, type, _, name, sym):
-      sec = ctx.label_of_var(sym, sym.secure)
-      return EId(span, type, sec, name, sym)
-    case EInt(span, type, _, value):
-      return EInt(span, type, SecLabel.LOW, value)
-    case EBool(span, type, _, value):
-      return EBool(span, type, SecLabel.LOW, value)
-    case EArray(expr=EId(sym=sym), index=EInt() as index):
+    case EArray(_, _, _, EId(sym=sym) as expr, EInt() as index):
       # array access with an integer literal
-      nnode = map_tree(flow_analysis, node, pc, ctx)
+      yield pass_.step(expr, pc, ctx)
       # l_access = join(l_index, l_arr[index])
-      nnode.secure = nnode.index.secure.join(
-        ctx.label_of_array_index(sym, index.value))
-      return nnode
-    case EArray(expr=EId(sym=sym)):
+      return (yield pass_.step(index, pc, ctx)) | ctx.label_of_array_index(sym, index.value)
+    case EArray(_, _, _, EId(sym=sym) as expr, index):
       # array access with a statically-unknown index
-      nnode = map_tree(flow_analysis, node, pc, ctx)
+      yield pass_.step(expr, pc, ctx)
       # l_access = join(l_index, l_arr)
-      nnode.secure = nnode.index.secure.join(ctx.label_of(sym))
-      return nnode
-    case EArrayLiteral(span, type, _, values):
-      nvalues = [flow_analysis(val, pc, ctx) for val in values]
-      return EArrayLiteral(span, type, SecLabel.LOW, nvalues)
-    case EUnOp():
-      nnode = map_tree(flow_analysis, node, pc, ctx)
-      nnode.secure = nnode.expr.secure
-      return nnode
-    case EBinOp():
-      nnode = map_tree(flow_analysis, node, pc, ctx)
-      nnode.secure = nnode.lhs.secure.join(nnode.rhs.secure)
-      return nnode
-    case EDeclassify(span, type, _, expr):
-      nexpr = flow_analysis(expr, pc, ctx)
-      if nexpr.secure is not SecLabel.HIGH:
-        report_security_error('can only declassify high information', span)
-      return EDeclassify(span, type, SecLabel.LOW, nexpr)
-
-    # case SFnDef(span, params, retype, body):
-    #   # create a new SecEnv for this
-    #   fnctx = SecurityContext({}, {})
-    #   for param in params:
-    #     param.sym.
-    case ECall(span, type, _, name, args):
-      nname = flow_analysis(name, pc, ctx)
-      nargs = []
-      for arg in args:
-        nargs.append(flow_analysis(arg, pc, ctx))
+      return (yield pass_.step(index, pc, ctx)) | ctx.label_of(sym)
+    case _:
+      return flow_analysis_unhandled(pass_, node, pc, ctx)
+
+@flow_analysis.on(EUnOp)
+def flow_analysis_eunop(pass_, node: EUnOp, pc: int, ctx: SecurityContext):
+  return (yield pass_.step(node.expr, pc, ctx))
 
+@flow_analysis.on(EBinOp)
+def flow_analysis_ebinop(pass_, node: EBinOp, pc: int, ctx: SecurityContext):
+  return (yield pass_.step(node.lhs, pc, ctx)) | (yield pass_.step(node.rhs, pc, ctx))
+
+@flow_analysis.on(EDeclassify)
+def flow_analysis_edeclassify(pass_, node: EDeclassify, pc: int, ctx: SecurityContext):
+  seclabel = yield pass_.step(node.expr, pc, ctx)
+  ctx.must_be_high(seclabel, 'can only declassify high information', node.span)
+  return LOW
+
+@flow_analysis.on(ECall)
+def flow_analysis_ecall(pass_, node: ECall, pc: int, ctx: SecurityContext):
+  match node:
+    case ECall(_, _, _, name, args):
+      labels = []
+      for arg in args:
+        labels.append((yield pass_.step(arg, pc, ctx)))
       # this is guaranteed by type-checking
       assert(isinstance(name.sym.type, TFn))
-      sfndef = name.sym.type.sfndef
-      # create a new SecEnv for this
-      fnctx = SecurityContext({}, {})
-      # register argument labels
-      for param, narg in zip(sfndef.params, nargs):
-        param.sym.secure = narg.secure
-        fnctx.register_var(param.sym, narg.secure)
-      # process body
-      nbody = flow_analysis(sfndef.body, pc, fnctx)
-      # figure out highest return security label
-      retseclabels = fold_tree(fold_fn_returns, [], nbody)
-      sec = SecLabel.LOW.join(*retseclabels)
-      return ECall(span, type, sec, nname, nargs)
-
-    case SScope():
-      return map_tree(flow_analysis, node, pc, ctx)
-    case SVarDef(span, EId(sym=sym) as lhs, rhs):
+      summary = summary_of(pass_, name.sym, ctx.summaries, ctx.lattice)
+      # a call back into a function that is still being summarized only
+      # raises its checks, its notes are raised by the outermost call
+      ctx.replay(summary, pc, labels, node.span,
+                 notes=name.sym not in ctx.summaries.pending)
+      return substitute(ctx.lattice, summary.returns, pc, labels)
+
+def array_labels(pass_, rhs: Expr, pc: int, ctx: SecurityContext) -> ArrayLabels:
+  match rhs:
+    case EArrayLiteral(values=values):
+      # [...]
+      return ArrayLabels.of_list([pass_(val, pc, ctx) for val in values])
+    case EId(sym=rsym):
+      # y, type-checking made sure it is an array
+      pass_(rhs, pc, ctx)
+      return ctx.labels_of_array(rsym)
+    case _:
+      # should've been caught in type-checking
+      raise RuntimeError(rhs)
+
+@flow_analysis.on(SVarDef)
+def flow_analysis_svardef(pass_, node: SVarDef, pc: int, ctx: SecurityContext):
+  match node:
+    case SVarDef(_, EId(sym=sym) as lhs, rhs):
       # var def
-      nrhs = flow_analysis(rhs, pc, ctx)
-      # register security label for the symbol
-      ctx.register_var(sym, nrhs.secure)
-      # update lhs security label from the symbol
-      nlhs = flow_analysis(lhs, pc, ctx)
-      return SVarDef(span, nlhs, nrhs)
-    case SVarDef(span, EArray() as lhs, rhs):
+      ctx.register_var(sym, pass_(rhs, pc, ctx))
+    case SVarDef(_, EArray() as lhs, rhs):
       # array def
-      nrhs = flow_analysis(rhs, pc, ctx)
-      match nrhs:
-        case EArrayLiteral(values=values):
-          seclabels = [v.secure for v in values][::]
-        case EId(sym=rsym):
-          seclabels = ctx.labels_of_array(rsym)
-        case _:
-          # should've been caught in type-checking
-          raise RuntimeError()
-      # register security labels for the array symbol
-      ctx.register_array(lhs.expr.sym, seclabels)
-      # update lhs security label from the symbol
-      # nlhs = flow_analysis(lhs, pc, ctx)
-      nlhs = lhs
-      return SVarDef(span, nlhs, nrhs)
-    case SFnDef():
-      # this will be processed manually on every ECall(...)
-      return node
+      ctx.register_array(lhs.expr.sym, array_labels(pass_, rhs, pc, ctx))
+    case _:
+      return flow_analysis_unhandled(pass_, node, pc, ctx)
+
+@flow_analysis.on(SAssign)
+def flow_analysis_sassign(pass_, node: SAssign, pc: int, ctx: SecurityContext):
+  match node:
     case SAssign(span, EId(name=name, sym=Symbol(type=TArray()) as sym) as lhs, rhs):
       # x = ... where x is array
       oseclabels = ctx.labels_of_array(sym)
-      nrhs = flow_analysis(rhs, pc, ctx)
-      match nrhs:
-        case EArrayLiteral(values=values):
-          # x = [...]
-          nseclabels = [val.secure for val in values][::]
-        case EId(sym=rsym):
-          # x = y
-          # type-checking made sure y is an array
-          nseclabels = ctx.labels_of_array(rsym)
-        case _:
-          raise RuntimeError(nrhs)
-      for idx, (osec, nsec) in enumerate(zip(oseclabels, nseclabels)):
-        if osec is not nsec:
-          label = str(nsec)
-          # TODO: this can get really verbose
-          report_note(f'label of {blue(name)}[{blue(idx)}] set to {yellow(label)}', span,
-            preamble_lines=0)
-        ctx.relabel_array_index(sym, idx, nsec)
-      nlhs = flow_analysis(lhs, pc, ctx)
-      return SAssign(span, nlhs, nrhs)
+      nseclabels = array_labels(pass_, rhs, pc, ctx)
+      # a note per run of elements, not per element
+      for start, end, osec, nsec in oseclabels.segments(nseclabels):
+        ctx.note_index(name, start, end, osec, nsec, span)
+      ctx.register_array(sym, nseclabels)
     case SAssign(span, EId(name=name, sym=sym) as lhs, rhs):
       # x = ... where x is var
-      origsec = ctx.label_of_var(sym, sym.secure)
-      nrhs = flow_analysis(rhs, pc, ctx)
+      origsec = ctx.label_of_var(sym, mask_of(sym.secure))
       # update variable's security label
-      ctx.relabel_var(sym, pc.join(nrhs.secure))
-      nlhs = flow_analysis(lhs, pc, ctx)
-      if origsec is not ctx.label_of_var(sym):
-        label = str(ctx.label_of_var(sym))
-        report_note(f'label of {blue(name)} set to {yellow(label)}', span,
-                    preamble_lines=0)
-      return SAssign(span, nlhs, nrhs)
-    case SAssign(span, EArray(expr=EId(name=name, sym=sym), index=EInt() as index) as lhs, rhs):
+      ctx.relabel_var(sym, pc | pass_(rhs, pc, ctx))
+      ctx.note_var(name, origsec, ctx.label_of_var(sym), span)
+    case SAssign(span, EArray(expr=EId(name=name, sym=sym), index=EInt() as index) as lhs, rhs) \
+         if 0 <= index.value < sym.type.length:
       # array[EInt()] = ...
-      nrhs = flow_analysis(rhs, pc, ctx)
-      oldsec = ctx.label_of_array_index(sym, index.value)
-      if oldsec != nrhs.secure:
-        label = str(nrhs.secure)
-        report_note(f'label of {blue(name)}[{blue(index.value)}] set to {yellow(label)}', span,
-          preamble_lines=0)
-      ctx.relabel_array_index(sym, index.value, nrhs.secure)
-      nlhs = flow_analysis(lhs, pc, ctx)
-      return SAssign(span, nlhs, nrhs)
+      nsec = pass_(rhs, pc, ctx)
+      ctx.note_index(name, index.value, index.value + 1,
+                     ctx.label_of_array_index(sym, index.value), nsec, span)
+      ctx.relabel_array_index(sym, index.value, nsec)
     case SAssign(span, EArray(expr=EId(name=name, sym=sym)) as lhs, rhs):
-      # array[x] = ...
-      nrhs = flow_analysis(rhs, pc, ctx)
-      nlhs = flow_analysis(lhs, pc, ctx)
-      newsec = nlhs.secure.join(nrhs.secure)
-      if newsec is SecLabel.HIGH:
-        # index is not statically known, hence mark whole array as high
-        report_note(f'label of whole array {blue(name)} set to {yellow("high")}', span,
-          preamble_lines=0)
-        ctx.relabel_array(sym, SecLabel.HIGH)
-      else:
-        # cannot know which index becomes low, so err on the side of
-        # caution and don't mark any as low
-        pass
-      return SAssign(span, nlhs, nrhs)
-    case SIf(span, clause, body, els):
-      nclause = flow_analysis(clause, pc, ctx)
-      npc = pc.join(nclause.secure)
-      els_ctx = ctx.copy()
-      nbody = flow_analysis(body, npc, ctx)
-      nels = flow_analysis(els, npc, els_ctx) if els else None
-      # merge else branch into the original security context
-      ctx.merge(els_ctx)
-      return SIf(span, nclause, nbody, nels)
-    case SWhile(span, clause, body):
-      nclause = flow_analysis(clause, pc, ctx)
-      npc = pc.join(nclause.secure)
-      if npc is SecLabel.HIGH:
-        # TODO: better error message if inside high if ()
-        report_security_error('insecure implicit flow - while loop with a high guard', clause.span)
-      nbody = flow_analysis(body, npc, ctx)
-      nclause = flow_analysis(clause, pc, ctx)
-      npc = pc.join(nclause.secure)
-      if npc is SecLabel.HIGH:
-        # TODO: better error message if inside high if ()
-        report_security_error('insecure implicit flow - while loop with a high guard after iteration',
-          clause.span)
-      return SWhile(span, nclause, nbody)
-    case SThrow(span):
-      if pc is SecLabel.HIGH:
-        report_security_error('throw in high context is not allowed', span)
-      return SThrow(span)
-    case SReturn(span, _, expr):
-      nexpr = flow_analysis(expr, pc, ctx)
-      return SReturn(span, pc.join(nexpr.secure), nexpr)
-    case SGlobal(span, type, expr, origsec):
+      # array[x] = ..., or a constant index out of range: there is no bounds
+      # checking, so any element may be written instead
+      nsec = pass_(rhs, pc, ctx)
+      newsec = pass_(lhs, pc, ctx) | nsec
+      # index is not statically known, hence mark whole array as high; but
+      # cannot know which index becomes low, so err on the side of caution
+      # and don't mark any as low
+      ctx.note_array(name, newsec, span)
+      if newsec != LOW:
+        ctx.relabel_array_join(sym, newsec)
+    case _:
+      return flow_analysis_unhandled(pass_, node, pc, ctx)
+
+@flow_analysis.on(SThrow)
+def flow_analysis_sthrow(pass_, node: SThrow, pc: int, ctx: SecurityContext):
+  ctx.must_be_low(pc, 'throw in high context is not allowed', node.span)
+
+@flow_analysis.on(SReturn)
+def flow_analysis_sreturn(pass_, node: SReturn, pc: int, ctx: SecurityContext):
+  seclabel = pc | pass_(node.expr, pc, ctx)
+  if ctx.summary is not None:
+    ctx.summary.returns |= seclabel
+
+@flow_analysis.on(SGlobal)
+def flow_analysis_sglobal(pass_, node: SGlobal, pc: int, ctx: SecurityContext):
+  match node:
+    case SGlobal(_, _, expr, origsec):
       match expr:
         case EId(sym=sym):
-          ctx.register_var(sym, origsec)
+          ctx.register_var(sym, mask_of(origsec))
         case EArray(expr=EId(sym=sym), index=EInt(value=size)):
-          ctx.register_array_basic(sym, size, origsec)
+          ctx.register_array_basic(sym, size, mask_of(origsec))
         case _:
           report_error(f'unhandled lvalue in flow analysis', expr.span)
       # don't analyze expr itself since there is no reason for it
-      # nexpr = flow_analysis(expr, pc, ctx)
-      return SGlobal(span, type, expr, origsec)
-    case File() | STryCatch():
-      return map_tree(flow_analysis, node, pc, ctx)
-    case _:
-      report_error('unhandled node in flow analysis', node.span)
@@ -1,31 +1,69 @@
+from bisect import bisect_right
 from dataclasses import dataclass, field
 from itertools import count as idcount
-from .types import Type, TUnresolved, SecLabel
-
-@dataclass
+from .types import Type, TUnresolved, SecLabel, Lattice, TWO_POINT
+
+@dataclass(slots=True)
+class SourceFile:
+  '''Source text shared by all spans into it, with a line-start index that is
+  built once on first use.'''
+  text: str = field(repr=False)
+  name: str = '<input>'
+  _line_starts: list[int]|None = field(default=None, init=False, repr=False, compare=False)
+
+  @property
+  def line_starts(self) -> list[int]:
+    if self._line_starts is None:
+      text = self.text
+      starts = [0]
+      idx = text.find('\n')
+      while idx != -1:
+        starts.append(idx + 1)
+        idx = text.find('\n', idx + 1)
+      self._line_starts = starts
+    return self._line_starts
+
+  def lnum_of(self, offset: int) -> int:
+    '''Zero-based number of the line containing `offset`.'''
+    return bisect_right(self.line_starts, offset) - 1
+
+  def line(self, lnum: int) -> str:
+    '''Text of line `lnum`, without its line terminator.'''
+    starts = self.line_starts
+    if lnum >= len(starts):
+      return ''
+    start = starts[lnum]
+    end = starts[lnum + 1] - 1 if lnum + 1 < len(starts) else len(self.text)
+    if end > start and self.text[end - 1] == '\r':
+      end -= 1
+    return self.text[start:end]
+
+@dataclass(slots=True)
 class Span:
   off_start: int
   off_end: int
   lnum: int
   cstart: int
   cend: int
-  src: str = field(repr=False)
+  src: SourceFile = field(repr=False)
 
-@dataclass
+@dataclass(slots=True)
 class Token:
   type: str
   value: str
   span: Span = field(repr=False)
 
-FAKE_SPAN = Span(0, 0, 0, 0, 0, '')
+FAKE_SPAN = Span(0, 0, 0, 0, 0, SourceFile(''))
 TOKEN_EOF = Token('eof', 'eof', FAKE_SPAN)
 
-@dataclass
+@dataclass(slots=True)
 class Symbol:
   name: str
   type: Type
   secure: SecLabel
   origin: Span = field(repr=False)
+  # dense label slot of a variable, see `SymTab.allocate`; -1 for functions
+  slot: int = field(default=-1, repr=False, compare=False)
   id: int = field(default_factory=idcount().__next__, init=False)
 
   def __hash__(self):
@@ -33,152 +71,188 @@ class Symbol:
 
 SYMBOL_UNRESOLVED = Symbol('UNRESOLVED', TUnresolved(), SecLabel.INVALID, FAKE_SPAN)
 
-@dataclass
+@dataclass(slots=True)
 class SymTab:
-  parent: 'SymTab|None'
-  symbols: dict[str, Symbol]
+  '''Symbols visible at the current point of a walk over the program.
+
+  There is one table for all scopes: every name maps to the stack of its
+  definitions, innermost last, and the names defined since a scope was
+  entered are logged so that leaving it pops just those. Lookup, definition
+  and leaving a scope cost the same at any nesting depth.'''
+  # name -> (symbol, scope depth) of each visible definition, innermost last
+  symbols: dict[str, list[tuple[Symbol, int]]] = field(default_factory=dict)
+  # names in order of definition, and where each open scope starts in it
+  log: list[str] = field(default_factory=list)
+  marks: list[int] = field(default_factory=list)
+  # label slots handed out so far
+  nslots: int = 0
 
   def lookup(self, name: str) -> Symbol|None:
-    if name in self.symbols:
-      return self.symbols[name]
-    elif self.parent is not None:
-      # not in this scope
-      return self.parent.lookup(name)
-    else:
-      # not found
-      return None
+    defs = self.symbols.get(name)
+    return defs[-1][0] if defs else None
 
-  def register(self, name: str, sym: Symbol):
-    assert(self.lookup(name) is None)
-    self.symbols[name] = sym
+  def lookup_local(self, name: str) -> Symbol|None:
+    '''Like `lookup`, but only in the innermost scope.'''
+    defs = self.symbols.get(name)
+    if defs and defs[-1][1] == len(self.marks):
+      return defs[-1][0]
+    return None
 
-@dataclass
+  def register(self, name: str, sym: Symbol):
+    assert(self.lookup_local(name) is None)
+    self.symbols.setdefault(name, []).append((sym, len(self.marks)))
+    self.log.append(name)
+
+  def enter(self):
+    self.marks.append(len(self.log))
+
+  def exit(self):
+    mark = self.marks.pop()
+    symbols = self.symbols
+    for name in self.log[mark:]:
+      defs = symbols[name]
+      defs.pop()
+      if not defs:
+        del symbols[name]
+    del self.log[mark:]
+
+  def allocate(self, size: int = 1) -> int:
+    '''Reserve `size` consecutive label slots, numbered densely across the
+    whole program.'''
+    slot = self.nslots
+    self.nslots += size
+    return slot
+
+@dataclass(slots=True)
 class AstNode:
   span: Span = field(repr=False)
 
-@dataclass
+@dataclass(slots=True)
 class Expr(AstNode):
   type: Type
   secure: SecLabel
 
-@dataclass
+@dataclass(slots=True)
 class ELValue(Expr):
   pass
 
-@dataclass
+@dataclass(slots=True)
 class EId(ELValue):
   name: str
   sym: Symbol
 
-@dataclass
+@dataclass(slots=True)
 class EInt(Expr):
   value: int
 
-@dataclass
+@dataclass(slots=True)
 class EBool(Expr):
   value: bool
 
-@dataclass
+@dataclass(slots=True)
 class EArray(ELValue):
   expr: EId
   index: Expr
 
-@dataclass
+@dataclass(slots=True)
 class EArrayLiteral(Expr):
   values: list[Expr]
 
-@dataclass
+@dataclass(slots=True)
 class EUnOp(Expr):
   op: str
   expr: Expr
 
-@dataclass
+@dataclass(slots=True)
 class EBinOp(Expr):
   op: str
   lhs: Expr
   rhs: Expr
 
-@dataclass
+@dataclass(slots=True)
 class FnParam(AstNode):
   type: Type
   name: str
   sym: Symbol
 
-@dataclass
+@dataclass(slots=True)
 class ECall(Expr):
   name: EId
   params: list[Expr]
 
-@dataclass
+@dataclass(slots=True)
 class EDeclassify(Expr):
   expr: Expr
 
-@dataclass
+@dataclass(slots=True)
 class Stmt(AstNode):
   pass
 
-@dataclass
+@dataclass(slots=True)
 class SScope(Stmt):
   stmts: list[Stmt]
   secure: SecLabel
-  symtab: SymTab = field(repr=False)
 
-@dataclass
+@dataclass(slots=True)
 class SVarDef(Stmt):
   lhs: ELValue
   rhs: Expr
 
-@dataclass
+@dataclass(slots=True)
 class SFnDef(Stmt):
   name: EId
   params: list[FnParam]
   retype: Type
   body: SScope
 
-@dataclass
+@dataclass(slots=True)
 class SAssign(Stmt):
   lhs: ELValue
   rhs: Expr
 
-@dataclass
+@dataclass(slots=True)
 class SIf(Stmt):
   clause: Expr
   body: SScope
   else_stmt: SScope | None
   # TODO: allow if (...) do ...
 
-@dataclass
+@dataclass(slots=True)
 class SWhile(Stmt):
   clause: Expr
   body: SScope
 
-@dataclass
+@dataclass(slots=True)
 class STryCatch(Stmt):
   tryBody: SScope
   catchBody: SScope
 
-@dataclass
+@dataclass(slots=True)
 class SThrow(Stmt):
   pass
 
-@dataclass
+@dataclass(slots=True)
 class SDebug(Stmt):
   expr: Expr
 
-@dataclass
+@dataclass(slots=True)
 class SReturn(Stmt):
   secure: SecLabel
   expr: Expr
 
-@dataclass
+@dataclass(slots=True)
 class SGlobal(Stmt):
   type: Type
   expr: ELValue
   orig_secure: SecLabel
 
-@dataclass
+@dataclass(slots=True)
 class File(AstNode):
   stmts: list[Stmt]
   symtab: SymTab = field(repr=False)
   inputs: list[SGlobal]
-  outputs: list[SGlobal]
\ No newline at end of file
+  outputs: list[SGlobal]
+  # language features the parser saw, lets passes with nothing to do be skipped
+  features: set[str] = field(default_factory=set, repr=False)
+  # declared in the `lattice` block
+  lattice: Lattice = field(default=TWO_POINT, repr=False)
\ No newline at end of file
@@ -0,0 +1,494 @@
+'''
+Binary encoding of a type-checked `File`, so that the front end can run once
+and the tree be handed to any number of analysis runs.
+
+# example:
+dump_ast(ast, 'prog.plast')
+ast = load_ast('prog.plast')
+
+A file is a header, a table of string offsets, a stream of little-endian
+32-bit words and the blob of UTF-8 strings the offsets point into. The
+header ends with a CRC-32 of everything after it, so that a damaged file is
+rejected rather than loaded as some other tree. The words are, in order:
+
+  source      name and text (string ids)
+  lattice     number of compartments, their names
+  features    number of features, their names
+  types       number of types, then a record per type, operands first
+  symbols     number of symbols, then a record per symbol
+  symtab      label slots, the definitions of every name, log and marks
+  nodes       number of records, then the node records in post-order
+
+A node record is the class code followed by the class's non-child fields;
+its children are the records right before it, in field order, and a list
+of children stores its length in the record. Nodes that occur twice are
+stored once and referred to by index afterwards. Function definitions that
+are only reachable through the type of their symbol come after the file. Loading maps the file into
+memory and reads the words straight out of the mapping.
+'''
+
+import gc
+import mmap
+import os
+import sys
+import zlib
+from array import array
+from dataclasses import fields
+from .ast import *
+from .types import *
+from .utils import trampoline
+
+MAGIC = b'PLST'
+FORMAT_VERSION = 2
+# magic, then version, number of strings, size of the blob, number of words
+# and checksum
+HEADER_SIZE = len(MAGIC) + 5 * 4
+
+# field kinds
+SPAN = 0
+TYPE = 1
+LABEL = 2
+STR = 3
+INT = 4
+BOOL = 5
+SYM = 6
+NODE = 7
+NODES = 8
+OPTIONAL = 9
+SYMTAB = 10
+FEATURES = 11
+LATTICE = 12
+
+# words that are not a value of their field
+NO_SPAN = -1      # FAKE_SPAN, in place of its start offset
+NO_LABEL = -1     # SecLabel.INVALID
+NO_SYM = -1       # SYMBOL_UNRESOLVED
+BIG_INT = -2**31  # an int that does not fit into a word, followed by its text
+NODE_REF = 0      # in place of a class code: a node stored before, by index
+
+# type codes
+T_UNRESOLVED = 0
+T_INT = 1
+T_BOOL = 2
+T_ARRAY = 3
+T_FN = 4
+SCALARS = {TUnresolved(): T_UNRESOLVED, TInt(): T_INT, TBool(): T_BOOL}
+
+class AstFormatError(Exception):
+  '''The file is not a binary AST this compiler can read, or the tree cannot
+  be written as one.'''
+
+# node class -> code, and code -> (class, kinds of its constructor fields)
+CODES: dict[type, int] = {}
+CLASSES: list[tuple[type, tuple[int, ...]]] = [(None, ())]
+
+def _register(cls: type, *kinds: int):
+  assert len(kinds) == len([f for f in fields(cls) if f.init]), cls
+  CODES[cls] = len(CLASSES)
+  CLASSES.append((cls, kinds))
+
+_register(EId, SPAN, TYPE, LABEL, STR, SYM)
+_register(EInt, SPAN, TYPE, LABEL, INT)
+_register(EBool, SPAN, TYPE, LABEL, BOOL)
+_register(EArray, SPAN, TYPE, LABEL, NODE, NODE)
+_register(EArrayLiteral, SPAN, TYPE, LABEL, NODES)
+_register(EUnOp, SPAN, TYPE, LABEL, STR, NODE)
+_register(EBinOp, SPAN, TYPE, LABEL, STR, NODE, NODE)
+_register(FnParam, SPAN, TYPE, STR, SYM)
+_register(ECall, SPAN, TYPE, LABEL, NODE, NODES)
+_register(EDeclassify, SPAN, TYPE, LABEL, NODE)
+_register(SScope, SPAN, NODES, LABEL)
+_register(SVarDef, SPAN, NODE, NODE)
+_register(SFnDef, SPAN, NODE, NODES, TYPE, NODE)
+_register(SAssign, SPAN, NODE, NODE)
+_register(SIf, SPAN, NODE, NODE, OPTIONAL)
+_register(SWhile, SPAN, NODE, NODE)
+_register(STryCatch, SPAN, NODE, NODE)
+_register(SThrow, SPAN)
+_register(SDebug, SPAN, NODE)
+_register(SReturn, SPAN, LABEL, NODE)
+_register(SGlobal, SPAN, TYPE, NODE, LABEL)
+_register(File, SPAN, NODES, SYMTAB, NODES, NODES, FEATURES, LATTICE)
+
+class _Writer:
+  def __init__(self, ast: File):
+    self.ast = ast
+    self.src = None
+    self.strings: dict[str, int] = {}
+    self.types: dict[int, int] = {}
+    self.type_words: list[int] = []
+    self.ntypes = 0
+    self.syms: dict[Symbol, int] = {}
+    self.nodes: dict[int, int] = {}
+    self.node_words: list[int] = []
+    self.nrecords = 0
+    self.fns: list[tuple[int, SFnDef]] = []
+
+  def string(self, s: str) -> int:
+    idx = self.strings.get(s)
+    if idx is None:
+      idx = self.strings[s] = len(self.strings)
+    return idx
+
+  def int(self, value: int, out: list[int]):
+    if -2**31 < value < 2**31:
+      out.append(value)
+    else:
+      out += (BIG_INT, self.string(str(value)))
+
+  def span(self, span: Span, out: list[int]):
+    if span is FAKE_SPAN:
+      out += (NO_SPAN, 0, 0, 0, 0)
+      return
+    if self.src is None:
+      self.src = span.src
+    elif span.src is not self.src:
+      raise AstFormatError(f'span into a second source file {span.src.name}')
+    out += (span.off_start, span.off_end, span.lnum, span.cstart, span.cend)
+
+  def label(self, seclabel: SecLabel) -> int:
+    if seclabel.lattice is None:
+      return NO_LABEL
+    if seclabel.lattice != self.ast.lattice:
+      raise AstFormatError(f'label {seclabel} of another lattice')
+    return seclabel.mask
+
+  def type(self, type_: Type) -> int:
+    # operands are written first, so that loading can build types in order
+    idx = self.types.get(id(type_))
+    if idx is not None:
+      return idx
+    code = SCALARS.get(type_) if isinstance(type_, ScalarType) else None
+    if code is not None:
+      words = [code]
+    else:
+      match type_:
+        case TArray(of, length):
+          words = [T_ARRAY, self.type(of)]
+          self.int(length, words)
+        case TFn(retype, params, sfndef):
+          words = [T_FN, self.type(retype), len(params), *map(self.type, params), 0]
+          self.fns.append((len(self.type_words) + len(words) - 1, sfndef))
+        case _:
+          raise AstFormatError(f'cannot encode type {type_!r}')
+    idx = self.types[id(type_)] = self.ntypes
+    self.ntypes += 1
+    self.type_words += words
+    return idx
+
+  def sym(self, sym: Symbol) -> int:
+    if sym is SYMBOL_UNRESOLVED:
+      return NO_SYM
+    idx = self.syms.get(sym)
+    if idx is None:
+      idx = self.syms[sym] = len(self.syms)
+    return idx
+
+  def node(self, node: AstNode):
+    # children are written before their parent, by a generator that yields
+    # them to `trampoline` instead of recursing into arbitrarily deep trees
+    idx = self.nodes.get(id(node))
+    out = self.node_words
+    self.nrecords += 1
+    if idx is not None:
+      out += (NODE_REF, idx)
+      return
+    code = CODES.get(type(node))
+    if code is None:
+      raise AstFormatError(f'cannot encode node {type(node).__name__}')
+    cls, kinds = CLASSES[code]
+    record = [code]
+    for f, kind in zip(fields(cls), kinds):
+      value = getattr(node, f.name)
+      if kind == SPAN:
+        self.span(value, record)
+      elif kind == TYPE:
+        record.append(self.type(value))
+      elif kind == LABEL:
+        record.append(self.label(value))
+      elif kind == STR:
+        record.append(self.string(value))
+      elif kind == INT:
+        self.int(value, record)
+      elif kind == BOOL:
+        record.append(int(value))
+      elif kind == SYM:
+        record.append(self.sym(value))
+      elif kind == NODE:
+        yield self.node(value)
+      elif kind == NODES:
+        for child in value:
+          yield self.node(child)
+        record.append(len(value))
+      elif kind == OPTIONAL:
+        if value is not None:
+          yield self.node(value)
+        record.append(int(value is not None))
+      # SYMTAB, FEATURES and LATTICE are sections of their own
+    self.nodes[id(node)] = len(self.nodes)
+    out += record
+
+  def symtab(self, symtab: SymTab) -> list[int]:
+    words = [symtab.nslots, len(symtab.symbols)]
+    for name, defs in symtab.symbols.items():
+      words += (self.string(name), len(defs))
+      for sym, depth in defs:
+        words += (self.sym(sym), depth)
+    words.append(len(symtab.log))
+    words += map(self.string, symtab.log)
+    words.append(len(symtab.marks))
+    words += symtab.marks
+    return words
+
+  def write(self) -> bytes:
+    ast = self.ast
+    if ast.lattice.width > 30:
+      raise AstFormatError('lattice too wide for the binary AST format')
+    trampoline(self.node(ast))
+    symtab = self.symtab(ast.symtab)
+    # the type of a function points at its definition as type annotation
+    # left it, which later passes may have replaced in the tree: such
+    # definitions follow the file as roots of their own. They and the types
+    # of symbols can bring in more of either.
+    sym_words = []
+    nsyms = nfns = 0
+    while nsyms < len(self.syms) or nfns < len(self.fns):
+      while nfns < len(self.fns):
+        sfndef = self.fns[nfns][1]
+        if id(sfndef) not in self.nodes:
+          trampoline(self.node(sfndef))
+        nfns += 1
+      for sym in list(self.syms)[nsyms:]:
+        sym_words += (self.string(sym.name), self.type(sym.type), self.label(sym.secure))
+        self.span(sym.origin, sym_words)
+        sym_words.append(sym.slot)
+        nsyms += 1
+    sym_words.insert(0, nsyms)
+    for pos, sfndef in self.fns:
+      self.type_words[pos] = self.nodes[id(sfndef)]
+    src = self.src or SourceFile('')
+    words = [self.string(src.name), self.string(src.text)]
+    words.append(ast.lattice.width)
+    words += map(self.string, ast.lattice.compartments)
+    features = sorted(ast.features)
+    words.append(len(features))
+    words += map(self.string, features)
+    words.append(self.ntypes)
+    words += self.type_words
+    words += sym_words
+    words += symtab
+    words.append(self.nrecords)
+    words += self.node_words
+
+    blob = bytearray()
+    offsets = array('i', [0])
+    for s in self.strings:
+      blob += s.encode()
+      offsets.append(len(blob))
+    blob += bytes(-len(blob) % 4)
+    words = array('i', words)
+    if sys.byteorder == 'big':
+      for part in offsets, words:
+        part.byteswap()
+    body = [offsets.tobytes(), words.tobytes(), blob]
+    checksum = 0
+    for part in body:
+      checksum = zlib.crc32(part, checksum)
+    header = array('I', [FORMAT_VERSION, len(self.strings), len(blob), len(words), checksum])
+    if sys.byteorder == 'big':
+      header.byteswap()
+    return b''.join([MAGIC, header.tobytes(), *body])
+
+def dumps_ast(ast: File) -> bytes:
+  return _Writer(ast).write()
+
+def dump_ast(ast: File, path: str):
+  data = dumps_ast(ast)
+  with open(path, 'wb') as fp:
+    fp.write(data)
+
+def _words(data, start: int, count: int):
+  '''`count` words from `data` at byte offset `start`, without copying where
+  the byte order allows.'''
+  view = memoryview(data)[start:start + 4 * count]
+  if sys.byteorder == 'little':
+    return view.cast('i')
+  words = array('i', view)
+  words.byteswap()
+  return words
+
+def _release(view):
+  if isinstance(view, memoryview):
+    view.release()
+
+def loads_ast(data) -> File:
+  '''Decode a `File` from a bytes-like object, such as a memory map. No view
+  into `data` is left behind, so that a map can be closed right after, also
+  when decoding fails.'''
+  if len(data) < HEADER_SIZE or data[:len(MAGIC)] != MAGIC:
+    raise AstFormatError('not a binary AST file')
+  header = _words(data, len(MAGIC), 5)
+  version, nstrings, blob_size, nwords, checksum = header
+  _release(header)
+  if version != FORMAT_VERSION:
+    raise AstFormatError(f'binary AST format {version}, expected {FORMAT_VERSION}')
+  offsets_start = HEADER_SIZE
+  words_start = offsets_start + 4 * (nstrings + 1)
+  blob_start = words_start + 4 * nwords
+  if nstrings < 0 or nwords < 0 or blob_size < 0 or len(data) != blob_start + blob_size:
+    raise AstFormatError('truncated binary AST file')
+  with memoryview(data) as view:
+    if zlib.crc32(view[HEADER_SIZE:]) != checksum & 0xffffffff:
+      raise AstFormatError('binary AST file is damaged (checksum mismatch)')
+  offsets = words = blob = None
+  # nothing read is garbage, collecting while building the tree only makes
+  # every collection walk more of it
+  enabled = gc.isenabled()
+  gc.disable()
+  try:
+    offsets = _words(data, offsets_start, nstrings + 1)
+    blob = memoryview(data)[blob_start:]
+    strings = [str(blob[offsets[i]:offsets[i + 1]], 'utf-8') for i in range(nstrings)]
+    words = _words(data, words_start, nwords)
+    it = iter(words)
+    ast = _read(strings, it.__next__)
+    if next(it, None) is not None:
+      raise AstFormatError('binary AST file has words left over')
+    return ast
+  except (StopIteration, IndexError, KeyError, ValueError, TypeError) as e:
+    raise AstFormatError(f'corrupt binary AST file ({e})') from None
+  finally:
+    for view in offsets, words, blob:
+      _release(view)
+    if enabled:
+      gc.enable()
+
+def load_ast(path: str) -> File:
+  with open(path, 'rb') as fp:
+    # mmap refuses empty files
+    if os.fstat(fp.fileno()).st_size < HEADER_SIZE:
+      raise AstFormatError('not a binary AST file')
+    with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      return loads_ast(data)
+
+def _read(strings: list[str], nxt) -> File:
+  name = strings[nxt()]
+  src = SourceFile(strings[nxt()], name)
+  lattice = Lattice(tuple(strings[nxt()] for _ in range(nxt())))
+  if lattice == TWO_POINT:
+    lattice = TWO_POINT
+  labels = lattice.labels
+  features = {strings[nxt()] for _ in range(nxt())}
+
+  def integer() -> int:
+    value = nxt()
+    return int(strings[nxt()]) if value == BIG_INT else value
+
+  def span() -> Span:
+    off_start = nxt()
+    if off_start == NO_SPAN:
+      nxt(); nxt(); nxt(); nxt()
+      return FAKE_SPAN
+    return Span(off_start, nxt(), nxt(), nxt(), nxt(), src)
+
+  def label() -> SecLabel:
+    mask = nxt()
+    if mask == NO_LABEL:
+      return SecLabel.INVALID
+    seclabel = labels.get(mask)
+    return seclabel if seclabel is not None else lattice.label(mask)
+
+  scalars = {code: type_ for type_, code in SCALARS.items()}
+  types: list[Type] = []
+  fns: list[tuple[TFn, int]] = []
+  for _ in range(nxt()):
+    code = nxt()
+    if code == T_ARRAY:
+      types.append(TArray(types[nxt()], integer()))
+    elif code == T_FN:
+      fn = TFn(types[nxt()], [types[nxt()] for _ in range(nxt())], None)
+      fns.append((fn, nxt()))
+      types.append(fn)
+    elif code in scalars:
+      types.append(scalars[code])
+    else:
+      raise AstFormatError(f'unknown type code {code}')
+
+  syms: list[Symbol] = []
+  for _ in range(nxt()):
+    sym = Symbol(strings[nxt()], types[nxt()], label(), span())
+    sym.slot = nxt()
+    syms.append(sym)
+  sym_of = lambda idx: SYMBOL_UNRESOLVED if idx == NO_SYM else syms[idx]
+
+  symtab = SymTab(nslots=nxt())
+  for _ in range(nxt()):
+    name = strings[nxt()]
+    symtab.symbols[name] = [(sym_of(nxt()), nxt()) for _ in range(nxt())]
+  symtab.log = [strings[nxt()] for _ in range(nxt())]
+  symtab.marks = [nxt() for _ in range(nxt())]
+
+  nodes: list[AstNode] = []
+  stack: list[AstNode] = []
+  for _ in range(nxt()):
+    code = nxt()
+    if code == NODE_REF:
+      stack.append(nodes[nxt()])
+      continue
+    if not 0 < code < len(CLASSES):
+      raise AstFormatError(f'unknown node class {code}')
+    cls, kinds = CLASSES[code]
+    args = []
+    # children: how many of the stack's top entries each child field takes
+    takes = []
+    ntakes = 0
+    for kind in kinds:
+      if kind == SPAN:
+        args.append(span())
+      elif kind == TYPE:
+        args.append(types[nxt()])
+      elif kind == LABEL:
+        args.append(label())
+      elif kind == STR:
+        args.append(strings[nxt()])
+      elif kind == INT:
+        args.append(integer())
+      elif kind == BOOL:
+        args.append(nxt() != 0)
+      elif kind == SYM:
+        args.append(sym_of(nxt()))
+      elif kind == NODE:
+        takes.append((len(args), 1, kind))
+        args.append(None)
+        ntakes += 1
+      elif kind == NODES or kind == OPTIONAL:
+        count = nxt()
+        takes.append((len(args), count, kind))
+        args.append(None)
+        ntakes += count
+      elif kind == SYMTAB:
+        args.append(symtab)
+      elif kind == FEATURES:
+        args.append(features)
+      else:
+        args.append(lattice)
+    if takes:
+      top = len(stack) - ntakes
+      children = stack[top:]
+      del stack[top:]
+      pos = 0
+      for arg, count, kind in takes:
+        if kind == NODES:
+          args[arg] = children[pos:pos + count]
+        elif count:
+          args[arg] = children[pos]
+        pos += count
+    node = cls(*args)
+    nodes.append(node)
+    stack.append(node)
+
+  for fn, idx in fns:
+    fn.sfndef = nodes[idx]
+  if not stack or not isinstance(stack[0], File):
+    raise AstFormatError('binary AST file does not hold a file')
+  return stack[0]
@@ -0,0 +1,236 @@
+'''
+On-disk cache of compile results, content-addressed by what went into them.
+
+# example:
+cache = CompileCache(default_cache_dir())
+key = cache.key('ast', source_text)
+ast = cache.load('ast', key)
+if ast is None:
+  ast = ...
+  cache.store('ast', key, ast)
+
+Every key also covers the compiler's own source (`compiler_version`), so an
+entry is never used by a compiler other than the one that wrote it. Entries
+are pickles in `<root>/<kind>/<key[:2]>/<key>`; they are written atomically
+and are touched on every hit, and `evict` drops the least recently used ones
+once the directory grows over its size limit. A long-lived process can also
+keep the most recently used entries in memory, see `memory_bytes`.
+
+The size of the directory is estimated by `<root>/usage`, which grows by a
+byte for every USAGE_UNIT bytes stored, so that `evict` only walks the
+directory when the estimate is over the limit.
+'''
+
+import hashlib
+import io
+import os
+import pickle
+from collections import OrderedDict
+from glob import glob
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+USAGE_UNIT = 1024
+# share of the size limit that eviction leaves, so that the next walk of the
+# directory only comes after a tenth of the limit has been stored again
+EVICT_TO = 0.9
+
+_version: str|None = None
+
+def compiler_version() -> str:
+  '''Hash of the compiler's sources, or of the bundle it runs from (see
+  bundle.py).'''
+  global _version
+  if _version is None:
+    digest = hashlib.sha256()
+    if os.path.isfile(ROOT):
+      # running from a bundle, which holds all of the sources
+      paths = [ROOT]
+    else:
+      paths = sorted(glob(os.path.join(ROOT, '*.py')) + glob(os.path.join(ROOT, 'lib', '*.py')))
+      paths.insert(0, os.path.join(ROOT, 'palisade'))
+    for path in paths:
+      digest.update(os.path.relpath(path, ROOT).encode())
+      with open(path, 'rb') as fp:
+        digest.update(fp.read())
+    _version = digest.hexdigest()
+  return _version
+
+def default_cache_dir() -> str:
+  '''$PALISADE_CACHE_DIR, or palisade/ under $XDG_CACHE_HOME (~/.cache).'''
+  path = os.environ.get('PALISADE_CACHE_DIR')
+  if path:
+    return path
+  base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+  return os.path.join(base, 'palisade')
+
+def report_key(cache: 'CompileCache', text: str, diagnostics: str, max_notes: int|None,
+               color: bool) -> str:
+  '''Key of the report of compiling `text` with these options.'''
+  return cache.key('report', text, diagnostics, str(max_notes), str(color))
+
+class _Pickler(pickle.Pickler):
+  def __init__(self, file, persistent_id):
+    super().__init__(file, pickle.HIGHEST_PROTOCOL)
+    self._persistent_id = persistent_id
+
+  def persistent_id(self, obj):
+    return self._persistent_id(obj)
+
+class _Unpickler(pickle.Unpickler):
+  def __init__(self, file, persistent_load):
+    super().__init__(file)
+    self._persistent_load = persistent_load
+
+  def persistent_load(self, pid):
+    return self._persistent_load(pid)
+
+class Uncacheable(Exception):
+  '''Raised by a `persistent_id` function for objects that cannot be stored.'''
+
+class CompileCache:
+  def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES, memory_bytes: int = 0):
+    self.root = root
+    self.max_bytes = max_bytes
+    self.stored = False
+    # pickled entries by path, least recently used first, up to memory_bytes
+    self.memory: OrderedDict[str, bytes] = OrderedDict()
+    self.memory_bytes = memory_bytes
+    self.memory_used = 0
+
+  def key(self, *parts: str|bytes) -> str:
+    digest = hashlib.sha256(compiler_version().encode())
+    for part in parts:
+      if isinstance(part, str):
+        part = part.encode()
+      # length-prefixed, so that parts cannot run into each other
+      digest.update(len(part).to_bytes(8, 'little'))
+      digest.update(part)
+    return digest.hexdigest()
+
+  def path(self, kind: str, key: str) -> str:
+    return os.path.join(self.root, kind, key[:2], key)
+
+  def load(self, kind: str, key: str, persistent_load=None):
+    '''The entry stored under `key`, or None. `persistent_load` resolves the
+    ids handed out by `persistent_id` when the entry was stored.'''
+    path = self.path(kind, key)
+    data = self.memory.get(path)
+    if data is not None:
+      self.memory.move_to_end(path)
+    else:
+      try:
+        with open(path, 'rb') as fp:
+          data = fp.read()
+        os.utime(path)
+      except OSError:
+        return None
+      self.remember(path, data)
+    try:
+      if persistent_load is None:
+        return pickle.loads(data)
+      return _Unpickler(io.BytesIO(data), persistent_load).load()
+    except Exception:
+      # written by a broken run or unreadable for some other reason, treat
+      # it as missing; it is replaced by the next store
+      return None
+
+  def store(self, kind: str, key: str, obj, persistent_id=None) -> bool:
+    '''Store `obj` under `key`. `persistent_id` may return an id to store in
+    place of an object, or raise `Uncacheable` to give up on the entry.
+    Returns whether the entry was written.'''
+    try:
+      if persistent_id is None:
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+      else:
+        buf = io.BytesIO()
+        _Pickler(buf, persistent_id).dump(obj)
+        data = buf.getvalue()
+    except (Uncacheable, RecursionError, pickle.PicklingError):
+      return False
+    path = self.path(kind, key)
+    try:
+      import tempfile
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+      with os.fdopen(fd, 'wb') as fp:
+        fp.write(data)
+      os.replace(tmp, path)
+    except OSError:
+      return False
+    self.stored = True
+    self.remember(path, data)
+    self.account(len(data))
+    return True
+
+  def usage_path(self) -> str:
+    return os.path.join(self.root, 'usage')
+
+  def account(self, size: int):
+    '''Add `size` bytes to the estimate in the usage file. Appends are
+    atomic, so compiles running side by side do not lose each other's.'''
+    try:
+      fd = os.open(self.usage_path(), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+      try:
+        os.write(fd, bytes(-(-size // USAGE_UNIT)))
+      finally:
+        os.close(fd)
+    except OSError:
+      pass
+
+  def remember(self, path: str, data: bytes):
+    if len(data) > self.memory_bytes:
+      return
+    old = self.memory.pop(path, None)
+    if old is not None:
+      self.memory_used -= len(old)
+    self.memory[path] = data
+    self.memory_used += len(data)
+    while self.memory_used > self.memory_bytes:
+      _, old = self.memory.popitem(last=False)
+      self.memory_used -= len(old)
+
+  def evict(self):
+    '''Remove the least recently used entries once the cache has grown over
+    `max_bytes`, down to EVICT_TO of it. Until the usage file says so, this
+    is a single stat.'''
+    try:
+      if os.stat(self.usage_path()).st_size * USAGE_UNIT <= self.max_bytes:
+        return
+    except OSError:
+      # no estimate yet, or of a cache written before there was one
+      pass
+    entries = []
+    total = 0
+    for dirpath, _, filenames in os.walk(self.root):
+      if dirpath == self.root:
+        # the usage file, entries are in directories by kind
+        continue
+      for name in filenames:
+        path = os.path.join(dirpath, name)
+        try:
+          stat = os.stat(path)
+        except OSError:
+          continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    if total > self.max_bytes:
+      entries.sort()
+      for _, size, path in entries:
+        try:
+          os.remove(path)
+        except OSError:
+          continue
+        total -= size
+        if total <= self.max_bytes * EVICT_TO:
+          break
+    # start over from the actual size; what other compiles stored while the
+    # directory was walked is not counted, the next walk makes up for it
+    try:
+      import tempfile
+      fd, tmp = tempfile.mkstemp(dir=self.root)
+      with os.fdopen(fd, 'wb') as fp:
+        fp.write(bytes(-(-total // USAGE_UNIT)))
+      os.replace(tmp, self.usage_path())
+    except OSError:
+      pass
@@ -0,0 +1,96 @@
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+
+@dataclass(slots=True)
+class StageTiming:
+  name: str
+  wall: float = 0.0
+  cpu: float = 0.0
+  # AST nodes after the stage (tokens for tokenize), None if not applicable
+  nodes: int|None = None
+  # peak traced memory above what was allocated when the stage started
+  mem_peak: int|None = None
+  skipped: bool = False
+
+class PassTimer:
+  '''Per-stage wall/CPU time, node counts and (optionally) peak memory, for
+  `compile --time-passes`. A disabled timer only hands out no-op stages.
+
+  A compile with an enabled timer runs without the compile cache (see
+  `driver.compile_file`), so every pass has a stage of its own rather than
+  a cached tree or report standing in for them.'''
+  def __init__(self, enabled: bool = False, memory: bool = False):
+    self.enabled = enabled
+    self.memory = enabled and memory
+    self.stages: list[StageTiming] = []
+
+  @contextmanager
+  def stage(self, name: str):
+    if not self.enabled:
+      yield None
+      return
+    record = StageTiming(name)
+    self.stages.append(record)
+    if self.memory:
+      import tracemalloc
+      if not tracemalloc.is_tracing():
+        tracemalloc.start()
+      tracemalloc.reset_peak()
+      mem_start = tracemalloc.get_traced_memory()[0]
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    try:
+      yield record
+    finally:
+      record.wall = time.perf_counter() - wall_start
+      record.cpu = time.process_time() - cpu_start
+      if self.memory:
+        record.mem_peak = tracemalloc.get_traced_memory()[1] - mem_start
+
+  def skip(self, name: str):
+    if self.enabled:
+      self.stages.append(StageTiming(name, skipped=True))
+
+  def report(self, format: str = 'text', file=None):
+    if not self.enabled:
+      return
+    file = file or sys.stderr
+    if format == 'json':
+      import json
+      json.dump({'stages': [asdict(stage) for stage in self.stages]}, file, indent=2)
+      file.write('\n')
+      return
+    header = f'{"stage":<28}{"wall ms":>10}{"cpu ms":>10}{"nodes":>10}'
+    if self.memory:
+      header += f'{"peak KiB":>12}'
+    print(header, file=file)
+    total = StageTiming('total')
+    for stage in self.stages:
+      if stage.skipped:
+        print(f'{stage.name:<28}{"skipped":>10}', file=file)
+        continue
+      total.wall += stage.wall
+      total.cpu += stage.cpu
+      nodes = '' if stage.nodes is None else stage.nodes
+      line = f'{stage.name:<28}{stage.wall * 1000:>10.2f}{stage.cpu * 1000:>10.2f}{nodes:>10}'
+      if self.memory:
+        line += f'{stage.mem_peak / 1024:>12.1f}'
+      print(line, file=file)
+    print(f'{total.name:<28}{total.wall * 1000:>10.2f}{total.cpu * 1000:>10.2f}', file=file)
+
+@contextmanager
+def profiled(path: str|None):
+  '''Run the body under cProfile and write the stats to `path`, if given.'''
+  if path is None:
+    yield
+    return
+  import cProfile
+  profiler = cProfile.Profile()
+  profiler.enable()
+  try:
+    yield
+  finally:
+    profiler.disable()
+    profiler.dump_stats(path)
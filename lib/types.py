@@ -1,22 +1,87 @@
 from dataclasses import dataclass
-from enum import Enum, auto
 
-class SecLabel(Enum):
-  INVALID = auto()
-  LOW = auto()
-  HIGH = auto()
+class Lattice:
+  '''Security lattice of a program: the sets of compartments declared in its
+  `lattice` block, ordered by inclusion.
+
+  Labels are bitmasks with one bit per compartment, so the join of two labels
+  is `|` and `a <= b` is `a & ~b == 0`. `low` is the empty set and `high` the
+  set of all compartments. A program without a `lattice` block has the single
+  compartment `high`, which makes the usual two-point lattice.'''
+  __slots__ = ('compartments', 'bits', 'width', 'top', 'labels')
+
+  def __init__(self, compartments: tuple[str, ...]):
+    self.compartments = compartments
+    self.bits = {name: 1 << idx for idx, name in enumerate(compartments)}
+    self.width = len(compartments)
+    self.top = (1 << self.width) - 1
+    # interned labels, by mask
+    self.labels: dict[int, SecLabel] = {}
+
+  def __eq__(self, other) -> bool:
+    return isinstance(other, Lattice) and self.compartments == other.compartments
+
+  def __hash__(self) -> int:
+    return hash(self.compartments)
+
+  def __repr__(self) -> str:
+    return f'<lattice {", ".join(self.compartments)}>'
+
+  def __reduce__(self):
+    return (Lattice, (self.compartments,))
+
+  def label(self, mask: int) -> 'SecLabel':
+    seclabel = self.labels.get(mask)
+    if seclabel is None:
+      seclabel = self.labels[mask] = SecLabel(mask, self)
+    return seclabel
+
+  def leq(self, lhs: int, rhs: int) -> bool:
+    return lhs & ~rhs == 0
+
+  def name_of(self, mask: int) -> str:
+    if mask == 0:
+      return 'low'
+    elif mask == self.top:
+      return 'high'
+    return '+'.join(name for name in self.compartments if mask & self.bits[name])
+
+class SecLabel:
+  '''A label of a `Lattice`. LOW and HIGH are the labels of the two-point
+  lattice, INVALID marks nodes that have not been given one.'''
+  __slots__ = ('mask', 'lattice')
+
+  def __init__(self, mask: int, lattice: Lattice|None):
+    self.mask = mask
+    self.lattice = lattice
+
+  def __eq__(self, other) -> bool:
+    return (isinstance(other, SecLabel) and self.mask == other.mask
+            and self.lattice == other.lattice)
+
+  def __hash__(self) -> int:
+    return hash((self.mask, self.lattice))
+
+  def __reduce__(self):
+    if self.lattice is None:
+      return (SecLabel, (self.mask, None))
+    return (self.lattice.label, (self.mask,))
 
   def join(self, *others: 'SecLabel') -> 'SecLabel':
     # always traverse to find any INVALID labels
     result = self
-    for i in range(len(others)):
-      match others[i]:
-        case SecLabel.HIGH:
-          result = SecLabel.HIGH
-        case SecLabel.LOW:
-          pass
-        case _:
-          raise RuntimeError(others[i])
+    for other in others:
+      if other.lattice is None:
+        raise RuntimeError(other)
+      if result.lattice is None:
+        # as with the two-point enum, INVALID only gives way to a label
+        # above low
+        if other.mask:
+          result = other
+        continue
+      assert other.lattice is result.lattice, (result, other)
+      if other.mask & ~result.mask:
+        result = result.lattice.label(result.mask | other.mask)
     return result
 
   @staticmethod
@@ -30,41 +95,59 @@ class SecLabel(Enum):
         raise RuntimeError(label)
 
   def __str__(self) -> str:
-    match self:
-      case SecLabel.LOW:
-        return 'low'
-      case SecLabel.HIGH:
-        return 'high'
-      case SecLabel.INVALID:
-        return 'invalid'
-      case _:
-        raise RuntimeError(self)
+    if self.lattice is None:
+      return 'invalid'
+    return self.lattice.name_of(self.mask)
 
   def __repr__(self) -> str:
     return f'<{str(self)}>'
 
-@dataclass
+TWO_POINT = Lattice(('high',))
+SecLabel.INVALID = SecLabel(0, None)
+SecLabel.LOW = TWO_POINT.label(0)
+SecLabel.HIGH = TWO_POINT.label(1)
+
+@dataclass(slots=True)
 class Type:
   pass
 
-@dataclass
-class TUnresolved(Type):
-  pass
+class ScalarType(Type):
+  '''Types without parameters. Each of them has a single shared instance, so
+  `TInt()` allocates nothing and types compare by identity.'''
+  __slots__ = ()
 
-@dataclass
-class TInt(Type):
-  pass
+  def __new__(cls):
+    instance = SCALAR_TYPES.get(cls)
+    if instance is None:
+      instance = SCALAR_TYPES[cls] = object.__new__(cls)
+    return instance
 
-@dataclass
-class TBool(Type):
-  pass
+  __eq__ = object.__eq__
+  __hash__ = object.__hash__
+
+  def __repr__(self) -> str:
+    return f'{type(self).__name__}()'
+
+  def __reduce__(self):
+    return (type(self), ())
+
+SCALAR_TYPES: dict[type, ScalarType] = {}
+
+class TUnresolved(ScalarType):
+  __slots__ = ()
+
+class TInt(ScalarType):
+  __slots__ = ()
+
+class TBool(ScalarType):
+  __slots__ = ()
 
-@dataclass
+@dataclass(slots=True)
 class TArray(Type):
   of: Type
   length: int
 
-@dataclass
+@dataclass(slots=True)
 class TFn(Type):
   retype: Type
   params: list[Type]
@@ -1,10 +1,19 @@
-from pprint import pprint
+import atexit
+import io
+import sys
+from types import GeneratorType
 from typing import NoReturn
-from sys import exit
 from dataclasses import replace as copy_dataclass
 from .ast import Span, FAKE_SPAN
 
-def color(s, c): return f'\033[1;{c}m{s}\033[0m'
+# whether the helpers below color their text, see `use_color`
+COLOR = True
+
+def use_color(enabled: bool):
+  global COLOR
+  COLOR = enabled
+
+def color(s, c): return f'\033[1;{c}m{s}\033[0m' if COLOR else f'{s}'
 def red(s): return color(s, 31)
 def blue(s): return color(s, 34)
 def purple(s): return color(s, 35)
@@ -13,40 +22,177 @@ def yellow(s): return color(s, 93)
 def green(s): return color(s, 32)
 def white(s): return color(s, 37)
 
+class Diagnostics:
+  '''Buffers everything the compiler prints and writes it out in one flush.
+
+  Levels control which diagnostics are kept:
+  - quiet: only errors and explicitly requested output
+  - summary: like quiet plus debug output, notes are only counted
+  - full: everything
+  Notes about consecutive array indices coming from the same statement are
+  collapsed into a single range note, and at most `max_notes` notes are kept.'''
+  LEVELS = ('quiet', 'summary', 'full')
+
+  def __init__(self):
+    self.reset()
+
+  def reset(self, level: str = 'full', max_notes: int|None = None):
+    assert(level in Diagnostics.LEVELS)
+    self.level = level
+    self.max_notes = max_notes
+    self.buffer = io.StringIO()
+    self.notes = 0
+    self.hidden = 0
+    self.hidden_reported = False
+    # [name, first index, last index, label, span, shown] of a range note
+    # that is still being extended
+    self.pending: list|None = None
+    # gets a copy of everything flushed, if set
+    self.transcript: io.StringIO|None = None
+    # called with the level, message and span of every report, if set
+    self.listener = None
+
+  def out(self) -> io.StringIO:
+    '''Buffer to write the next piece of output into.'''
+    if self.pending is not None:
+      self.settle_pending()
+    return self.buffer
+
+  def keep_note(self) -> bool:
+    if self.level != 'full' or (self.max_notes is not None and self.notes >= self.max_notes):
+      self.hidden += 1
+      return False
+    self.notes += 1
+    return True
+
+  def index_note(self, name: str, first: int, last: int, label: str, span: Span):
+    pending = self.pending
+    if (pending is not None and pending[4] is span and pending[3] == label
+        and pending[2] + 1 == first and pending[0] == name):
+      pending[2] = last
+      return
+    if pending is not None:
+      self.settle_pending()
+    self.pending = [name, first, last, label, span, self.keep_note()]
+
+  def settle_pending(self):
+    name, first, last, label, span, shown = self.pending
+    self.pending = None
+    if not shown:
+      return
+    if first == last:
+      index = blue(first)
+    else:
+      index = f'{blue(first)}..{blue(last)}'
+    report_note(f'label of {blue(name)}[{index}] set to {yellow(label)}', span,
+      preamble_lines=0, counted=True)
+
+  def report_hidden(self):
+    '''Write a line about notes that were not shown, if there were any.'''
+    if self.hidden and not self.hidden_reported:
+      self.hidden_reported = True
+      hint = 'use --diagnostics=full' if self.level != 'full' else f'over --max-notes={self.max_notes}'
+      more = ' more' if self.notes else ''
+      report('note', f'{self.hidden}{more} notes not shown ({hint})', FAKE_SPAN, blue)
+
+  def flush(self):
+    self.out()
+    self.report_hidden()
+    text = self.buffer.getvalue()
+    if self.transcript is not None:
+      self.transcript.write(text)
+    sys.stdout.write(text)
+    sys.stdout.flush()
+    self.buffer = io.StringIO()
+
+DIAGNOSTICS = Diagnostics()
+atexit.register(DIAGNOSTICS.flush)
+
+def emit(*args, **kwargs):
+  '''print() into the diagnostics buffer.'''
+  print(*args, file=DIAGNOSTICS.out(), **kwargs)
+
+def trampoline(step):
+  '''The value of `step`, which is either a value already or a generator
+  that computes one. Such a generator does not call itself for nested work:
+  it yields the step for it (again a value or a generator) and is sent back
+  its value. The generators waiting on each other are kept on an explicit
+  stack here, so nesting is bounded by memory, not by the recursion limit.'''
+  if type(step) is not GeneratorType:
+    return step
+  stack = [step]
+  value = error = None
+  while True:
+    try:
+      if error is None:
+        step = stack[-1].send(value)
+      else:
+        step = stack[-1].throw(error)
+    except StopIteration as stop:
+      stack.pop()
+      value, error = stop.value, None
+      if not stack:
+        return value
+      continue
+    except BaseException as exc:
+      # unwind the waiting generators in order, as recursion would
+      stack.pop()
+      if not stack:
+        raise
+      value, error = None, exc
+      continue
+    if type(step) is GeneratorType:
+      stack.append(step)
+      value, error = None, None
+    else:
+      value, error = step, None
+
+def pprint(obj):
+  from pprint import pprint as _pprint
+  _pprint(obj, stream=DIAGNOSTICS.out())
+
+def exit(code: int = 0) -> NoReturn:
+  DIAGNOSTICS.flush()
+  sys.exit(code)
+
 def report(level: str, msg: str, span: Span, colorfn, preamble_lines: int = 2,
            epilogue: str|None = None, epilogue_pp = None):
-  print(colorfn(f'{level}: ') + msg)
+  out = DIAGNOSTICS.out()
+  if DIAGNOSTICS.listener is not None:
+    DIAGNOSTICS.listener(level, msg, span)
+  print(colorfn(f'{level}: ') + msg, file=out)
   if span is not FAKE_SPAN:
-    lines = span.src.splitlines()
+    src = span.src
     lstart = max(span.lnum - preamble_lines, 0)
     lend = span.lnum
     # TODO: strip whitespace from the left of all lines, consistently
     # print preamble lines
     for i in range(lstart, lend):
-      print(f'{i + 1:4} | ' + lines[i].replace('\t', '    '))
+      print(f'{i + 1:4} | ' + src.line(i).replace('\t', '    '), file=out)
 
     cstart = span.cstart
     cend = span.cend
 
     # print marked line
     # NOTE: doing .replace on line here would mess up offsets
-    line = lines[lend]
+    line = src.line(lend)
     before, highlighted, after = line[:cstart], line[cstart:cend], line[cend:]
     print(f'{lend + 1:4} | '
       + before.replace('\t', '    ')
       + colorfn(highlighted).replace('\t', '    ')
-      + after.replace('\t', '    '))
+      + after.replace('\t', '    '), file=out)
 
     # print underline
     extra_spaces = len(before.replace('\t', '    ')) - len(before)
     print(' ' * 7 # padding for line numbers
       + colorfn('~' * (cstart + extra_spaces))
-      + colorfn('^' * (cend - cstart)))
+      + colorfn('^' * (cend - cstart)), file=out)
 
   if epilogue is not None:
-    print(epilogue)
+    print(epilogue, file=out)
   if epilogue_pp is not None:
-    pprint(epilogue_pp)
+    from pprint import pprint as _pprint
+    _pprint(epilogue_pp, stream=out)
 
 def report_error(msg: str, span: Span) -> NoReturn:
   report('error', msg, span, red)
@@ -62,10 +208,28 @@ def report_security_error(msg: str, span: Span) -> NoReturn:
 def report_security_error_cont(msg: str, span: Span):
   report('security error', msg, span, purple)
 
-def report_note(msg: str, span: Span, **kwargs):
-  report('note', msg, span, blue, **kwargs)
+def report_error_note(msg: str, span: Span):
+  '''Note that belongs to an error, shown at every diagnostics level.'''
+  report('note', msg, span, blue)
+
+def report_note(msg: str, span: Span, counted: bool = False, **kwargs):
+  if counted or DIAGNOSTICS.keep_note():
+    report('note', msg, span, blue, **kwargs)
+
+def report_index_note(name: str, first: int, last: int, label: str, span: Span):
+  '''Note that the array elements `first` to `last` changed their label to
+  `label`.'''
+  DIAGNOSTICS.index_note(name, first, last, label, span)
+
+def debug_enabled() -> bool:
+  return DIAGNOSTICS.level != 'quiet'
+
+def debug_print(*args, **kwargs):
+  if debug_enabled():
+    emit(*args, **kwargs)
 
 def report_debug(msg: str, span: Span,
                  epilogue: str|None = None, epilogue_pp = None):
-  report('debug', msg, span, cyan,
-    epilogue = epilogue, epilogue_pp = epilogue_pp)
+  if debug_enabled():
+    report('debug', msg, span, cyan,
+      epilogue = epilogue, epilogue_pp = epilogue_pp)
@@ -0,0 +1,619 @@
+'''
+A language server for `palisade lsp`: errors, security errors and changed
+output labels of the open files as diagnostics, over the Language Server
+Protocol on stdin and stdout.
+
+Every open file keeps its type-checked tree, and the labels flowing into
+and out of each of its top-level statements. An edit is mapped, by the
+offsets of their spans, to the top-level statements it touches, which are
+tokenized, parsed and checked again on their own, in the scope of the
+statements before them. The rest of the tree stays; the spans of the
+statements after the edit are moved when something needs them. Flow
+analysis then starts again at the first changed statement, and skips every
+statement after them whose incoming labels are the same as last time, and
+which calls no function that changed.
+
+The whole file is compiled again when that cannot work: edits to the
+`lattice`, `in` or `out` blocks, and statements that now define something
+else, or something of another type, than before.
+
+# example session, with an editor on the other end:
+LanguageServer(sys.stdin.buffer, sys.stdout.buffer).run()
+'''
+
+import json
+import os
+import re
+import sys
+import traceback
+from bisect import bisect_right
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from urllib.parse import unquote, urlparse
+from cfg import lower_stmts
+from driver import CompileOptions, compile_ast
+from flow_analysis import flow_analysis, solve, SecurityContext, SummaryCache, LOW
+from lib.ast import *
+from lib.types import *
+from lib.timing import PassTimer
+from lib.utils import DIAGNOSTICS
+from parser import Parser
+from symbolize import symbolize
+from tokenizer import RegexTokenizer
+from traverse import iter_tree
+from type_check import type_annotate, type_check
+
+# DiagnosticSeverity of the protocol, by report level; debug output is left out
+ERROR = 1
+INFORMATION = 3
+SEVERITIES = {'error': ERROR, 'security error': ERROR, 'note': INFORMATION}
+# notes published for a file at most
+MAX_NOTES = 100
+# label slots an edited tree may have used up over the ones of its last full
+# compile, before it is compiled again
+SLOT_SLACK = 4096
+NO_SHIFT = (0, 0)
+ANSI_RE = re.compile(r'\x1b\[[0-9;]*m')
+
+# JSON-RPC error codes
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+
+# a diagnostic: (severity, message, offset, lnum, cstart, cend), offset -1
+# for a report without a span
+Diagnostic = tuple[int, str, int, int, int, int]
+
+def captured(run, *args) -> tuple[object, list[Diagnostic], bool]:
+  '''Call `run` with `args`, and return its result, the diagnostics it
+  reported, and whether it stopped at an error or crashed.'''
+  diagnostics = []
+  def listener(level: str, msg: str, span: Span):
+    severity = SEVERITIES.get(level)
+    if severity is None:
+      return
+    offset = -1 if span is FAKE_SPAN else span.off_start
+    diagnostics.append((severity, ANSI_RE.sub('', msg), offset, span.lnum, span.cstart, span.cend))
+  DIAGNOSTICS.reset()
+  DIAGNOSTICS.listener = listener
+  result = None
+  failed = False
+  try:
+    result = run(*args)
+    # range notes that are still being extended
+    DIAGNOSTICS.out()
+  except SystemExit:
+    failed = True
+  except Exception as e:
+    # a crash of the compiler is reported like an error, and logged
+    traceback.print_exc(file=sys.stderr)
+    diagnostics.append((ERROR, f'internal error: {type(e).__name__}: {e}', -1, 0, 0, 0))
+    failed = True
+  finally:
+    DIAGNOSTICS.reset()
+  return result, diagnostics, failed
+
+def definitions(stmts: list[Stmt]) -> list[Symbol]:
+  '''Symbols defined by `stmts` in the scope they are in.'''
+  syms = []
+  for stmt in stmts:
+    match stmt:
+      case SVarDef(lhs=EId(sym=sym) | EArray(expr=EId(sym=sym))) | SFnDef(name=EId(sym=sym)):
+        syms.append(sym)
+  return syms
+
+def same_type(old: Type, new: Type) -> bool:
+  if isinstance(old, TFn):
+    return isinstance(new, TFn) and old.retype == new.retype and old.params == new.params
+  return old == new
+
+def path_of(uri: str) -> str:
+  parsed = urlparse(uri)
+  return unquote(parsed.path) if parsed.scheme == 'file' else uri
+
+@dataclass(slots=True)
+class Statement:
+  '''What is known about a top-level statement apart from its tree.'''
+  # offset of its first token
+  start: int
+  # every span in its tree, and in the trees of the functions it defines
+  spans: list[Span]
+  # functions called anywhere in it, and functions defined anywhere in it
+  calls: set[Symbol]
+  fns: list[Symbol]
+
+@dataclass(slots=True)
+class Region:
+  '''Top-level statements checked on their own, to replace some others.'''
+  stmts: list[Stmt]
+  nslots: int
+  features: set[str]
+  # symbols they define in place of the ones the replaced statements defined
+  renames: dict[Symbol, Symbol]
+
+class Document:
+  '''An open file. `text` is its latest version; `src` and everything about
+  the tree is of the last version that got through the front end, which it
+  differs from at most from offset `lo` up to `suffix` characters before the
+  end (`lo` is None when it does not differ).'''
+  def __init__(self, uri: str, text: str, version: int|None, encoding: str):
+    self.uri = uri
+    self.name = path_of(uri)
+    self.version = version
+    self.encoding = encoding
+    self.text = text
+    # the latest version, for positions
+    self.lines = SourceFile(text, self.name)
+    self.src: SourceFile|None = None
+    self.ast: File|None = None
+    self.lo: int|None = 0
+    self.suffix = 0
+    # errors of the latest version, if it did not get through the front end
+    self.errors: list[Diagnostic] = []
+
+  # edits
+
+  def offset(self, position: dict) -> int:
+    '''Offset into `text` of an LSP position.'''
+    starts = self.lines.line_starts
+    lnum = position['line']
+    if lnum >= len(starts):
+      return len(self.text)
+    line = self.lines.line(lnum)
+    col = position['character']
+    if self.encoding == 'utf-16' and not line.isascii():
+      units = 0
+      for idx, c in enumerate(line):
+        if units >= col:
+          col = idx
+          break
+        units += 2 if ord(c) > 0xFFFF else 1
+      else:
+        col = len(line)
+    return starts[lnum] + min(col, len(line))
+
+  def position(self, lnum: int, col: int) -> dict:
+    line = self.lines.line(lnum)
+    if self.encoding == 'utf-16' and not line.isascii():
+      col = len(line[:col].encode('utf-16-le')) // 2
+    return {'line': lnum, 'character': col}
+
+  def edit(self, range: dict, text: str):
+    start, end = self.offset(range['start']), self.offset(range['end'])
+    suffix = len(self.text) - end
+    self.text = self.text[:start] + text + self.text[end:]
+    self.lines = SourceFile(self.text, self.name)
+    if self.src is None:
+      return
+    if self.lo is None:
+      self.lo, self.suffix = start, suffix
+    else:
+      self.lo, self.suffix = min(self.lo, start), min(self.suffix, suffix)
+    self.suffix = min(self.suffix, len(self.text) - self.lo, len(self.src.text) - self.lo)
+
+  def replace(self, text: str):
+    self.text = text
+    self.lines = SourceFile(text, self.name)
+    self.lo, self.suffix = 0, 0
+
+  # analysis
+
+  def analyze(self):
+    '''Bring the diagnostics up to date with `text`.'''
+    if self.ast is not None and self.lo is None:
+      return
+    if self.ast is None or not self.update():
+      self.rebuild()
+
+  def rebuild(self):
+    '''Compile the whole file.'''
+    src = SourceFile(self.text, self.name)
+    ast, errors, failed = captured(compile_ast, src, CompileOptions(), PassTimer())
+    self.errors = errors
+    if failed:
+      # keep the last tree that got through, edits are still checked against it
+      return
+    self.src, self.ast = src, ast
+    self.lo, self.suffix = None, 0
+    # label slots of the top-level definitions, see `same_labels`
+    self.slots = [sym.slot for defs in ast.symtab.symbols.values()
+                  for sym, _ in defs if sym.slot >= 0]
+    self.base_slots = ast.symtab.nslots
+    self.summaries = SummaryCache()
+    n = len(ast.stmts)
+    self.stmts = [self.index(stmt) for stmt in ast.stmts]
+    # (offset, lines) each statement's spans have yet to be moved by
+    self.shifts = [NO_SHIFT] * n
+    # statements before this one that define functions have been moved
+    self.settled = n
+    # labels going into and coming out of each statement, as of its last
+    # flow analysis (None after a security error), whether that is up to
+    # date, and the diagnostics it reported
+    self.ins: list[SecurityContext|None] = [None] * n
+    self.outs: list[SecurityContext|None] = [None] * n
+    self.done = [False] * n
+    self.notes: list[list[Diagnostic]] = [[] for _ in range(n)]
+    self.entry, _, _ = captured(self.flow_globals)
+    self.final = self.entry
+    self.flow(0, n)
+
+  def index(self, stmt: Stmt) -> Statement:
+    spans = {}
+    calls = set()
+    fns = []
+    trees = [stmt]
+    while trees:
+      for node in iter_tree(trees.pop()):
+        spans[id(node.span)] = node.span
+        match node:
+          case ECall(name=EId(sym=sym)):
+            calls.add(sym)
+          case SFnDef(name=EId(sym=sym)):
+            fns.append(sym)
+            # the annotated definition the summary is made from
+            if sym.type.sfndef.body is not node.body:
+              trees.append(sym.type.sfndef)
+    for sym in fns:
+      self.summaries.callees(sym)
+    spans = list(spans.values())
+    return Statement(min(span.off_start for span in spans), spans, calls, fns)
+
+  def update(self) -> bool:
+    '''Check just the statements the changes touch. Returns False if the
+    whole file has to be compiled again.'''
+    ast, src, stmts = self.ast, self.src, self.stmts
+    n = len(stmts)
+    lo, hi = self.lo, len(src.text) - self.suffix
+    if not n or lo < stmts[0].start or ast.symtab.nslots > self.base_slots + SLOT_SLACK:
+      return False
+    starts = [stmt.start for stmt in stmts]
+    a = bisect_right(starts, lo) - 1
+    if a and lo == starts[a]:
+      # text typed right before a statement may still belong to the one before
+      a -= 1
+    b = bisect_right(starts, hi)
+    # statements after the change keep their columns, so none may start on its last line
+    last = src.lnum_of(hi)
+    while b < n and src.lnum_of(starts[b]) == last:
+      b += 1
+    delta = len(self.text) - len(src.text)
+    begin = starts[a]
+    stop = starts[b] + delta if b < n else None
+
+    region, errors, failed = captured(self.check, self.lines, a, b, begin, stop)
+    if failed:
+      end = len(self.text) if stop is None else stop
+      if not errors or not begin <= errors[0][2] < end:
+        # maybe not an error once the rest of the file follows
+        return False
+      if any(0 <= error[2] < begin for error in errors):
+        # a note on an earlier statement, which has to be where it is now
+        for idx in range(a):
+          self.settle(idx)
+        _, errors, _ = captured(self.check, self.lines, a, b, begin, stop)
+      self.errors = errors
+      return True
+    if region is None:
+      return False
+    self.errors = []
+    self.commit(region, a, b, hi, delta)
+    return True
+
+  def check(self, lines: SourceFile, a: int, b: int, begin: int, stop: int|None) -> Region|None:
+    '''Tokenize, parse and type check the text from `begin` up to `stop` in
+    place of statements `a` up to `b`. Returns None if that cannot stand in
+    for compiling the whole file.'''
+    tokenizer = RegexTokenizer(lines)
+    if tokenizer.tokenize(begin, stop) != (len(lines.text) if stop is None else stop):
+      # the last token or comment runs into the statements after
+      return None
+    parser = Parser(tokenizer.buffer)
+    parser.lattice = self.ast.lattice
+    stmts = []
+    while not parser.maybe('eof'):
+      stmts.append(parser.parse_stmt())
+
+    symtab = SymTab(nslots=self.ast.symtab.nslots)
+    for node in [*self.ast.inputs, *self.ast.outputs]:
+      match node.expr:
+        case EId(sym=sym) | EArray(expr=EId(sym=sym)):
+          symtab.register(sym.name, sym)
+    for sym in definitions(self.ast.stmts[:a]):
+      symtab.register(sym.name, sym)
+    stmts = [symbolize(stmt, symtab) for stmt in stmts]
+    old, new = definitions(self.ast.stmts[a:b]), definitions(stmts)
+    if [sym.name for sym in old] != [sym.name for sym in new]:
+      return None
+    stmts = [type_annotate(stmt) for stmt in stmts]
+    stmts = [type_check(stmt) for stmt in stmts]
+    if not all(same_type(osym.type, nsym.type) for osym, nsym in zip(old, new)):
+      return None
+    return Region(stmts, symtab.nslots, parser.features, dict(zip(new, old)))
+
+  def commit(self, region: Region, a: int, b: int, hi: int, delta: int):
+    '''Put the statements of `region` in place of statements `a` up to `b`.'''
+    ast, src = self.ast, self.src
+    renames = region.renames
+    # the rest of the program knows the symbols of the replaced statements
+    for tree in [*region.stmts, *(sym.type.sfndef for sym in renames if isinstance(sym.type, TFn))]:
+      for node in iter_tree(tree):
+        if isinstance(node, EId) and node.sym in renames:
+          node.sym = renames[node.sym]
+    changed = set()
+    for new, old in renames.items():
+      if isinstance(old.type, TFn):
+        old.type.sfndef = new.type.sfndef
+        self.summaries.callgraph.pop(old, None)
+        changed.add(old)
+      old.origin = new.origin
+
+    lines = len(self.lines.line_starts) - len(src.line_starts)
+    src.text = self.text
+    src._line_starts = self.lines.line_starts
+    stmts = [self.index(stmt) for stmt in region.stmts]
+    for stmt in stmts:
+      for span in stmt.spans:
+        span.src = src
+    n = len(self.stmts)
+    for idx in range(b, n):
+      self.stmts[idx].start += delta
+      doff, dlines = self.shifts[idx]
+      self.shifts[idx] = (doff + delta, dlines + lines)
+      if self.notes[idx]:
+        self.notes[idx] = [(severity, msg, off + delta, lnum + lines, cstart, cend)
+                           if off >= hi else (severity, msg, off, lnum, cstart, cend)
+                           for severity, msg, off, lnum, cstart, cend in self.notes[idx]]
+
+    m = len(stmts)
+    ast.stmts[a:b] = region.stmts
+    ast.symtab.nslots = region.nslots
+    ast.features |= region.features
+    self.stmts[a:b] = stmts
+    self.shifts[a:b] = [NO_SHIFT] * m
+    self.ins[a:b] = [None] * m
+    self.outs[a:b] = [None] * m
+    self.done[a:b] = [False] * m
+    self.notes[a:b] = [[] for _ in range(m)]
+    self.settled = min(self.settled, a + m)
+    self.lo, self.suffix = None, 0
+
+    if changed:
+      # functions calling a changed one, and statements calling any of them
+      later = [sym for stmt in self.stmts[a + m:] for sym in stmt.fns]
+      grown = True
+      while grown:
+        grown = False
+        for sym in later:
+          if sym not in changed and not changed.isdisjoint(self.summaries.callees(sym)):
+            changed.add(sym)
+            grown = True
+      for sym in changed:
+        self.summaries.entries.pop(sym, None)
+      for idx in range(a + m, len(self.stmts)):
+        if not self.stmts[idx].calls.isdisjoint(changed):
+          self.done[idx] = False
+    self.flow(a, a + m)
+
+  def settle(self, idx: int):
+    '''Move the spans of statement `idx` to where it is now.'''
+    doff, dlines = self.shifts[idx]
+    if doff or dlines:
+      for span in self.stmts[idx].spans:
+        span.off_start += doff
+        span.off_end += doff
+        span.lnum += dlines
+      self.shifts[idx] = NO_SHIFT
+
+  def flow_globals(self) -> SecurityContext:
+    ctx = SecurityContext(lattice=self.ast.lattice, summaries=self.summaries)
+    solve(flow_analysis, lower_stmts([*self.ast.inputs, *self.ast.outputs]), LOW, ctx)
+    return ctx
+
+  def flow_stmt(self, idx: int, ctx: SecurityContext) -> SecurityContext:
+    # calls replay what the called functions reported, with their spans
+    for fidx in range(self.settled, idx):
+      if self.stmts[fidx].fns:
+        self.settle(fidx)
+    self.settled = max(self.settled, idx)
+    self.settle(idx)
+    ctx = ctx.copy()
+    solve(flow_analysis, lower_stmts([self.ast.stmts[idx]]), LOW, ctx)
+    return ctx
+
+  def flow(self, begin: int, end: int):
+    '''Flow analysis from statement `begin` on, of statements `begin` up to
+    `end` at least. Top-level statements have no edges between them but
+    falling through, so they can be analyzed one at a time.'''
+    while begin and self.outs[begin - 1] is None:
+      begin -= 1
+    ctx = self.outs[begin - 1] if begin else self.entry
+    for idx in range(begin, len(self.stmts)):
+      if idx >= end and self.done[idx] and self.same_labels(ctx, self.ins[idx]):
+        if self.outs[idx] is None:
+          return
+        ctx = self.outs[idx]
+        continue
+      self.ins[idx] = ctx
+      ctx, self.notes[idx], failed = captured(self.flow_stmt, idx, ctx)
+      self.done[idx] = True
+      self.outs[idx] = ctx
+      if failed:
+        # functions left halfway through being summarized
+        self.summaries.pending.clear()
+        return
+    self.final = ctx
+
+  def same_labels(self, ctx: SecurityContext, other: SecurityContext) -> bool:
+    '''Whether the top-level variables have the same labels in both. Those
+    of local variables cannot matter to the statements after.'''
+    if ctx is other:
+      return True
+    for slot in self.slots:
+      if ctx.arrays.get(slot) != other.arrays.get(slot):
+        return False
+      known = ctx.knows_slot(slot)
+      if known != other.knows_slot(slot) or known and ctx.label_at(slot) != other.label_at(slot):
+        return False
+    return True
+
+  def diagnostics(self, max_notes: int = MAX_NOTES) -> list[Diagnostic]:
+    '''What compiling the latest version would report, as diagnostics.'''
+    if self.errors or self.ast is None:
+      return self.errors
+    diagnostics = []
+    notes = 0
+    for idx in range(len(self.stmts)):
+      for diagnostic in self.notes[idx]:
+        if diagnostic[0] == INFORMATION:
+          notes += 1
+          if notes > max_notes:
+            continue
+        diagnostics.append(diagnostic)
+      if self.outs[idx] is None:
+        return diagnostics
+    lattice = self.ast.lattice
+    for out in self.ast.outputs:
+      match out.expr:
+        case EId(sym=sym) | EArray(expr=EId(sym=sym)):
+          label, declared = self.final.label_of(sym), out.orig_secure.mask
+      if label == declared:
+        continue
+      span = out.span
+      if lattice.leq(label, declared):
+        diagnostics.append((INFORMATION, f'output {sym.name} is {lattice.name_of(label)}, '
+                            f'below its declared label {out.orig_secure}',
+                            span.off_start, span.lnum, span.cstart, span.cend))
+      else:
+        diagnostics.append((ERROR, f'output {sym.name} is {lattice.name_of(label)}, '
+                            f'above its declared label {out.orig_secure}',
+                            span.off_start, span.lnum, span.cstart, span.cend))
+    return diagnostics
+
+class LanguageServer:
+  '''Speaks the protocol on binary streams `stdin` and `stdout`.'''
+  def __init__(self, stdin, stdout, max_notes: int = MAX_NOTES):
+    self.stdin = stdin
+    self.stdout = stdout
+    self.max_notes = max_notes
+    self.encoding = 'utf-16'
+    self.documents: dict[str, Document] = {}
+    self.shutdown = False
+    self.methods = {
+      'initialize': self.initialize,
+      'shutdown': self.on_shutdown,
+      'textDocument/didOpen': self.did_open,
+      'textDocument/didChange': self.did_change,
+      'textDocument/didClose': self.did_close,
+    }
+
+  def run(self) -> int:
+    '''Serve until the client says exit. Returns the exit status.'''
+    # the compiler prints its reports, which must not end up in the protocol
+    with open(os.devnull, 'w') as null, redirect_stdout(null):
+      while (message := self.read()) is not None:
+        method = message.get('method')
+        if method == 'exit':
+          return 0 if self.shutdown else 1
+        self.dispatch(message)
+    return 1
+
+  def read(self) -> dict|None:
+    length = None
+    while True:
+      line = self.stdin.readline()
+      if not line:
+        return None
+      line = line.strip()
+      if not line:
+        break
+      name, _, value = line.decode('ascii').partition(':')
+      if name.strip().lower() == 'content-length':
+        length = int(value)
+    if length is None:
+      return {}
+    return json.loads(self.stdin.read(length))
+
+  def send(self, message: dict):
+    body = json.dumps(message).encode()
+    self.stdout.write(b'Content-Length: %d\r\n\r\n' % len(body) + body)
+    self.stdout.flush()
+
+  def dispatch(self, message: dict):
+    method = message.get('method')
+    handler = self.methods.get(method)
+    request = 'id' in message
+    if handler is None:
+      # notifications nobody handles, like initialized, are fine to drop
+      if request and method is not None:
+        self.send({'jsonrpc': '2.0', 'id': message['id'],
+                   'error': {'code': METHOD_NOT_FOUND, 'message': f'unknown method {method}'}})
+      return
+    try:
+      result = handler(message.get('params') or {})
+    except Exception as e:
+      traceback.print_exc(file=sys.stderr)
+      if request:
+        self.send({'jsonrpc': '2.0', 'id': message['id'],
+                   'error': {'code': INTERNAL_ERROR, 'message': str(e)}})
+      return
+    if request:
+      self.send({'jsonrpc': '2.0', 'id': message['id'], 'result': result})
+
+  def initialize(self, params: dict) -> dict:
+    encodings = params.get('capabilities', {}).get('general', {}).get('positionEncodings', [])
+    # offsets are counted in code points, anything else needs converting
+    if 'utf-32' in encodings:
+      self.encoding = 'utf-32'
+    return {
+      'capabilities': {
+        'positionEncoding': self.encoding,
+        # open, close and incremental changes
+        'textDocumentSync': {'openClose': True, 'change': 2},
+      },
+      'serverInfo': {'name': 'palisade'},
+    }
+
+  def on_shutdown(self, params: dict):
+    self.shutdown = True
+    return None
+
+  def did_open(self, params: dict):
+    item = params['textDocument']
+    doc = self.documents[item['uri']] = Document(item['uri'], item['text'],
+                                                 item.get('version'), self.encoding)
+    doc.analyze()
+    self.publish(doc)
+
+  def did_change(self, params: dict):
+    doc = self.documents.get(params['textDocument']['uri'])
+    if doc is None:
+      return
+    doc.version = params['textDocument'].get('version')
+    for change in params['contentChanges']:
+      if 'range' in change:
+        doc.edit(change['range'], change['text'])
+      else:
+        doc.replace(change['text'])
+    doc.analyze()
+    self.publish(doc)
+
+  def did_close(self, params: dict):
+    uri = params['textDocument']['uri']
+    if self.documents.pop(uri, None) is not None:
+      self.send({'jsonrpc': '2.0', 'method': 'textDocument/publishDiagnostics',
+                 'params': {'uri': uri, 'diagnostics': []}})
+
+  def publish(self, doc: Document):
+    diagnostics = []
+    for severity, msg, offset, lnum, cstart, cend in doc.diagnostics(self.max_notes):
+      if offset < 0:
+        lnum = cstart = cend = 0
+      diagnostics.append({
+        'range': {'start': doc.position(lnum, cstart), 'end': doc.position(lnum, cend)},
+        'severity': severity,
+        'source': 'palisade',
+        'message': msg,
+      })
+    params = {'uri': doc.uri, 'diagnostics': diagnostics}
+    if doc.version is not None:
+      params['version'] = doc.version
+    self.send({'jsonrpc': '2.0', 'method': 'textDocument/publishDiagnostics', 'params': params})
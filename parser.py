@@ -1,6 +1,7 @@
 from lib.ast import *
 from lib.types import *
-from lib.utils import report_error
+from lib.utils import report_error, trampoline
+from typing import Any, Generator
 
 PRECTABLE_ARITH      = 0
 PRECTABLE_BITWISE    = 1
@@ -50,46 +51,54 @@ UNOPS = {
 }
 
 class Parser:
+  '''Recursive-descent parser over a `TokenBuffer`.
+
+  Tokens are referred to by their index in the buffer, use `tok_type`,
+  `tok_value` and `tok_span` to look at one.'''
   def __init__(self, tokens):
     self.tokens = tokens
     self.idx = 0
+    self.features = set()
+    self.lattice = TWO_POINT
 
-  def token(self) -> Token:
-    if self.idx < len(self.tokens):
-      return self.tokens[self.idx]
-    else:
-      return TOKEN_EOF
+  def token(self) -> int:
+    return self.idx
 
-  def peek(self, n: int) -> Token:
-    self.idx += n
-    tok = self.token()
-    self.idx -= n
-    return tok
+  def peek(self, n: int) -> int:
+    return self.idx + n
+
+  def tok_type(self, tok: int) -> str:
+    return self.tokens.type(tok)
 
-  def expect(self, *types) -> Token:
-    tok = self.token()
-    if tok.type not in types:
+  def tok_value(self, tok: int) -> str:
+    return self.tokens.value(tok)
+
+  def tok_span(self, tok: int) -> Span:
+    return self.tokens.span(tok)
+
+  def expect(self, *types) -> int:
+    tok = self.idx
+    type = self.tokens.type(tok)
+    if type not in types:
       if len(types) > 1:
         s = f'one of {", ".join(types)}'
       else:
         s = types[0]
-      report_error(f'expected {s} but got {tok.type}', tok.span)
+      report_error(f'expected {s} but got {type}', self.tok_span(tok))
     self.idx += 1
     return tok
 
   def maybe(self, *types) -> bool:
-    return self.token().type in types
+    return self.tokens.type(self.idx) in types
 
-  def consume(self) -> Token:
-    tok = self.token()
+  def consume(self) -> int:
+    tok = self.idx
     self.idx += 1
     return tok
 
   def check_precedence(self, prev_op, op) -> bool:
-    if prev_op is None:
-      return False
-    prev_type, prev_prio = BINOPS[prev_op.type]
-    type, prio = BINOPS[op.type]
+    prev_type, prev_prio = BINOPS[self.tok_type(prev_op)]
+    type, prio = BINOPS[self.tok_type(op)]
     if prev_type == type:
       # same type of op
       return prev_prio >= prio
@@ -97,113 +106,159 @@ class Parser:
       # no ambiguity between op types
       return PRECTABLE_AUTO_RESOLUTION[(prev_type, type)]
     else:
-      report_error('ambiguous precedence, use parenthesis', op.span)
+      report_error('ambiguous precedence, use parenthesis', self.tok_span(op))
 
   def parse(self) -> File:
     stmts = []
+    if self.maybe('lattice'):
+      self.lattice = self.parse_lattice()
     ins, outs = self.parse_globals()
     while not self.maybe('eof'):
       stmts.append(self.parse_stmt())
-    return File(FAKE_SPAN, stmts, SymTab(None, {}), ins, outs)
+    return File(FAKE_SPAN, stmts, SymTab(), ins, outs, self.features, self.lattice)
+
+  def parse_expr(self) -> Expr:
+    return trampoline(self.parse_expr_step())
 
-  def parse_expr(self):
+  def parse_expr_step(self) -> Generator[Any, Any, Expr]:
+    # like statements, expressions nested in call arguments, array indices,
+    # array literals and declassify are parsed by generators that yield the
+    # step for them, see `trampoline`
     if(self.maybe('declassify')):
       return self.parse_declassify()
     if(self.maybe('[')):
       return self.parse_array_literal()
-    return self.parse_expr_prec(None)
-
-  def parse_expr_prec(self, prev_op):
-    expr = self.parse_term()
+    return self.parse_expr_prec()
+
+  def parse_expr_prec(self) -> Generator[Any, Any, Expr]:
+    # operator-precedence parsing with an explicit stack instead of recursion,
+    # so expression length and nesting are not bounded by the recursion limit.
+    # stack frames are (kind, token, lhs), where kind is one of
+    # - 'unop': prefix operator waiting for its operand
+    # - '(': open parenthesis waiting for the matching ')'
+    # - 'binop': lhs and operator waiting for the rhs
+    stack = []
     while True:
-      op = self.token()
-      if not op.type in BINOPS:
-        # not an operator, expression is done
-        return expr
-      # check precedence
-      if self.check_precedence(prev_op, op):
-        # prev_op binds tighter than op
-        return expr
-      # consume operator token
-      self.consume()
-      rhs = self.parse_expr_prec(op)
-      expr = EBinOp(op.span, TUnresolved(), SecLabel.INVALID, op.type, expr, rhs)
-
-  def parse_term(self):
+      # operand: prefix operators and open parenthesis, followed by a term
+      while True:
+        if self.maybe(*UNOPS):
+          stack.append(('unop', self.consume(), None))
+        elif self.maybe('(') and self.tok_type(self.peek(1)) not in ('declassify', '['):
+          stack.append(('(', self.consume(), None))
+        else:
+          break
+      expr = yield self.parse_term_step()
+      # operator: reduce whatever binds tighter than the next operator
+      while True:
+        while stack and stack[-1][0] == 'unop':
+          _, op, _ = stack.pop()
+          expr = EUnOp(self.tok_span(op), TUnresolved(), SecLabel.INVALID, self.tok_type(op), expr)
+        op = self.token()
+        if self.tok_type(op) in BINOPS:
+          # an operator that binds at least as tight as op completes its rhs here
+          while stack and stack[-1][0] == 'binop' and self.check_precedence(stack[-1][1], op):
+            expr = self.reduce_binop(stack.pop(), expr)
+          self.consume()
+          stack.append(('binop', op, expr))
+          break
+        # not an operator, (sub)expression is done
+        while stack and stack[-1][0] == 'binop':
+          expr = self.reduce_binop(stack.pop(), expr)
+        if not stack:
+          return expr
+        # only an open parenthesis can be left on top
+        self.expect(')')
+        stack.pop()
+
+  def reduce_binop(self, frame, rhs) -> EBinOp:
+    _, op, lhs = frame
+    return EBinOp(self.tok_span(op), TUnresolved(), SecLabel.INVALID, self.tok_type(op), lhs, rhs)
+
+  def parse_term_step(self) -> Expr|Generator[Any, Any, Expr]:
     if self.maybe('identifier'):
-      if self.peek(1).type == '(':
+      if self.tok_type(self.peek(1)) == '(':
         # function call
         return self.parse_call()
       else:
-        return self.parse_lvalue()
+        return self.parse_lvalue_step()
     elif self.maybe('integer', 'integer_hex', 'integer_bin', 'integer_oct'):
       return self.parse_integer()
     elif self.maybe('true', 'false'):
       return self.parse_boolean()
     elif self.maybe('('):
-      self.expect('(')
-      expr = self.parse_expr()
-      self.expect(')')
-      return expr
-    elif self.maybe(*UNOPS):
-      op = self.consume()
-      return EUnOp(op.span, TUnresolved(), SecLabel.INVALID, op.type, self.parse_term())
+      # parenthesized declassify or array literal, plain ones are
+      # handled by parse_expr_prec
+      return self.parse_parens()
     else:
-      report_error('unexpected token while parsing expression', self.token().span)
+      report_error('unexpected token while parsing expression', self.tok_span(self.token()))
+
+  def parse_parens(self) -> Generator[Any, Any, Expr]:
+    self.expect('(')
+    expr = yield self.parse_expr_step()
+    self.expect(')')
+    return expr
 
   def parse_lvalue(self) -> ELValue:
+    return trampoline(self.parse_lvalue_step())
+
+  def parse_lvalue_step(self) -> ELValue|Generator[Any, Any, ELValue]:
     eid = self.parse_identifier()
     if self.maybe('['):
-      self.expect('[')
-      index = self.parse_expr()
-      self.expect(']')
-      return EArray(eid.span, TUnresolved(), SecLabel.INVALID, eid, index)
+      return self.parse_index(eid)
     return eid
 
+  def parse_index(self, eid: EId) -> Generator[Any, Any, EArray]:
+    self.expect('[')
+    index = yield self.parse_expr_step()
+    self.expect(']')
+    return EArray(eid.span, TUnresolved(), SecLabel.INVALID, eid, index)
+
   def parse_identifier(self) -> EId:
     tok = self.expect('identifier')
-    return EId(tok.span, TUnresolved(), SecLabel.INVALID, tok.value, SYMBOL_UNRESOLVED)
+    return EId(self.tok_span(tok), TUnresolved(), SecLabel.INVALID, self.tok_value(tok),
+      SYMBOL_UNRESOLVED)
 
   def parse_integer(self) -> EInt:
     tok = self.expect('integer', 'integer_hex', 'integer_bin', 'integer_oct')
-    if tok.type == 'integer_hex':
-      return EInt(tok.span, TUnresolved(), SecLabel.INVALID, int(tok.value, 16))
-    if tok.type == 'integer_bin':
-      return EInt(tok.span, TUnresolved(), SecLabel.INVALID, int(tok.value, 2))
-    if tok.type == 'integer_oct':
-      return EInt(tok.span, TUnresolved(), SecLabel.INVALID, int(tok.value, 8))
+    type, value, span = self.tok_type(tok), self.tok_value(tok), self.tok_span(tok)
+    if type == 'integer_hex':
+      return EInt(span, TUnresolved(), SecLabel.INVALID, int(value, 16))
+    if type == 'integer_bin':
+      return EInt(span, TUnresolved(), SecLabel.INVALID, int(value, 2))
+    if type == 'integer_oct':
+      return EInt(span, TUnresolved(), SecLabel.INVALID, int(value, 8))
     else:
-      return EInt(tok.span, TUnresolved(), SecLabel.INVALID, int(tok.value))
+      return EInt(span, TUnresolved(), SecLabel.INVALID, int(value))
 
   def parse_boolean(self) -> EBool:
     tok = self.expect('true', 'false')
-    return EBool(tok.span, TUnresolved(), SecLabel.INVALID, tok.type == 'true')
+    return EBool(self.tok_span(tok), TUnresolved(), SecLabel.INVALID, self.tok_type(tok) == 'true')
   
-  def parse_array_literal(self) -> EArrayLiteral:
+  def parse_array_literal(self) -> Generator[Any, Any, EArrayLiteral]:
     tok = self.expect('[')
     values = []
     while True:
-      values.append(self.parse_expr())
+      values.append((yield self.parse_expr_step()))
       if self.maybe(']'):
         self.expect(']')
         break
       self.expect(',')
-    return EArrayLiteral(tok.span, TArray(TUnresolved(), len(values)), SecLabel.INVALID, values)
+    return EArrayLiteral(self.tok_span(tok), TArray(TUnresolved(), len(values)), SecLabel.INVALID, values)
 
   def parse_type(self) -> Type:
     # TODO: array type
     tok = self.expect('int', 'bool')
-    if tok.type == 'int':
+    if self.tok_type(tok) == 'int':
       return TInt()
     else:
       return TBool()
 
-  def parse_call(self) -> ECall:
+  def parse_call(self) -> Generator[Any, Any, ECall]:
     name = self.parse_identifier()
     self.expect('(')
     params = []
     while not self.maybe(')'):
-      params.append(self.parse_expr())
+      params.append((yield self.parse_expr_step()))
       if self.maybe(')'):
         break
       self.expect(',')
@@ -211,6 +266,12 @@ class Parser:
     return ECall(name.span, TUnresolved(), SecLabel.INVALID, name, params)
 
   def parse_stmt(self) -> Stmt:
+    return trampoline(self.parse_stmt_step())
+
+  def parse_stmt_step(self) -> Stmt|Generator[Any, Any, Stmt]:
+    # statements with a body are parsed by generators that yield the steps
+    # for the statements nested in them, see `trampoline`, so nesting depth
+    # is not bounded by the recursion limit
     if self.maybe('{'):
       return self.parse_scope()
     elif self.maybe('fn'):
@@ -235,28 +296,43 @@ class Parser:
       else:
         return self.parse_assign(lvalue)
     else:
-      report_error('unexpected token while parsing statement', self.token().span)
+      report_error('unexpected token while parsing statement', self.tok_span(self.token()))
 
-  def parse_scope(self) -> SScope:
+  def parse_scope(self) -> Generator[Any, Any, SScope]:
     tok = self.expect('{')
     stmts = []
     while not self.maybe('}'):
-      stmts.append(self.parse_stmt())
+      stmts.append((yield self.parse_stmt_step()))
     self.expect('}')
-    return SScope(tok.span, stmts, SecLabel.INVALID, SymTab(None, {}))
+    return SScope(self.tok_span(tok), stmts, SecLabel.INVALID)
 
   def parse_assign(self, lhs: ELValue) -> SAssign:
     # lvalue = expr;
     tok = self.expect('=')
     rhs = self.parse_expr()
     self.expect(';')
-    return SAssign(tok.span, lhs, rhs)
+    return SAssign(self.tok_span(tok), lhs, rhs)
 
   def parse_seclabel(self) -> SecLabel:
-    tok = self.expect('high', 'low')
-    return SecLabel.from_label(tok.type)
+    # low | high | compartment (+ compartment)*
+    lattice = self.lattice
+    if self.maybe('high', 'low'):
+      tok = self.consume()
+      return lattice.label(lattice.top if self.tok_type(tok) == 'high' else 0)
+    mask = self.parse_compartment()
+    while self.maybe('+'):
+      self.consume()
+      mask |= self.parse_compartment()
+    return lattice.label(mask)
 
-  def parse_fndef(self) -> SFnDef:
+  def parse_compartment(self) -> int:
+    tok = self.expect('identifier')
+    bit = self.lattice.bits.get(self.tok_value(tok))
+    if bit is None:
+      report_error(f'unknown compartment {self.tok_value(tok)}', self.tok_span(tok))
+    return bit
+
+  def parse_fndef(self) -> Generator[Any, Any, SFnDef]:
     # fn name(params) retype body
     tok = self.expect('fn')
     name = self.parse_identifier()
@@ -275,65 +351,66 @@ class Parser:
       self.expect(',')
     self.expect(')')
     retype = self.parse_type()
-    body = self.parse_scope()
-    return SFnDef(tok.span, name, params, retype, body)
+    body = yield self.parse_scope()
+    return SFnDef(self.tok_span(tok), name, params, retype, body)
 
-  def parse_if(self) -> SIf:
+  def parse_if(self) -> Generator[Any, Any, SIf]:
     # if (clause) stmt [else stmt]
     tok = self.expect('if')
     self.expect('(')
     clause = self.parse_expr()
     self.expect(')')
-    body = self.parse_scope()
+    body = yield self.parse_scope()
     if self.maybe('else'):
       self.expect('else')
-      else_stmt = self.parse_scope()
+      else_stmt = yield self.parse_scope()
     else:
       else_stmt = None
-    return SIf(tok.span, clause, body, else_stmt)
+    return SIf(self.tok_span(tok), clause, body, else_stmt)
 
-  def parse_while(self) -> SWhile:
+  def parse_while(self) -> Generator[Any, Any, SWhile]:
     # while (clause) stmt
     tok = self.expect('while')
     self.expect('(')
     clause = self.parse_expr()
     self.expect(')')
-    body = self.parse_scope()
-    return SWhile(tok.span, clause, body)
+    body = yield self.parse_scope()
+    return SWhile(self.tok_span(tok), clause, body)
 
   def parse_debug(self) -> SDebug:
     # debug expr;
     tok = self.expect('debug')
+    self.features.add('debug')
     expr = self.parse_expr()
     self.expect(';')
-    return SDebug(tok.span, expr)
+    return SDebug(self.tok_span(tok), expr)
 
   def parse_return(self) -> SReturn:
     # return expr;
     tok = self.expect('return')
     expr = self.parse_expr()
     self.expect(';')
-    return SReturn(tok.span, SecLabel.INVALID, expr)
+    return SReturn(self.tok_span(tok), SecLabel.INVALID, expr)
   
-  def parse_declassify(self) -> EDeclassify:
+  def parse_declassify(self) -> Generator[Any, Any, EDeclassify]:
     # declassify expr;
     tok = self.expect('declassify')
-    expr = self.parse_expr()
-    return EDeclassify(tok.span, TUnresolved(), SecLabel.INVALID, expr)
+    expr = yield self.parse_expr_step()
+    return EDeclassify(self.tok_span(tok), TUnresolved(), SecLabel.INVALID, expr)
   
-  def parse_try_catch(self) -> STryCatch:
+  def parse_try_catch(self) -> Generator[Any, Any, STryCatch]:
     # try { stmts } catch { stmts }
     tok = self.expect('try')
-    try_body = self.parse_scope()
+    try_body = yield self.parse_scope()
     self.expect('catch')
-    catch_body = self.parse_scope()
-    return STryCatch(tok.span, try_body, catch_body)
+    catch_body = yield self.parse_scope()
+    return STryCatch(self.tok_span(tok), try_body, catch_body)
     
   def parse_throw(self) -> SThrow:
     # throw;
     tok = self.expect('throw')
     self.expect(';')
-    return SThrow(tok.span)
+    return SThrow(self.tok_span(tok))
 
   def parse_vardef(self, lhs: ELValue) -> SVarDef:
     # lvalue := expr ;
@@ -353,7 +430,7 @@ class Parser:
         if lhs.index.value < len(rhs.values):
           report_error('the array literal is to long', rhs.span)
     self.expect(';')
-    return SVarDef(tok.span, lhs, rhs)
+    return SVarDef(self.tok_span(tok), lhs, rhs)
   
   def parse_global_variable(self) -> SGlobal:
     seclabel = self.parse_seclabel()
@@ -363,6 +440,24 @@ class Parser:
     type = self.parse_type()
     return SGlobal(name.span, type, name, seclabel)
 
+  def parse_lattice(self) -> Lattice:
+    # lattice { name, ... }
+    self.expect('lattice')
+    self.expect('{')
+    names = []
+    while not self.maybe('}'):
+      tok = self.expect('identifier')
+      if self.tok_value(tok) in names:
+        report_error(f'compartment {self.tok_value(tok)} declared twice', self.tok_span(tok))
+      names.append(self.tok_value(tok))
+      if self.maybe('}'):
+        break
+      self.expect(',')
+    self.expect('}')
+    if not names:
+      report_error('lattice needs at least one compartment', self.tok_span(self.token()))
+    return Lattice(tuple(names))
+
   def parse_globals(self):
     ins = []
     self.expect('in')
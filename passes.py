@@ -0,0 +1,172 @@
+'''
+Passes over the AST, dispatched through class-keyed handler tables.
+
+# example pass:
+NEGATE = Pass('negate')
+
+@NEGATE.on(EBool)
+def negate_bool(pass_, node: EBool):
+  return EBool(node.span, node.type, node.secure, not node.value)
+
+Nodes without a handler are passed to `map_tree`, so handlers only need to
+exist for the node types a pass actually cares about. Handlers recurse by
+calling `pass_(child, ...)`, never the pass by name, so that the same
+handlers work when the pass is fused with others.
+
+Handlers of nodes that nest arbitrarily deep (`traverse.NESTING`: scopes,
+statements with a body and expressions with operands) are generators
+instead, which yield
+`pass_.step(child, ...)` and are sent back the child's result, see
+`trampoline`, so that no pass recurses once per level of nesting:
+
+@SOME_PASS.on(SWhile)
+def some_pass_swhile(pass_, node: SWhile):
+  body = yield pass_.step(node.body)
+  ...
+
+For these nodes `descend` is such a generator too, and a handler that uses
+its result yields it.
+'''
+
+from lib.ast import *
+from lib.utils import *
+from traverse import map_steps, iter_tree, count_nodes
+from lib.timing import PassTimer
+
+def descend(pass_, node: AstNode, *args):
+  return map_steps(pass_.step, node, *args)
+
+class Pass:
+  '''A pass that rebuilds the tree, or a read-only one (`readonly=True`)
+  whose handlers only look at nodes.
+
+  `requires` lists the parser features (see `File.features`) a pass has
+  something to do with; the pass is skipped for files without any of them.'''
+  def __init__(self, name: str, readonly: bool = False,
+               requires: frozenset[str]|None = None):
+    self.name = name
+    self.readonly = readonly
+    self.requires = requires
+    self.handlers = {}
+    self.fallback = descend
+
+  def __repr__(self) -> str:
+    return f'<pass {self.name}>'
+
+  def on(self, *classes: type):
+    '''Register the decorated function as the handler for `classes`.'''
+    def register(handler):
+      for cls in classes:
+        self.handlers[cls] = handler
+      return handler
+    return register
+
+  def otherwise(self, handler):
+    '''Register the decorated function as the handler for all other nodes.'''
+    self.fallback = handler
+    return handler
+
+  def __call__(self, node: AstNode, *args):
+    result = self.handlers.get(type(node), self.fallback)(self, node, *args)
+    if type(result) is GeneratorType:
+      return trampoline(result)
+    return result
+
+  def step(self, node: AstNode, *args):
+    '''What the handler of `node` returns: its result, or a generator that
+    computes it.'''
+    return self.handlers.get(type(node), self.fallback)(self, node, *args)
+
+  def wanted(self, features: set[str]) -> bool:
+    return self.requires is None or not self.requires.isdisjoint(features)
+
+  def run(self, ast: File, *args):
+    if not self.readonly:
+      return self(ast, *args)
+    handlers = self.handlers
+    for node in iter_tree(ast):
+      handler = handlers.get(type(node))
+      if handler is not None:
+        handler(self, node, *args)
+    return ast
+
+class FusedPass(Pass):
+  '''A rebuilding pass with read-only passes riding along: each node the
+  base pass returns is handed to the read-only handlers right away, instead
+  of walking the finished tree once per read-only pass.
+
+  Read-only passes see nodes bottom-up here rather than top-down, so only
+  passes that do not care about the order can be fused.'''
+  def __init__(self, base: Pass, visitors: list[Pass]):
+    super().__init__('+'.join(p.name for p in [base, *visitors]))
+    self.base = base
+    self.visitors = visitors
+    self.handlers = base.handlers
+    self.fallback = base.fallback
+
+  def __call__(self, node: AstNode, *args):
+    return trampoline(self.step(node, *args))
+
+  def step(self, node: AstNode, *args):
+    result = self.handlers.get(type(node), self.fallback)(self, node, *args)
+    if type(result) is GeneratorType:
+      return self.visit_steps(result)
+    self.visit(result)
+    return result
+
+  def visit_steps(self, steps):
+    result = yield steps
+    self.visit(result)
+    return result
+
+  def visit(self, result: AstNode):
+    for visitor in self.visitors:
+      vhandler = visitor.handlers.get(type(result))
+      if vhandler is not None:
+        vhandler(visitor, result)
+
+class PassManager:
+  '''Runs a pipeline of passes over a `File`.
+
+  Passes whose features the parser did not see are skipped, and read-only
+  passes are fused into the rebuilding pass before them, unless the tree
+  in between is asked for with `dumps` or the passes are timed.'''
+  def __init__(self, passes: list[Pass]):
+    self.passes = passes
+
+  def plan(self, features: set[str], dumps: set[Pass] = set(),
+           fuse: bool = True) -> list[Pass]:
+    # each entry is a rebuilding or read-only pass plus the read-only
+    # passes fused into it
+    plan: list[tuple[Pass, list[Pass]]] = []
+    for pass_ in self.passes:
+      if not pass_.wanted(features):
+        continue
+      if fuse and pass_.readonly and plan and not plan[-1][0].readonly and \
+         plan[-1][0] not in dumps:
+        plan[-1][1].append(pass_)
+      else:
+        plan.append((pass_, []))
+    return [FusedPass(base, visitors) if visitors else base for base, visitors in plan]
+
+  def run(self, ast: File, dumps: set[Pass] = set(), timer: PassTimer|None = None) -> File:
+    timer = timer or PassTimer()
+    # the time of a fused pass could not be told apart from the pass it
+    # rides along with, a timed run gives each pass a walk of its own
+    plan = self.plan(ast.features, dumps, fuse=not timer.enabled)
+    stages = {getattr(stage, 'base', stage): stage for stage in plan}
+    for pass_ in self.passes:
+      if not pass_.wanted(ast.features):
+        timer.skip(pass_.name)
+        continue
+      stage = stages.get(pass_)
+      if stage is None:
+        # fused into an earlier pass
+        continue
+      with timer.stage(stage.name) as record:
+        ast = stage.run(ast)
+      if record is not None:
+        record.nodes = count_nodes(ast)
+      if pass_ in dumps:
+        pprint(ast)
+    return ast
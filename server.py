@@ -0,0 +1,191 @@
+'''
+A compile daemon for `palisade serve`; client.py is the other end.
+
+The daemon listens on a Unix domain socket and keeps a pool of worker
+processes with the compiler imported and the compile cache, with its most
+recently used entries held in memory, warm between requests. Requests and
+responses are single lines of JSON:
+
+  {"path": "prog.pls"}                       compile a file
+  {"source": "in {...", "name": "<stdin>"}   compile source text
+  {"stop": true}                             shut the daemon down
+
+A compile request may also carry "options" (fields of `CompileOptions`) and
+a "timeout" in seconds, at most the daemon's own. The response is
+{"output": ..., "code": ..., "secure": ...}, or {"error": ...} if the
+request could not be compiled at all.
+'''
+
+import asyncio
+import json
+import os
+import signal
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import fields
+from driver import CompileOptions, CompileResult, compile_captured
+from lib.ast import SourceFile
+from lib.cache import CompileCache
+from lib.utils import DIAGNOSTICS
+
+DEFAULT_TIMEOUT = 30.0
+# how long after its timeout a worker gets to answer before the request fails anyway
+TIMEOUT_GRACE = 5.0
+# entries of the compile cache each worker keeps in memory
+MEMORY_CACHE_BYTES = 16 * 1024 * 1024
+# longest request line the daemon reads, sources included
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+# options a request can set
+REQUEST_OPTIONS = {f.name for f in fields(CompileOptions)} - {'emit_ast', 'load_ast'}
+
+class CompileTimeout(BaseException):
+  '''Raised in a worker when a request runs out of time. Not an Exception,
+  so that the compile does not report it as a crash.'''
+
+# the worker's cache, kept across the requests it runs
+_cache: CompileCache|None = None
+
+def _init_worker(cache: CompileCache|None):
+  global _cache
+  _cache = cache
+  # ctrl-c is for the daemon, which shuts the workers down itself
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _on_alarm(signum, frame):
+  raise CompileTimeout()
+
+def _compile(name: str, text: str, options: CompileOptions, timeout: float) -> CompileResult|None:
+  '''Run in a worker: compile `text`, or give up after `timeout` seconds and
+  return None.'''
+  if _cache is not None:
+    _cache.stored = False
+  signal.signal(signal.SIGALRM, _on_alarm)
+  signal.setitimer(signal.ITIMER_REAL, timeout)
+  try:
+    return compile_captured(SourceFile(text, name), options, _cache)
+  except CompileTimeout:
+    # drop whatever the compile left behind
+    DIAGNOSTICS.reset()
+    return None
+  finally:
+    signal.setitimer(signal.ITIMER_REAL, 0)
+
+def _read(path: str) -> str:
+  with open(path) as fp:
+    return fp.read()
+
+class Server:
+  def __init__(self, path: str, jobs: int|None, timeout: float, cache: CompileCache|None):
+    self.path = path
+    self.jobs = jobs or os.cpu_count() or 1
+    self.timeout = timeout
+    self.cache = cache
+    self.workers = None
+    self.stopped = None
+    # whether workers added to the cache, and whether it is being evicted
+    self.stored = False
+    self.evicting = False
+
+  async def run(self):
+    self.remove_stale_socket()
+    self.stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+      loop.add_signal_handler(signum, self.stopped.set)
+    with ProcessPoolExecutor(self.jobs, initializer=_init_worker,
+                             initargs=(self.cache,)) as self.workers:
+      server = await asyncio.start_unix_server(self.handle, self.path,
+                                               limit=MAX_REQUEST_BYTES)
+      try:
+        async with server:
+          await self.stopped.wait()
+      finally:
+        if os.path.exists(self.path):
+          os.remove(self.path)
+    if self.cache is not None and self.stored:
+      self.cache.evict()
+
+  def remove_stale_socket(self):
+    if not os.path.exists(self.path):
+      return
+    try:
+      with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(self.path)
+    except OSError:
+      # nothing is listening there anymore
+      os.remove(self.path)
+    else:
+      raise RuntimeError(f'a daemon is already listening on {self.path}')
+
+  async def handle(self, reader, writer):
+    try:
+      while True:
+        try:
+          line = await reader.readline()
+        except ValueError:
+          # the rest of the stream cannot be told apart from this request
+          await self.send(writer, {'error': f'request over {MAX_REQUEST_BYTES} bytes'})
+          break
+        if not line:
+          break
+        try:
+          request = json.loads(line)
+          response = await self.respond(request)
+        except (ValueError, TypeError, AttributeError, KeyError) as e:
+          response = {'error': f'bad request: {e}'}
+        await self.send(writer, response)
+    except ConnectionError:
+      pass
+    finally:
+      writer.close()
+
+  async def send(self, writer, response: dict):
+    writer.write(json.dumps(response).encode() + b'\n')
+    await writer.drain()
+
+  async def respond(self, request: dict) -> dict:
+    if request.get('stop'):
+      self.stopped.set()
+      return {'stopped': True}
+    options = request.get('options', {})
+    unknown = set(options) - REQUEST_OPTIONS
+    if unknown:
+      return {'error': f'unknown options: {", ".join(sorted(unknown))}'}
+    options = CompileOptions(**options)
+    timeout = min(float(request.get('timeout', self.timeout)), self.timeout)
+
+    if 'source' in request:
+      name, text = request.get('name', '<input>'), request['source']
+    else:
+      name = request['path']
+      try:
+        text = await asyncio.to_thread(_read, name)
+      except (OSError, UnicodeDecodeError) as e:
+        return {'error': f'cannot read {name}: {e}'}
+
+    loop = asyncio.get_running_loop()
+    job = loop.run_in_executor(self.workers, _compile, name, text, options, timeout)
+    try:
+      result = await asyncio.wait_for(job, timeout + TIMEOUT_GRACE)
+    except asyncio.TimeoutError:
+      result = None
+    if result is None:
+      return {'error': f'timed out after {timeout:g} seconds'}
+    if result.stored:
+      self.stored = True
+      if not self.evicting:
+        self.evicting = True
+        loop.create_task(self.evict())
+    return {'output': result.output, 'code': result.code, 'secure': result.secure}
+
+  async def evict(self):
+    try:
+      await asyncio.to_thread(self.cache.evict)
+    finally:
+      self.evicting = False
+
+def serve(path: str, jobs: int|None = None, timeout: float = DEFAULT_TIMEOUT,
+          cache: CompileCache|None = None):
+  '''Run the daemon on socket `path` until it is stopped. Give `cache` some
+  `memory_bytes` (such as MEMORY_CACHE_BYTES) to keep entries in memory.'''
+  asyncio.run(Server(path, jobs, timeout, cache).run())
@@ -1,73 +1,111 @@
 from lib.ast import *
 from lib.utils import *
-from traverse import map_tree
+from passes import Pass, descend
 
-def symbolize(node: AstNode, symtab: SymTab):
+symbolize = Pass('symbolize')
+
+@symbolize.on(File)
+def symbolize_file(pass_, node: File, symtab: SymTab|None = None):
+  return descend(pass_, node, node.symtab)
+
+@symbolize.on(EId)
+def symbolize_eid(pass_, node: EId, symtab: SymTab):
   match node:
     case EId(span, type, sec, name, _):
       sym = symtab.lookup(name)
       if sym is None:
         report_error('use of undefined variable', span)
       return EId(span, type, sec, name, sym)
+
+@symbolize.on(FnParam)
+def symbolize_fnparam(pass_, node: FnParam, symtab: SymTab):
+  match node:
     case FnParam(span, type, name, _):
-      sym = symtab.lookup(name)
+      sym = symtab.lookup_local(name)
       if sym is not None:
         report_error_cont(f'redefinition of parameter {name}', span)
-        report_note('previously defined here', sym.origin)
+        report_error_note('previously defined here', sym.origin)
         exit(1)
       sym = Symbol(name, type, SecLabel.INVALID, span)
       symtab.register(name, sym)
       return FnParam(span, type, name, sym)
-    case SScope(span, stmts, sec, symtab_):
-      symtab_.parent = symtab
-      nstmts = [symbolize(stmt, symtab_) for stmt in stmts]
-      return SScope(span, nstmts, sec, symtab_)
+
+@symbolize.on(SScope)
+def symbolize_sscope(pass_, node: SScope, symtab: SymTab):
+  match node:
+    case SScope(span, stmts, sec):
+      symtab.enter()
+      nstmts = []
+      for stmt in stmts:
+        nstmts.append((yield pass_.step(stmt, symtab)))
+      symtab.exit()
+      return SScope(span, nstmts, sec)
+
+@symbolize.on(SGlobal)
+def symbolize_sglobal(pass_, node: SGlobal, symtab: SymTab):
+  match node:
     case SGlobal(span, type, EId(name=name) as expr, origsec):
       sym = symtab.lookup(name)
       if sym is not None:
         report_error_cont(f'redefinition of {name}', span)
-        report_note('previously defined here', sym.origin)
+        report_error_note('previously defined here', sym.origin)
         exit(1)
-      symtab.register(name, Symbol(name, TUnresolved(), origsec, span))
-      nexpr = symbolize(expr, symtab)
+      symtab.register(name, Symbol(name, TUnresolved(), origsec, span, symtab.allocate()))
+      nexpr = pass_(expr, symtab)
       return SGlobal(span, type, nexpr, origsec)
     case SGlobal(span, type, EArray(expr=EId(name=name), index=EInt() as length) as expr, origsec):
       sym = symtab.lookup(name)
       if sym is not None:
         report_error_cont(f'redefinition of {name}', span)
-        report_note('previously defined here', sym.origin)
+        report_error_note('previously defined here', sym.origin)
         exit(1)
-      symtab.register(name, Symbol(name, TUnresolved(), origsec, span))
-      nexpr = symbolize(expr, symtab)
+      symtab.register(name, Symbol(name, TUnresolved(), origsec, span, symtab.allocate()))
+      nexpr = pass_(expr, symtab)
       return SGlobal(span, type, nexpr, origsec)
     case SGlobal(_, _, EArray(index=index)):
       report_error('can only define arrays with integer literals as size', index.span)
+    case _:
+      return descend(pass_, node, symtab)
+
+@symbolize.on(SVarDef)
+def symbolize_svardef(pass_, node: SVarDef, symtab: SymTab):
+  match node:
     case SVarDef(span, (EId(name=name) | EArray(expr=EId(name=name))) as lhs, rhs):
-      nrhs = symbolize(rhs, symtab)
+      nrhs = pass_(rhs, symtab)
       sym = symtab.lookup(name)
       if sym is not None:
         report_error_cont(f'redefinition of {name}', span)
-        report_note('previously defined here', sym.origin)
+        report_error_note('previously defined here', sym.origin)
         exit(1)
-      symtab.register(name, Symbol(name, TUnresolved(), SecLabel.INVALID, span))
-      nlhs = symbolize(lhs, symtab)
+      symtab.register(name, Symbol(name, TUnresolved(), SecLabel.INVALID, span,
+                                   symtab.allocate()))
+      nlhs = pass_(lhs, symtab)
       return SVarDef(span, nlhs, nrhs)
-    case SFnDef(span, EId(_, _, _, name, _) as lhs, params, retype,
-                SScope(_, _, _, symtab_) as body):
+    case _:
+      return descend(pass_, node, symtab)
+
+@symbolize.on(SFnDef)
+def symbolize_sfndef(pass_, node: SFnDef, symtab: SymTab):
+  match node:
+    case SFnDef(span, EId(_, _, _, name, _) as lhs, params, retype, SScope() as body):
       sym = symtab.lookup(name)
       if sym is not None:
         report_error_cont(f'redefinition of {name}', span)
-        report_note('previously defined here', sym.origin)
+        report_error_note('previously defined here', sym.origin)
         exit(1)
       # register function
       symtab.register(name, Symbol(name, TUnresolved(), SecLabel.INVALID, span))
-      nlhs = symbolize(lhs, symtab)
-      # register parameters
-      # shadowing is allowed at this point, since symtab_
-      # does not have a parent just yet
-      nparams = [symbolize(param, symtab_) for param in params]
+      nlhs = pass_(lhs, symtab)
+      # register parameters in a scope around the body, where they may
+      # shadow names from outside the function
+      symtab.enter()
+      nparams = [pass_(param, symtab) for param in params]
+      slot = symtab.allocate(len(nparams))
+      for idx, param in enumerate(nparams):
+        param.sym.slot = slot + idx
       # finally, symbolize the body
-      nbody = symbolize(body, symtab)
+      nbody = yield pass_.step(body, symtab)
+      symtab.exit()
       return SFnDef(span, nlhs, nparams, retype, nbody)
     case _:
-      return map_tree(symbolize, node, symtab)
+      return (yield descend(pass_, node, symtab))
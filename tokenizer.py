@@ -1,5 +1,7 @@
+import re
 import string
-from lib.ast import Span, Token, FAKE_SPAN
+from array import array
+from lib.ast import SourceFile, Span, Token, FAKE_SPAN, TOKEN_EOF
 from lib.utils import report_error
 
 WHITESPACE = string.whitespace
@@ -24,6 +26,7 @@ KEYWORDS = [
   'catch',
   'throw',
 
+  'lattice',
   'in',
   'out',
 
@@ -36,17 +39,120 @@ KEYWORDS = [
   'int',
   'bool',
 ]
+KEYWORD_SET = frozenset(KEYWORDS)
+OPERATORS = [
+  ':=', '==', '<<', '<=', '>>', '>=', '||', '&&', '!=',
+  ':', '=', '<', '>', '|', '&', '!', '/',
+  *EASY_MAP,
+]
+# token types are stored as small ints in TokenBuffer, this is the id -> type table
+TOKEN_TYPES = list(dict.fromkeys([
+  'eof', 'identifier',
+  'integer', 'integer_0', 'integer_hex', 'integer_bin', 'integer_oct',
+  *KEYWORDS,
+  *OPERATORS,
+]))
+TOKEN_IDS = {type: id for id, type in enumerate(TOKEN_TYPES)}
+TOKEN_ID_IDENTIFIER = TOKEN_IDS['identifier']
+KEYWORD_IDS = {keyword: TOKEN_IDS[keyword] for keyword in KEYWORDS}
+
+# master pattern used by RegexTokenizer: skip whitespace and comments, then
+# match exactly one token; alternatives are tried in order
+TOKEN_RE = re.compile(r'''
+  (?>(?:[ \t\n\r\x0b\x0c]+|//[^\n]*)*)
+  (?:
+     (?P<identifier>[A-Za-z_][A-Za-z0-9_]*)
+    |(?P<integer_hex>0x[0-9A-F]*)
+    |(?P<integer_bin>0b[01]*)
+    |(?P<integer_oct>0o[0-7]*)
+    |(?P<integer_0>0(?=[0-9]))
+    |(?P<integer>0|[1-9][0-9]*)
+    |(?P<dual>:=|==|<<|<=|>>|>=|\|\||&&|!=)
+    |(?P<single>[:=<>|&!/])
+    |(?P<easy>[-+*%^~()\[\]{}:;,])
+    |(?P<unhandled>.)
+    |(?P<eof>\Z)
+  )
+''', re.VERBOSE | re.DOTALL)
+TOKEN_GROUPS = [None] + sorted(TOKEN_RE.groupindex, key=TOKEN_RE.groupindex.get)
+EMPTY_PREFIX_ERRORS = {
+  'integer_hex': 'empty hex literal',
+  'integer_bin': 'empty binary literal',
+  'integer_oct': 'empty octal literal',
+}
+
+class TokenBuffer:
+  '''Packed token stream, stored as parallel arrays of type ids and offsets.
+
+  Token values, spans and line/column numbers are derived from the offsets
+  only when somebody asks for them.'''
+  def __init__(self, source: SourceFile):
+    self.source = source
+    self.src = source.text
+    self.types = array('B')
+    self.starts = array('i')
+    self.ends = array('i')
+
+  def __len__(self) -> int:
+    return len(self.types)
+
+  def append(self, type: str, start: int, end: int) -> int:
+    self.types.append(TOKEN_IDS[type])
+    self.starts.append(start)
+    self.ends.append(end)
+    return len(self.types) - 1
+
+  def type(self, idx: int) -> str:
+    if idx < len(self.types):
+      return TOKEN_TYPES[self.types[idx]]
+    else:
+      return 'eof'
+
+  def value(self, idx: int) -> str:
+    if idx < len(self.types):
+      return self.src[self.starts[idx]:self.ends[idx]]
+    else:
+      return TOKEN_EOF.value
+
+  def span(self, idx: int) -> Span:
+    if idx < len(self.types):
+      return self.make_span(self.starts[idx], self.ends[idx])
+    else:
+      return FAKE_SPAN
+
+  def make_span(self, start: int, end: int) -> Span:
+    source = self.source
+    lnum = source.lnum_of(start)
+    lstart = source.line_starts[lnum]
+    return Span(start, end, lnum, start - lstart, end - lstart, source)
+
+  def token(self, idx: int) -> Token:
+    if idx < len(self.types):
+      return Token(self.type(idx), self.value(idx), self.span(idx))
+    else:
+      return TOKEN_EOF
+
+  def tokens(self) -> list[Token]:
+    '''Materialize the whole stream as `Token` objects, e.g. for printing.'''
+    return [self.token(idx) for idx in range(len(self))]
+
+def as_source(src: str|SourceFile) -> SourceFile:
+  return src if isinstance(src, SourceFile) else SourceFile(src)
 
 class Tokenizer:
-  def __init__(self, src):
-    self.src = src
+  def __init__(self, src: str|SourceFile):
+    self.source = as_source(src)
+    self.src = self.source.text
     self.idx = 0
     self.state = 'default'
-    self.tokens = []
+    self.buffer = TokenBuffer(self.source)
     self.lnum = 0
     self.cnum = 0
     self.tok_start = 0
-    self.tok_cstart = 0
+
+  @property
+  def tokens(self) -> list[Token]:
+    return self.buffer.tokens()
 
   def getc(self) -> str|None:
     if self.idx < len(self.src):
@@ -68,23 +174,17 @@ class Tokenizer:
 
   def token_start(self, state: str):
     self.tok_start = self.idx
-    self.tok_cstart = self.cnum
     self.state = state
 
-  def token_end(self, type: str|None = None) -> Token:
+  def token_end(self, type: str|None = None) -> int:
     if type is None:
       type = self.state
-    span = Span(self.tok_start, self.idx, self.lnum, self.tok_cstart, self.cnum, self.src)
-    token = Token(type, self.src[self.tok_start:self.idx], span)
-    self.tokens.append(token)
+    tok = self.buffer.append(type, self.tok_start, self.idx)
     self.state = 'default'
-    return token
+    return tok
 
-  def token_onec(self, type) -> Token:
-    span = Span(self.idx, self.idx+1, self.lnum, self.cnum, self.cnum+1, self.src)
-    token = Token(type, self.src[self.idx:self.idx+1], span)
-    self.tokens.append(token)
-    return token
+  def token_onec(self, type) -> int:
+    return self.buffer.append(type, self.idx, self.idx+1)
   
   def tokenize(self):
     self.state = 'default'
@@ -132,8 +232,8 @@ class Tokenizer:
           self.token_onec(c)
           self.advance()
         else:
-          tok = self.token_onec(c)
-          report_error('unhandled character in tokenize', tok.span)
+          span = Span(self.idx, self.idx+1, self.lnum, self.cnum, self.cnum+1, self.source)
+          report_error('unhandled character in tokenize', span)
       elif self.state == 'identifier':
         if c in ID_BODY:
           self.advance()
@@ -156,7 +256,7 @@ class Tokenizer:
         elif c in DIGITS:
           tok = self.token_end()
           report_error('leading zeroes with no prefix are not allowed,' +
-            ' use 0o for octal', tok.span)
+            ' use 0o for octal', self.buffer.span(tok))
         else:
           # just a single zero
           self.token_end('integer')
@@ -165,7 +265,7 @@ class Tokenizer:
           self.advance()
         elif self.value() == '0x':
           tok = self.token_end()
-          report_error('empty hex literal', tok.span)
+          report_error('empty hex literal', self.buffer.span(tok))
         else:
           self.token_end()
       elif self.state == 'integer_bin':
@@ -173,7 +273,7 @@ class Tokenizer:
           self.advance()
         elif self.value() == '0b':
           tok = self.token_end()
-          report_error('empty binary literal', tok.span)
+          report_error('empty binary literal', self.buffer.span(tok))
         else:
           self.token_end()
       elif self.state == 'integer_oct':
@@ -181,7 +281,7 @@ class Tokenizer:
           self.advance()
         elif self.value() == '0o':
           tok = self.token_end()
-          report_error('empty octal literal', tok.span)
+          report_error('empty octal literal', self.buffer.span(tok))
         else:
           self.token_end()
       elif self.state == 'integer':
@@ -255,3 +355,72 @@ class Tokenizer:
           self.advance()
       else:
         report_error(f'invalid state in tokenize: {self.state}', FAKE_SPAN)
+
+class RegexTokenizer:
+  '''Drop-in replacement for `Tokenizer` driven by a single compiled pattern.
+
+  Produces the same token stream and diagnostics as the state machine.'''
+  def __init__(self, src: str|SourceFile):
+    self.source = as_source(src)
+    self.src = self.source.text
+    self.buffer = TokenBuffer(self.source)
+
+  @property
+  def tokens(self) -> list[Token]:
+    return self.buffer.tokens()
+
+  def tokenize(self, begin: int = 0, stop: int|None = None) -> int:
+    '''Tokenize from offset `begin`, which must not be inside a token or a
+    comment, up to the first token that starts at or after `stop`. Returns
+    where that token starts, the length of the source if there is none.'''
+    # NOTE: the state machine only emits identifiers, integers and the
+    # single-character operators once it sees the next character, so one of
+    # those that runs into the end of the source is dropped here as well
+    src = self.src
+    srclen = len(src)
+    if stop is None:
+      stop = srclen + 1
+    buffer = self.buffer
+    types = buffer.types.append
+    starts = buffer.starts.append
+    ends = buffer.ends.append
+    for m in TOKEN_RE.finditer(src, begin):
+      kind = TOKEN_GROUPS[m.lastindex]
+      start, end = m.span(kind)
+      if start >= stop and kind != 'eof':
+        return start
+      if kind == 'identifier':
+        if end == srclen:
+          break
+        type = KEYWORD_IDS.get(src[start:end], TOKEN_ID_IDENTIFIER)
+      elif kind == 'dual' or kind == 'easy':
+        type = TOKEN_IDS[src[start:end]]
+      elif kind == 'single':
+        if end == srclen:
+          break
+        type = TOKEN_IDS[src[start:end]]
+      elif kind == 'unhandled':
+        report_error('unhandled character in tokenize', buffer.make_span(start, end))
+      elif kind == 'eof' or end == srclen:
+        # the remaining kinds are still pending when they hit the end
+        break
+      elif kind == 'integer':
+        type = TOKEN_IDS[kind]
+      elif kind in EMPTY_PREFIX_ERRORS:
+        type = TOKEN_IDS[kind]
+        if end - start == 2:
+          tok = buffer.append(kind, start, end)
+          report_error(EMPTY_PREFIX_ERRORS[kind], buffer.span(tok))
+      elif kind == 'integer_0':
+        tok = buffer.append(kind, start, end)
+        report_error('leading zeroes with no prefix are not allowed,' +
+          ' use 0o for octal', buffer.span(tok))
+      types(type)
+      starts(start)
+      ends(end)
+    return srclen
+
+TOKENIZERS = {
+  'regex': RegexTokenizer,
+  'fsm': Tokenizer,
+}
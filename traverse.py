@@ -6,122 +6,188 @@ def handler(arg1, arg2, node: AstNode):
     ...
     case _:
       return map_tree(handler, node, arg1, arg2)
+
+# example usage of iter_tree, for read-only passes that look at every node:
+for node in iter_tree(root):
+  match node:
+    case SReturn(): ...
 '''
 
+from dataclasses import fields
+from operator import is_
 from lib.ast import *
 from lib.utils import *
-from functools import partial
+
+# kinds of child fields
+CHILD = 0     # a single node
+CHILDREN = 1  # a list of nodes
+OPTIONAL = 2  # a single node or None
+
+# node class -> (constructor field names, child fields in visiting order)
+TRAVERSAL: dict[type, tuple[tuple[str, ...], tuple[tuple[str, int], ...]]] = {}
+
+def _register(cls: type, *children: tuple[str, int]):
+  TRAVERSAL[cls] = (tuple(f.name for f in fields(cls) if f.init), children)
+
+_register(EId)
+_register(EInt)
+_register(EBool)
+_register(FnParam)
+_register(SThrow)
+_register(EArray, ('expr', CHILD), ('index', CHILD))
+_register(EArrayLiteral, ('values', CHILDREN))
+_register(EUnOp, ('expr', CHILD))
+_register(EBinOp, ('lhs', CHILD), ('rhs', CHILD))
+_register(ECall, ('name', CHILD), ('params', CHILDREN))
+_register(EDeclassify, ('expr', CHILD))
+_register(SScope, ('stmts', CHILDREN))
+_register(SGlobal, ('expr', CHILD))
+_register(SVarDef, ('lhs', CHILD), ('rhs', CHILD))
+_register(SFnDef, ('name', CHILD), ('params', CHILDREN), ('body', CHILD))
+_register(SAssign, ('lhs', CHILD), ('rhs', CHILD))
+_register(SIf, ('clause', CHILD), ('body', CHILD), ('else_stmt', OPTIONAL))
+_register(SWhile, ('clause', CHILD), ('body', CHILD))
+_register(STryCatch, ('tryBody', CHILD), ('catchBody', CHILD))
+_register(SDebug, ('expr', CHILD))
+_register(SReturn, ('expr', CHILD))
+_register(File, ('inputs', CHILDREN), ('outputs', CHILDREN), ('stmts', CHILDREN))
+
+def _traversal(node: AstNode):
+  traversal = TRAVERSAL.get(type(node))
+  if traversal is None:
+    report_error('unhandled node in traverse', node.span)
+  return traversal
 
 def map_tree(f, node: AstNode, *args):
-  '''Build a new tree by mapping `f` over the each node.'''
-  f2 = lambda acc, n: (acc, f(n, *args))
-  return _traverse_tree(f2, None, node)[1]
+  '''Build a new tree by mapping `f` over the each child of `node`.
+
+  Nodes whose children all come back unchanged are returned as they are,
+  so the result shares every untouched subtree with the input.
+
+  `f` may also return a generator for a child, see `trampoline`. Those of
+  nodes that nest are run on an explicit stack, so `f` can work its way
+  down arbitrarily deep statements and expressions without recursing.'''
+  return trampoline(map_steps(f, node, *args))
+
+# nodes whose children nest arbitrarily deep: statements with a body, and
+# expressions with operands
+NESTING = {File, SScope, SIf, SWhile, STryCatch, SFnDef,
+           EArray, EArrayLiteral, EUnOp, EBinOp, ECall, EDeclassify}
+
+def map_steps(f, node: AstNode, *args):
+  '''`map_tree` as a step for `trampoline`: a generator that yields the
+  children `f` returns generators for and returns the new node, for nodes
+  that nest, and the new node right away for all others.'''
+  names, children = _traversal(node)
+  if type(node) in NESTING:
+    return _map_steps(f, node, names, children, args)
+  changed = None
+  for name, kind in children:
+    child = getattr(node, name)
+    if kind == CHILD:
+      nchild = trampoline(f(child, *args))
+    elif kind == CHILDREN:
+      nchild = [trampoline(f(c, *args)) for c in child]
+      if all(map(is_, nchild, child)):
+        nchild = child
+    elif child is not None:
+      nchild = trampoline(f(child, *args))
+    else:
+      continue
+    if nchild is not child:
+      if changed is None:
+        changed = {}
+      changed[name] = nchild
+  return _rebuild(node, names, changed)
+
+def _map_steps(f, node: AstNode, names, children, args):
+  changed = None
+  for name, kind in children:
+    child = getattr(node, name)
+    if kind == CHILD:
+      nchild = f(child, *args)
+      if type(nchild) is GeneratorType:
+        nchild = yield nchild
+    elif kind == CHILDREN:
+      nchild = []
+      for c in child:
+        nc = f(c, *args)
+        if type(nc) is GeneratorType:
+          nc = yield nc
+        nchild.append(nc)
+      if all(map(is_, nchild, child)):
+        nchild = child
+    elif child is not None:
+      nchild = f(child, *args)
+      if type(nchild) is GeneratorType:
+        nchild = yield nchild
+    else:
+      continue
+    if nchild is not child:
+      if changed is None:
+        changed = {}
+      changed[name] = nchild
+  return _rebuild(node, names, changed)
+
+def _rebuild(node: AstNode, names: tuple[str, ...], changed: dict|None) -> AstNode:
+  if changed is None:
+    return node
+  return type(node)(*[changed[name] if name in changed else getattr(node, name)
+                      for name in names])
 
 def walk_tree(f, node: AstNode, *args):
-  '''Walk a tree and map `f` over each node. Does not build a new tree.'''
-  f2 = lambda acc, n: (acc, (f(n, *args), n)[1])
-  _traverse_tree(f2, None, node)
+  '''Walk a tree and map `f` over each child of `node`. Does not build a new tree.'''
+  for name, kind in _traversal(node)[1]:
+    child = getattr(node, name)
+    if kind == CHILD:
+      f(child, *args)
+    elif kind == CHILDREN:
+      for c in child:
+        f(c, *args)
+    elif child is not None:
+      f(child, *args)
 
 def traverse_tree(f, acc, node: AstNode, *args):
   '''Traverse a tree, updating `acc` and building a new tree.'''
-  f2 = lambda acc_, n: f(acc_, n, *args)
-  return _traverse_tree(f2, acc, node)
+  def f2(n: AstNode):
+    nonlocal acc
+    acc, nn = f(acc, n, *args)
+    return nn
+  nnode = map_tree(f2, node)
+  return (acc, nnode)
 
 def fold_tree(f, acc, node: AstNode, *args):
-  '''Map `f` over the each node and collect the results in `acc`.'''
-  f2 = lambda acc_, n: (f(acc_, n, *args), n)
-  return traverse_tree(f2, acc, node, *args)[0]
+  '''Map `f` over the each child of `node` and collect the results in `acc`.'''
+  for name, kind in _traversal(node)[1]:
+    child = getattr(node, name)
+    if kind == CHILD:
+      acc = f(acc, child, *args)
+    elif kind == CHILDREN:
+      for c in child:
+        acc = f(acc, c, *args)
+    elif child is not None:
+      acc = f(acc, child, *args)
+  return acc
 
-def _traverse_tree(f, acc, node: AstNode):
-  match node:
-    case EId() | EInt() | EBool() | FnParam():
-      return (acc, node)
-    case EArray(span, type, sec, expr, index):
-      acc, nexpr = f(acc, expr)
-      acc, nindex = f(acc, index)
-      return (acc, EArray(span, type, sec, nexpr, nindex))
-    case EArrayLiteral(span, type, sec, values):
-      nvalues = []
-      for expr in values: 
-        acc, nexpr = f(acc, expr)
-        nvalues.append(nexpr)
-      return (acc, EArrayLiteral(span, type, sec, nvalues))
-    case EUnOp(span, type, sec, op, expr):
-      acc, nexpr = f(acc, expr)
-      return (acc, EUnOp(span, type, sec, op, nexpr))
-    case EBinOp(span, type, sec, op, lhs, rhs):
-      acc, nlhs = f(acc, lhs)
-      acc, nrhs = f(acc, rhs)
-      return (acc, EBinOp(span, type, sec, op, nlhs, nrhs))
-    case ECall(span, type, sec, name, params):
-      acc, nname = f(acc, name)
-      nparams = []
-      for param in params:
-        acc, nparam = f(acc, param)
-        nparams.append(nparam)
-      return (acc, ECall(span, type, sec, nname, nparams))
-    case SScope(span, stmts, sec, symtab):
-      nstmts = []
-      for stmt in stmts:
-        acc, nstmt = f(acc, stmt)
-        nstmts.append(nstmt)
-      return (acc, SScope(span, nstmts, sec, symtab))
-    case SGlobal(span, type, expr, origsec):
-      acc, nexpr = f(acc, expr)
-      return (acc, SGlobal(span, type, nexpr, origsec))
-    case SVarDef(span, lhs, rhs):
-      acc, nlhs = f(acc, lhs)
-      acc, nrhs = f(acc, rhs)
-      return (acc, SVarDef(span, nlhs, nrhs))
-    case SFnDef(span, name, args, retype, body):
-      acc, nname = f(acc, name)
-      nargs = []
-      for arg in args:
-        acc, narg = f(acc, arg)
-        nargs.append(narg)
-      acc, nbody = f(acc, body)
-      return (acc, SFnDef(span, nname, nargs, retype, nbody))
-    case SAssign(span, lhs, rhs):
-      acc, nlhs = f(acc, lhs)
-      acc, nrhs = f(acc, rhs)
-      return (acc, SAssign(span, nlhs, nrhs))
-    case SIf(span, clause, body, else_stmt):
-      acc, nclause = f(acc, clause)
-      acc, nbody = f(acc, body)
-      acc, nelse_stmt = f(acc, else_stmt) if else_stmt else (acc, None)
-      return (acc, SIf(span, nclause, nbody, nelse_stmt))
-    case SWhile(span, clause, body):
-      acc, nclause = f(acc, clause)
-      acc, nbody = f(acc, body)
-      return (acc, SWhile(span, nclause, nbody))
-    case STryCatch(span, try_body, catch_body):
-      acc, ntry = f(acc, try_body)
-      acc, ncatch = f(acc, catch_body)
-      return (acc, STryCatch(span, ntry, ncatch))
-    case SThrow():
-      return (acc, node)
-    case SDebug(span, expr):
-      acc, nexpr = f(acc, expr)
-      return (acc, SDebug(span, nexpr))
-    case SReturn(span, sec, expr):
-      acc, nexpr = f(acc, expr)
-      return (acc, SReturn(span, sec, nexpr))
-    case EDeclassify(span, type, sec, expr):
-      acc, nexpr = f(acc, expr)
-      return (acc, EDeclassify(span, type, sec, nexpr))
-    case File(span, stmts, symtab, ins, outs):
-      nstmts = []
-      nins = []
-      nouts = []
-      for in_ in ins:
-        acc, nin = f(acc, in_)
-        nins.append(nin)
-      for out in outs:
-        acc, nout = f(acc, out)
-        nouts.append(nout)
-      for stmt in stmts:
-        acc, nstmt = f(acc, stmt)
-        nstmts.append(nstmt)
-      return (acc, File(span, nstmts, symtab, nins, nouts))
-    case _:
-      report_error('unhandled node in traverse', node.span)
+def iter_tree(node: AstNode):
+  '''Yield `node` and all of its descendants in pre-order.
+
+  Uses an explicit stack, so it works on arbitrarily deep trees.'''
+  stack = [node]
+  while stack:
+    node = stack.pop()
+    yield node
+    mark = len(stack)
+    for name, kind in _traversal(node)[1]:
+      child = getattr(node, name)
+      if kind == CHILD:
+        stack.append(child)
+      elif kind == CHILDREN:
+        stack.extend(child)
+      elif child is not None:
+        stack.append(child)
+    # children were pushed in visiting order, pop them in that order too
+    stack[mark:] = reversed(stack[mark:])
+
+def count_nodes(node: AstNode) -> int:
+  return sum(1 for _ in iter_tree(node))
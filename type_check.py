@@ -1,8 +1,8 @@
 from lib.ast import *
 from lib.types import *
 from lib.utils import report_error, report_error_cont, exit
-from traverse import map_tree, walk_tree
-from debug import debug_ast
+from traverse import iter_tree
+from passes import Pass, descend
 from parser import BINOPS, UNOPS, PRECTABLE_BOOLEAN, PRECTABLE_COMPARISON
 
 def type_eunop(op: str, span: Span, expr: Expr) -> Type:
@@ -36,7 +36,18 @@ def type_ebinop(op: str, span: Span, lhs: Expr, rhs: Expr) -> Type:
       report_error_cont('type mismatch', span)
       exit(1)
 
-def type_annotate(node: AstNode):
+type_annotate = Pass('type_annotate')
+
+@type_annotate.otherwise
+def type_annotate_unhandled(pass_, node: AstNode):
+  report_error('unhandled node in type annotate', node.span)
+
+type_annotate.on(EArray, EUnOp, EBinOp, EArrayLiteral, ECall)(descend)
+type_annotate.on(SScope, SAssign, SIf, SWhile, STryCatch, SThrow, SDebug, SReturn,
+                 EDeclassify, File)(descend)
+
+@type_annotate.on(EId, EInt, EBool)
+def type_annotate_leaf(pass_, node: Expr):
   match node:
     case EId(span, TUnresolved(), sec, name, sym):
       return EId(span, sym.type, sec, name, sym)
@@ -44,117 +55,174 @@ def type_annotate(node: AstNode):
       return EInt(span, TInt(), sec, v)
     case EBool(span, TUnresolved(), sec, v):
       return EBool(span, TBool(), sec, v)
-    case FnParam(type=type, sym=sym):
-      sym.type = type
-      return node
-    case EArray() | EUnOp() | EBinOp() | EArrayLiteral() | ECall():
-      return map_tree(type_annotate, node)
+    case _:
+      return type_annotate_unhandled(pass_, node)
+
+@type_annotate.on(FnParam)
+def type_annotate_fnparam(pass_, node: FnParam):
+  node.sym.type = node.type
+  return node
 
+@type_annotate.on(SVarDef)
+def type_annotate_svardef(pass_, node: SVarDef):
+  match node:
     case SVarDef(span, (EId(sym=sym) | EArray(expr=EId(sym=sym))) as lhs, rhs):
-      nrhs = type_annotate(rhs)
+      nrhs = pass_(rhs)
       # type inference
       sym.type = nrhs.type
-      nlhs = type_annotate(lhs)
+      nlhs = pass_(lhs)
       return SVarDef(span, nlhs, nrhs)
+    case _:
+      return type_annotate_unhandled(pass_, node)
+
+@type_annotate.on(SFnDef)
+def type_annotate_sfndef(pass_, node: SFnDef):
+  match node:
     case SFnDef(span, EId(_, _, _, _, sym) as lhs, params, retype, body):
-      nparams = [type_annotate(param) for param in params]
+      nparams = [pass_(param) for param in params]
       # functions don't have explicit type defined, create one
       tparams = [param.type for param in params]
       sym.type = TFn(retype, tparams, None)
-      nlhs = type_annotate(lhs)
+      nlhs = pass_(lhs)
       # annotate body after connecting type to symbol, to handle recursive calls
-      nbody = type_annotate(body)
+      nbody = yield pass_.step(body)
       nnode = SFnDef(span, nlhs, nparams, retype, nbody)
       sym.type.sfndef = nnode
       return nnode
-    case SScope() | SAssign() | SIf() | SWhile() | STryCatch() | SThrow() | SDebug() | SReturn() | EDeclassify() | File():
-      return map_tree(type_annotate, node)
+    case _:
+      return type_annotate_unhandled(pass_, node)
+
+@type_annotate.on(SGlobal)
+def type_annotate_sglobal(pass_, node: SGlobal):
+  match node:
     case SGlobal(span, type, EId() as expr, origsec):
       expr.sym.type = type
-      nexpr = type_annotate(expr)
+      nexpr = pass_(expr)
       return SGlobal(span, type, nexpr, origsec)
     case SGlobal(span, type, EArray(expr=EId() as id, index=EInt(value=length)) as expr, origsec):
       id.sym.type = TArray(type, length)
-      nexpr = type_annotate(expr)
+      nexpr = pass_(expr)
       return SGlobal(span, type, nexpr, origsec)
     case _:
-      report_error('unhandled node in type annotate', node.span)
+      return type_annotate_unhandled(pass_, node)
 
 def type_check_return(node: AstNode, retype: Type):
-  match node:
-    case SReturn(span, _, expr):
-      if expr.type != retype:
-        report_error('type mismatch in return', span)
-    case _:
-      walk_tree(type_check_return, node, retype)
+  for node in iter_tree(node):
+    match node:
+      case SReturn(span, _, expr):
+        if expr.type != retype:
+          report_error('type mismatch in return', span)
+
+type_check = Pass('type_check')
 
-def type_check(node: AstNode):
+@type_check.otherwise
+def type_check_unhandled(pass_, node: AstNode):
+  report_error('unhandled node in type check', node.span)
+
+type_check.on(EInt, EBool, SScope, STryCatch, SThrow, SDebug, SReturn, SGlobal, File,
+              FnParam)(descend)
+
+@type_check.on(EId)
+def type_check_eid(pass_, node: EId):
   match node:
     case EId(span, TUnresolved(), sec, name, sym):
       # any identifiers not resolved in type-annot can be resolved now
       return EId(span, sym.type, sec, name, sym)
-    case EId():
-      return map_tree(type_check, node)
-    case EArray():
-      nnode =  map_tree(type_check, node)
-      nnode.type = nnode.expr.type.of
-      if not isinstance(nnode.index.type, TInt):
-        report_error('array index must be an int', nnode.index.span)
-      return nnode
-    case EArrayLiteral():
-      nnode = map_tree(type_check, node)
-      if not all(val.type == nnode.values[0].type for val in nnode.values):
-        report_error('values of different types in array literal', nnode.span)
-      nnode.type.of = nnode.values[0].type
-      return nnode
+    case _:
+      return descend(pass_, node)
+
+@type_check.on(EArray)
+def type_check_earray(pass_, node: EArray):
+  match node:
+    case EArray(span, _, sec, expr, index):
+      nexpr = yield pass_.step(expr)
+      nindex = yield pass_.step(index)
+      if not isinstance(nindex.type, TInt):
+        report_error('array index must be an int', nindex.span)
+      return EArray(span, nexpr.type.of, sec, nexpr, nindex)
+
+@type_check.on(EArrayLiteral)
+def type_check_earrayliteral(pass_, node: EArrayLiteral):
+  nnode = yield descend(pass_, node)
+  if not all(val.type == nnode.values[0].type for val in nnode.values):
+    report_error('values of different types in array literal', nnode.span)
+  nnode.type.of = nnode.values[0].type
+  return nnode
+
+@type_check.on(EUnOp)
+def type_check_eunop(pass_, node: EUnOp):
+  match node:
     case EUnOp(span, TUnresolved(), sec, op, expr):
-      nexpr = type_check(expr)
+      nexpr = yield pass_.step(expr)
       type = type_eunop(op, span, nexpr)
       return EUnOp(span, type, sec, op, nexpr)
+    case _:
+      return type_check_unhandled(pass_, node)
+
+@type_check.on(EBinOp)
+def type_check_ebinop(pass_, node: EBinOp):
+  match node:
     case EBinOp(span, TUnresolved(), sec, op, lhs, rhs):
-      nlhs = type_check(lhs)
-      nrhs = type_check(rhs)
+      nlhs = yield pass_.step(lhs)
+      nrhs = yield pass_.step(rhs)
       type = type_ebinop(op, span, nlhs, nrhs)
       return EBinOp(span, type, sec, op, nlhs, nrhs)
+    case _:
+      return type_check_unhandled(pass_, node)
+
+@type_check.on(ECall)
+def type_check_ecall(pass_, node: ECall):
+  match node:
     case ECall(span, TUnresolved(), sec, EId(_, _, _, name, sym) as lhs, params):
-      nnode = map_tree(type_check, node)
+      nlhs = pass_(lhs)
+      nparams = []
+      for param in params:
+        nparams.append((yield pass_.step(param)))
       if not isinstance(sym.type, TFn):
         report_error(f'{name} is not a function', span)
-      for idx, (ty, param) in enumerate(zip(sym.type.params, params)):
+      for idx, (ty, param) in enumerate(zip(sym.type.params, nparams)):
         if param.type != ty:
           report_error(f'function parameter #{idx+1} has invalid type', param.span)
       # propagate function return type to the ECall
-      nnode.type = sym.type.retype
-      return nnode
+      return ECall(span, sym.type.retype, sec, nlhs, nparams)
+    case _:
+      return type_check_unhandled(pass_, node)
+
+@type_check.on(EDeclassify)
+def type_check_edeclassify(pass_, node: EDeclassify):
+  match node:
     case EDeclassify(span, _, sec, expr):
-      nexpr = type_check(expr)
+      nexpr = yield pass_.step(expr)
       ntype = nexpr.type
       return EDeclassify(span, ntype, sec, nexpr)
-    case EId() | EInt() | EBool():
-      return map_tree(type_check, node)
 
-    case SAssign(span, _, _):
-      nnode = map_tree(type_check, node)
-      if nnode.lhs.type != nnode.rhs.type:
-        report_error('type mismatch in assignment', span)
-      return nnode
+@type_check.on(SAssign)
+def type_check_sassign(pass_, node: SAssign):
+  nnode = descend(pass_, node)
+  if nnode.lhs.type != nnode.rhs.type:
+    report_error('type mismatch in assignment', node.span)
+  return nnode
+
+@type_check.on(SVarDef)
+def type_check_svardef(pass_, node: SVarDef):
+  match node:
     case SVarDef(span, EArray(expr=EId(sym=sym), index=EInt() as index) as lhs, EId(sym=rsym) as rhs):
-      nrhs = type_check(rhs)
+      nrhs = pass_(rhs)
       # type inference
       if not isinstance(nrhs.type, TArray):
         report_error('type mismatch, expected array type', nrhs.span)
       sym.type = nrhs.type
-      nlhs = type_check(lhs)
+      nlhs = pass_(lhs)
       # guaranteed by type-checking
       assert(isinstance(rsym.type, TArray))
       if rsym.type.length != index.value:
         report_error('size mismatch between arrays', nrhs.span)
       return SVarDef(span, nlhs, nrhs)
     case SVarDef(span, (EId(sym=sym) | EArray(expr=EId(sym=sym))) as lhs, rhs):
-      nrhs = type_check(rhs)
+      nrhs = pass_(rhs)
       # type inference
       sym.type = nrhs.type
-      nlhs = type_check(lhs)
+      nlhs = pass_(lhs)
       match (nlhs, nrhs, nrhs.type):
         case (EId(), EId(), TArray()):
           # not allowed to define arrays without size specification
@@ -162,27 +230,37 @@ def type_check(node: AstNode):
         case _:
           pass
       return SVarDef(span, nlhs, nrhs)
+    case _:
+      return descend(pass_, node)
+
+@type_check.on(SFnDef)
+def type_check_sfndef(pass_, node: SFnDef):
+  match node:
     case SFnDef(span, name, params, retype, body):
-      nname = type_check(name)
-      nparams = list(map(type_check, params))
-      nbody = type_check(body)
+      nname = pass_(name)
+      nparams = [pass_(param) for param in params]
+      nbody = yield pass_.step(body)
       # make sure return statements have correct types
       type_check_return(nbody, retype)
       return SFnDef(span, nname, nparams, retype, body)
+
+@type_check.on(SIf)
+def type_check_sif(pass_, node: SIf):
+  match node:
     case SIf(span, clause, body, else_stmt):
-      nclause = type_check(clause)
+      nclause = pass_(clause)
       if not isinstance(nclause.type, TBool):
         report_error('if-statement clause should be a bool', span)
-      nbody = type_check(body)
-      nelse_stmt = type_check(else_stmt) if else_stmt else None
+      nbody = yield pass_.step(body)
+      nelse_stmt = (yield pass_.step(else_stmt)) if else_stmt else None
       return SIf(span, nclause, nbody, nelse_stmt)
+
+@type_check.on(SWhile)
+def type_check_swhile(pass_, node: SWhile):
+  match node:
     case SWhile(span, clause, body):
-      nclause = type_check(clause)
+      nclause = pass_(clause)
       if not isinstance(nclause.type, TBool):
         report_error('while-statement clause should be a bool', span)
-      nbody = type_check(body)
+      nbody = yield pass_.step(body)
       return SWhile(span, nclause, nbody)
-    case SScope() | SVarDef() |  STryCatch() | SThrow() | SDebug() | SReturn() | SGlobal() | File() | FnParam():
-      return map_tree(type_check, node)
-    case _:
-      report_error('unhandled node in type check', node.span)